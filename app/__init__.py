@@ -1,9 +1,10 @@
 from flask import Flask
-from neo4j import GraphDatabase
 import os
 from dotenv import load_dotenv
 from flask_login import LoginManager
 from app.models import User  # Import the User class
+from app.database import get_driver
+from app.instrumentation import instrumented
 
 # Load environment variables from .env file
 load_dotenv()
@@ -11,16 +12,8 @@ load_dotenv()
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
 
-# Neo4j connection setup
-uri = os.getenv("NEO4J_URI")
-username = os.getenv("NEO4J_USERNAME")
-password = os.getenv("NEO4J_PASSWORD")
-driver = GraphDatabase.driver(uri, auth=(username, password))
-
-@app.teardown_appcontext
-def close_driver(exception):
-    if driver:
-        driver.close()
+# Neo4j connections come from the process-wide driver in app/database.py, created on first
+# use and kept open across requests (it is closed when the process exits)
 
 # Setup Flask-Login
 login_manager = LoginManager()
@@ -28,8 +21,9 @@ login_manager.init_app(app)
 login_manager.login_view = 'login'
 
 @login_manager.user_loader
+@instrumented
 def load_user(user_id):
-    with driver.session() as session:
+    with get_driver().session() as session:
         result = session.run(
             "MATCH (u:User) WHERE ID(u) = $user_id RETURN u",
             user_id=int(user_id)
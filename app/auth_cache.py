@@ -0,0 +1,60 @@
+from collections import OrderedDict
+import os
+import threading
+import time
+
+from app.utils import User
+
+# Properties never kept in memory: the password hash is only needed at login
+_UNCACHED_PROPERTIES = {"password"}
+
+# Short-lived cache of logged-in users, keyed by the user_id in the session cookie.
+# Authenticated pages only need to know who the user is, so they read the user from
+# here and hit the database once per ttl_seconds per user instead of once per request.
+class AuthenticatedUserCache:
+    def __init__(self, ttl_seconds, max_entries):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # user_id -> (expires_at, properties)
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(user_id, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return dict(entry[1])
+
+    def put(self, user_id, properties):
+        cached = {key: value for key, value in properties.items() if key not in _UNCACHED_PROPERTIES}
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl_seconds, cached)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+user_cache = AuthenticatedUserCache(ttl_seconds=float(os.getenv("AUTH_CACHE_TTL_SECONDS", "60")),
+                                    max_entries=int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000")))
+
+# The logged-in user for this session's user_id, from the cache when possible
+def get_authenticated_user(driver, user_id):
+    properties = user_cache.get(user_id)
+    if properties is not None:
+        return User(uuid=user_id, properties=properties)
+    user = User.from_database(driver, user_id)
+    user_cache.put(user_id, user.properties)
+    return user
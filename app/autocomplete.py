@@ -0,0 +1,62 @@
+import bisect
+import os
+import re
+
+from app.instrumentation import instrumented
+from app.transactions import read_records
+from app.utils import NODE_LABEL, graph_node
+from app.world_cache import WorldSnapshotCache
+
+# Name completion for the editor's node pickers, answered from memory. Each world's names
+# are loaded once per world version into a sorted prefix index: every word start of every
+# name ("Windy City" -> "windy city", "city") as a sorted key list, so a lookup is one
+# binary search plus a short scan.
+autocomplete_cache = WorldSnapshotCache(max_bytes=int(os.getenv("AUTOCOMPLETE_CACHE_MAX_BYTES", 32 * 1024 * 1024)))
+
+_WORD_START = re.compile(r"\b\w")
+
+def build_name_index(rows):
+    entries = []
+    pairs = []
+    for row in rows:
+        name = row["name"]
+        if not isinstance(name, str) or not name:
+            continue
+        entries.append((row["uuid"], name, row["labels"][0] if row["labels"] else "Unknown"))
+        lowered = name.lower()
+        for match in _WORD_START.finditer(lowered):
+            pairs.append((lowered[match.start():], len(entries) - 1))
+    pairs.sort()
+    return ([key for key, _ in pairs], [position for _, position in pairs], entries)
+
+def complete(index, prefix, limit=10):
+    keys, positions, entries = index
+    prefix = prefix.lower()
+    results = []
+    seen = set()
+    for i in range(bisect.bisect_left(keys, prefix), len(keys)):
+        if not keys[i].startswith(prefix) or len(results) >= limit:
+            break
+        if positions[i] in seen:
+            continue
+        seen.add(positions[i])
+        node_uuid, name, group = entries[positions[i]]
+        results.append(graph_node(node_uuid, name, [group]))
+    return results
+
+@instrumented
+def _load_names(driver, world_uuid):
+    return read_records(driver, f"""
+        MATCH (n:{NODE_LABEL} {{world_uuid: $uuid}})
+        WHERE n.name IS NOT NULL
+        RETURN n.uuid AS uuid, n.name AS name, [label IN labels(n) WHERE label <> '{NODE_LABEL}'] AS labels
+    """, uuid=world_uuid)
+
+# Completions for `prefix` among the world's node names; `world` is a World read this request
+def autocomplete(driver, world, prefix, limit=10):
+    version = world.properties.get("version", 0)
+    index = autocomplete_cache.get(world.uuid, version)
+    if index is None:
+        index = build_name_index(_load_names(driver, world.uuid))
+        autocomplete_cache.put(world.uuid, version, index)
+    return complete(index, prefix, limit)
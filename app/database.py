@@ -0,0 +1,193 @@
+import atexit
+import logging
+import os
+import threading
+import time
+
+from neo4j import GraphDatabase
+from dotenv import load_dotenv
+
+from app.instrumentation import InstrumentedDriver, instrumented
+
+logger = logging.getLogger(__name__)
+
+# One driver (and so one connection pool) per process, shared by the blueprint and the login
+# manager. Pool settings come from the environment; the defaults keep connections well inside
+# the idle timeouts of App Engine / cloud load balancers so they aren't silently dropped.
+POOL_SETTINGS = {
+    "max_connection_pool_size": ("NEO4J_MAX_POOL_SIZE", int, 50),
+    "max_connection_lifetime": ("NEO4J_MAX_CONNECTION_LIFETIME", float, 1800),
+    "connection_acquisition_timeout": ("NEO4J_CONNECTION_ACQUISITION_TIMEOUT", float, 30),
+    "connection_timeout": ("NEO4J_CONNECTION_TIMEOUT", float, 15),
+    "liveness_check_timeout": ("NEO4J_LIVENESS_CHECK_TIMEOUT", float, 60),
+    # How long execute_read/execute_write keep retrying transient errors
+    "max_transaction_retry_time": ("NEO4J_MAX_TRANSACTION_RETRY_TIME", float, 15),
+}
+
+# Connections opened at startup so the first requests don't pay for the handshake
+WARMUP_CONNECTIONS = int(os.getenv("NEO4J_POOL_WARMUP", "2"))
+
+def pool_config():
+    config = {}
+    for key, (env_name, cast, default) in POOL_SETTINGS.items():
+        config[key] = cast(os.getenv(env_name, default))
+    config["keep_alive"] = os.getenv("NEO4J_KEEP_ALIVE", "true").lower() != "false"
+    return config
+
+# Owns the neo4j driver and counts sessions so pool use can be reported
+class ManagedDriver:
+    def __init__(self, uri, auth, **config):
+        self.driver = GraphDatabase.driver(uri, auth=auth, **config)
+        self.config = config
+        # Sessions in this process are causally chained: a read after a write waits until
+        # the follower serving it has that write
+        self.bookmark_manager = GraphDatabase.bookmark_manager()
+        self.created_at = time.time()
+        self.sessions_opened = 0
+        self.sessions_active = 0
+        self.sessions_peak = 0
+        self._lock = threading.Lock()
+
+    def session(self, **kwargs):
+        kwargs.setdefault("bookmark_manager", self.bookmark_manager)
+        return _ManagedSession(self, self.driver.session(**kwargs))
+
+    def _session_opened(self):
+        with self._lock:
+            self.sessions_opened += 1
+            self.sessions_active += 1
+            self.sessions_peak = max(self.sessions_peak, self.sessions_active)
+
+    def _session_closed(self):
+        with self._lock:
+            self.sessions_active -= 1
+
+    # Open `connections` connections at once (each session holds one while its query runs)
+    @instrumented
+    def warm(self, connections=WARMUP_CONNECTIONS):
+        if connections <= 0:
+            return 0
+        start = time.perf_counter()
+        self.driver.verify_connectivity()
+        barrier = threading.Barrier(connections)
+        errors = []
+
+        def open_connection():
+            try:
+                with self.driver.session() as session:
+                    result = session.run("RETURN 1")
+                    # Hold the connection until every thread has one, so the pool really grows
+                    barrier.wait(timeout=self.config.get("connection_timeout", 15))
+                    result.consume()
+            except Exception as e:
+                barrier.abort()
+                errors.append(e)
+
+        threads = [threading.Thread(target=open_connection, daemon=True) for _ in range(connections)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            logger.warning("pool_warmup_incomplete connections=%d errors=%d first_error=%s",
+                           connections, len(errors), errors[0])
+        logger.info("pool_warmed connections=%d seconds=%.3f", connections, time.perf_counter() - start)
+        return connections - len(errors)
+
+    # Connections the driver's pool holds right now (uses driver internals, so best effort)
+    def _pool_connections(self):
+        pool = getattr(self.driver, "_pool", None)
+        connections = getattr(pool, "connections", None)
+        if connections is None:
+            return None
+        return [connection for address_connections in list(connections.values()) for connection in list(address_connections)]
+
+    def pool_stats(self):
+        max_size = self.config.get("max_connection_pool_size")
+        stats = {
+            "max_size": max_size,
+            "sessions_active": self.sessions_active,
+            "sessions_peak": self.sessions_peak,
+            "sessions_opened": self.sessions_opened,
+            "uptime_seconds": round(time.time() - self.created_at, 1),
+        }
+        connections = self._pool_connections()
+        if connections is not None:
+            in_use = sum(1 for connection in connections if getattr(connection, "in_use", False))
+            stats["connections_open"] = len(connections)
+            stats["connections_in_use"] = in_use
+            stats["connections_idle"] = len(connections) - in_use
+            stats["utilization"] = round(in_use / max_size, 4) if max_size else None
+        return stats
+
+    def close(self):
+        self.driver.close()
+
+    def __getattr__(self, name):
+        return getattr(self.driver, name)
+
+
+class _ManagedSession:
+    def __init__(self, managed_driver, session):
+        self._managed_driver = managed_driver
+        self._session = session
+        self._closed = False
+        managed_driver._session_opened()
+
+    def __enter__(self):
+        self._session.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            return self._session.__exit__(exc_type, exc_value, traceback)
+        finally:
+            self._mark_closed()
+
+    def close(self):
+        try:
+            self._session.close()
+        finally:
+            self._mark_closed()
+
+    def _mark_closed(self):
+        if not self._closed:
+            self._closed = True
+            self._managed_driver._session_closed()
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+
+_driver = None
+_driver_pid = None
+_driver_lock = threading.Lock()
+
+# The process-wide driver, created (and warmed) on first use. Each forked worker gets its
+# own: sockets inherited from the parent can't be shared.
+def get_driver():
+    global _driver, _driver_pid
+    with _driver_lock:
+        if _driver is None or _driver_pid != os.getpid():
+            load_dotenv()
+            managed = ManagedDriver(os.getenv("NEO4J_URI"),
+                                    (os.getenv("NEO4J_USERNAME"), os.getenv("NEO4J_PASSWORD")),
+                                    **pool_config())
+            try:
+                managed.warm()
+            except Exception as e:
+                # The pool fills on demand instead; the first real query will report the problem
+                logger.warning("pool_warmup_failed error=%s", e)
+            # Every query is timed and counted for /metrics
+            _driver = InstrumentedDriver(managed)
+            _driver_pid = os.getpid()
+        return _driver
+
+def close_driver():
+    global _driver
+    with _driver_lock:
+        if _driver is not None and _driver_pid == os.getpid():
+            _driver.close()
+        _driver = None
+
+atexit.register(close_driver)
@@ -0,0 +1,341 @@
+import heapq
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from app.instrumentation import instrumented
+from app.route_planner import edge_value, load_route_graph
+from app.transactions import read_records
+from app.world_cache import WorldSnapshotCache
+
+logger = logging.getLogger(__name__)
+
+# Where tables are saved so a restarted process can reload instead of rebuilding
+TABLE_DIR = os.getenv("DISTANCE_TABLE_DIR", os.path.join(tempfile.gettempdir(), "storeybored_distance_tables"))
+
+# Above this many locations repeated Dijkstra beats the O(n^3) Floyd-Warshall
+FLOYD_WARSHALL_MAX_NODES = 1500
+
+# Tolerance when deciding whether an edge lies on a shortest path
+EPSILON = 1e-9
+
+# Incremental updates are saved at most this often; a stale file catches up on reload anyway
+SAVE_INTERVAL_SECONDS = 60
+
+# Loaded tables are n x n arrays, so they are bounded by memory rather than count
+MAX_CACHED_BYTES = int(os.getenv("DISTANCE_TABLE_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+# All-pairs shortest route distances and next hops for one world and one route cost property.
+# distances[i, j] is the cheapest total cost from location i to j (inf if unreachable) and
+# next_hops[i, j] is the index of the first location after i on that route (-1 if none).
+# change_seq is the world's change log position the table is known to be up to date with.
+class DistanceTable:
+    def __init__(self, world_uuid, cost_property, uuids, edges, distances=None, next_hops=None, change_seq=0):
+        self.world_uuid = world_uuid
+        self.cost_property = cost_property
+        self.change_seq = change_seq
+        self.uuids = list(uuids)
+        self.index = {location_uuid: i for i, location_uuid in enumerate(self.uuids)}
+        self.edges = dict(edges)  # (i, j) with i < j -> weight
+        self._lock = threading.Lock()
+        self._saved_at = 0
+        self._saving = False
+        if distances is None:
+            self.distances, self.next_hops = self._compute_all()
+        else:
+            self.distances, self.next_hops = distances, next_hops
+
+    @classmethod
+    def from_route_graph(cls, world_uuid, cost_property, graph, change_seq=0):
+        uuids = list(graph.adjacency)
+        index = {location_uuid: i for i, location_uuid in enumerate(uuids)}
+        edges = {}
+        for start, end, properties in graph.edges:
+            if start == end:
+                continue
+            key = (min(index[start], index[end]), max(index[start], index[end]))
+            weight = edge_value(properties, cost_property)
+            edges[key] = min(weight, edges.get(key, weight))
+        return cls(world_uuid, cost_property, uuids, edges, change_seq=change_seq)
+
+    # O(1) lookups
+    def distance(self, source_uuid, target_uuid):
+        i, j = self.index.get(source_uuid), self.index.get(target_uuid)
+        if i is None or j is None or not np.isfinite(self.distances[i, j]):
+            return None
+        return float(self.distances[i, j])
+
+    def next_hop(self, source_uuid, target_uuid):
+        i, j = self.index.get(source_uuid), self.index.get(target_uuid)
+        if i is None or j is None or i == j or self.next_hops[i, j] < 0:
+            return None
+        return self.uuids[self.next_hops[i, j]]
+
+    def _adjacency(self):
+        adjacency = [[] for _ in self.uuids]
+        for (i, j), weight in self.edges.items():
+            adjacency[i].append((j, weight))
+            adjacency[j].append((i, weight))
+        return adjacency
+
+    def _compute_all(self):
+        n = len(self.uuids)
+        if n <= FLOYD_WARSHALL_MAX_NODES:
+            return self._floyd_warshall()
+        adjacency = self._adjacency()
+        distances = np.full((n, n), np.inf)
+        next_hops = np.full((n, n), -1, dtype=np.int32)
+        for source in range(n):
+            distances[source], next_hops[source] = self._dijkstra_row(source, adjacency)
+        return distances, next_hops
+
+    def _floyd_warshall(self):
+        n = len(self.uuids)
+        distances = np.full((n, n), np.inf)
+        next_hops = np.full((n, n), -1, dtype=np.int32)
+        np.fill_diagonal(distances, 0)
+        next_hops[np.arange(n), np.arange(n)] = np.arange(n)
+        for (i, j), weight in self.edges.items():
+            distances[i, j] = distances[j, i] = weight
+            next_hops[i, j] = j
+            next_hops[j, i] = i
+        for k in range(n):
+            through_k = distances[:, k, None] + distances[None, k, :]
+            better = through_k < distances
+            distances = np.where(better, through_k, distances)
+            next_hops = np.where(better, next_hops[:, k, None], next_hops)
+        return distances, next_hops
+
+    def _dijkstra_row(self, source, adjacency):
+        n = len(self.uuids)
+        distances = np.full(n, np.inf)
+        first_hops = np.full(n, -1, dtype=np.int32)
+        distances[source] = 0
+        first_hops[source] = source
+        queue = [(0.0, source)]
+        while queue:
+            cost, node = heapq.heappop(queue)
+            if cost > distances[node]:
+                continue
+            for neighbour, weight in adjacency[node]:
+                new_cost = cost + weight
+                if new_cost < distances[neighbour]:
+                    distances[neighbour] = new_cost
+                    first_hops[neighbour] = neighbour if node == source else first_hops[node]
+                    heapq.heappush(queue, (new_cost, neighbour))
+        return distances, first_hops
+
+    def _add_location(self, location_uuid):
+        n = len(self.uuids)
+        self.uuids.append(location_uuid)
+        self.index[location_uuid] = n
+        self.distances = np.pad(self.distances, ((0, 1), (0, 1)), constant_values=np.inf)
+        self.next_hops = np.pad(self.next_hops, ((0, 1), (0, 1)), constant_values=-1)
+        self.distances[n, n] = 0
+        self.next_hops[n, n] = n
+        return n
+
+    # Adding or shortening an edge: relax every pair through it in both directions, O(n^2)
+    def _relax_through(self, i, j, weight):
+        for a, b in ((i, j), (j, i)):
+            through = self.distances[:, a, None] + weight + self.distances[None, b, :]
+            better = through < self.distances
+            first_hops = self.next_hops[:, a].copy()
+            first_hops[a] = b
+            self.distances = np.where(better, through, self.distances)
+            self.next_hops = np.where(better, first_hops[:, None], self.next_hops)
+
+    # Removing or lengthening an edge: only sources for which the edge was on a shortest
+    # path can change, so just those rows are recomputed
+    def _recompute_sources_using(self, i, j, weight):
+        with np.errstate(invalid="ignore"):  # inf - inf for unreachable pairs is simply not tight
+            via_i = np.abs(self.distances[:, i] + weight - self.distances[:, j]) <= EPSILON
+            via_j = np.abs(self.distances[:, j] + weight - self.distances[:, i]) <= EPSILON
+        reachable = np.isfinite(self.distances[:, i]) | np.isfinite(self.distances[:, j])
+        affected = np.flatnonzero((via_i | via_j) & reachable)
+        adjacency = self._adjacency()
+        for source in affected:
+            self.distances[source], self.next_hops[source] = self._dijkstra_row(source, adjacency)
+
+    # A ROUTE between two locations was created or its properties changed
+    def set_route(self, start_uuid, end_uuid, properties):
+        with self._lock:
+            i = self.index.get(start_uuid)
+            if i is None:
+                i = self._add_location(start_uuid)
+            j = self.index.get(end_uuid)
+            if j is None:
+                j = self._add_location(end_uuid)
+            if i == j:
+                return
+            key = (min(i, j), max(i, j))
+            old_weight = self.edges.get(key)
+            # MERGE + SET r += props keeps the old cost if the update doesn't mention it
+            if self.cost_property in properties or old_weight is None:
+                weight = edge_value(properties, self.cost_property)
+            else:
+                weight = old_weight
+
+            if old_weight is not None and weight > old_weight:
+                del self.edges[key]
+                self._recompute_sources_using(i, j, old_weight)
+            self.edges[key] = weight
+            self._relax_through(i, j, weight)
+
+    # Callers hold the lock
+    def _remove_edge(self, i, j):
+        weight = self.edges.pop((min(i, j), max(i, j)), None)
+        if weight is not None:
+            self._recompute_sources_using(i, j, weight)
+
+    def remove_route(self, start_uuid, end_uuid):
+        with self._lock:
+            i, j = self.index.get(start_uuid), self.index.get(end_uuid)
+            if i is not None and j is not None:
+                self._remove_edge(i, j)
+
+    def remove_location(self, location_uuid):
+        with self._lock:
+            i = self.index.get(location_uuid)
+            if i is None:
+                return
+            for a, b in [key for key in self.edges if i in key]:
+                self._remove_edge(a, b)
+
+    @property
+    def nbytes(self):
+        return self.distances.nbytes + self.next_hops.nbytes
+
+    def path(self):
+        return os.path.join(TABLE_DIR, f"{self.world_uuid}_{self.cost_property}.npz")
+
+    # Written to a temporary file and renamed, so a reader never sees half a table
+    def save(self):
+        os.makedirs(TABLE_DIR, exist_ok=True)
+        with self._lock:
+            uuids = np.array(self.uuids)
+            distances, next_hops = self.distances.copy(), self.next_hops.copy()
+            edge_keys = np.array(list(self.edges), dtype=np.int32).reshape(-1, 2)
+            edge_weights = np.array(list(self.edges.values()), dtype=np.float64)
+            change_seq = self.change_seq
+        temporary_path = f"{self.path()}.{threading.get_ident()}.tmp.npz"
+        np.savez_compressed(temporary_path, uuids=uuids, distances=distances, next_hops=next_hops,
+                            edge_keys=edge_keys, edge_weights=edge_weights, change_seq=np.array(change_seq))
+        os.replace(temporary_path, self.path())
+        self._saved_at = time.monotonic()
+
+    # Compressing an n x n table is too slow for the request that triggered it, so saves run
+    # on a background thread, one at a time per table
+    def save_in_background(self, force=True):
+        with self._lock:
+            if self._saving or not (force or time.monotonic() - self._saved_at >= SAVE_INTERVAL_SECONDS):
+                return
+            self._saving = True
+
+        def run():
+            try:
+                self.save()
+            except OSError as e:
+                logger.warning("distance_table_save_failed world=%s cost=%s error=%s", self.world_uuid, self.cost_property, e)
+            finally:
+                self._saving = False
+        threading.Thread(target=run, name="distance-table-save", daemon=True).start()
+
+    def save_if_due(self):
+        self.save_in_background(force=False)
+
+    # The saved table, if any; it may be behind the world, see get_distance_table
+    @classmethod
+    def load(cls, world_uuid, cost_property):
+        table_path = os.path.join(TABLE_DIR, f"{world_uuid}_{cost_property}.npz")
+        if not os.path.exists(table_path):
+            return None
+        data = np.load(table_path)
+        if "change_seq" not in data:
+            return None
+        edges = {(int(i), int(j)): float(weight) for (i, j), weight in zip(data["edge_keys"], data["edge_weights"])}
+        return cls(world_uuid, cost_property, [str(u) for u in data["uuids"]], edges,
+                   distances=data["distances"], next_hops=data["next_hops"], change_seq=int(data["change_seq"]))
+
+
+# Loaded tables, keyed by (world uuid, cost property) and the world version they are
+# up to date with
+table_cache = WorldSnapshotCache(max_bytes=MAX_CACHED_BYTES)
+
+# The ROUTE and node changes logged between two change sequence numbers, with the current
+# routes between each changed pair and whether each changed node is still a location
+@instrumented
+def _route_changes(driver, world_uuid, after, change_seq):
+    return read_records(driver, """
+        MATCH (c:WorldChange {world_uuid: $world_uuid})
+        WHERE c.seq > $after AND c.seq <= $change_seq AND (c.kind = 'node' OR c.type = 'ROUTE')
+        WITH DISTINCT c.kind AS kind, c.key AS key, c.start AS start, c.end AS end
+        OPTIONAL MATCH (l:Location {uuid: key})
+        WHERE kind = 'node'
+        OPTIONAL MATCH (a:Location {uuid: start})-[r:ROUTE]-(b:Location {uuid: end})
+        WHERE kind = 'edge'
+        RETURN kind, key, start, end, l IS NOT NULL AS exists, collect(properties(r)) AS routes
+    """, world_uuid=world_uuid, after=after, change_seq=change_seq)
+
+# Replays what the change log says happened to the routes since the table's change_seq
+def _catch_up(driver, table, change_seq):
+    for record in _route_changes(driver, table.world_uuid, table.change_seq, change_seq):
+        if record["kind"] == "node":
+            if not record["exists"]:
+                table.remove_location(record["key"])
+        elif record["routes"]:
+            weight = min(edge_value(properties, table.cost_property) for properties in record["routes"])
+            table.set_route(record["start"], record["end"], {table.cost_property: weight})
+        else:
+            table.remove_route(record["start"], record["end"])
+    table.change_seq = max(table.change_seq, change_seq)
+
+# The table for the world at `version`, whose change log is at change_seq and pruned up to
+# pruned_to (see World.change_position). A table already at this version costs no query.
+# Any write moves the version but most don't touch routes, so a table from an earlier
+# version (loaded, or saved by any process) is caught up from the change log instead of
+# rebuilt; it is only rebuilt once the log has been pruned past it.
+def get_distance_table(driver, world_uuid, cost_property, version, change_seq, pruned_to):
+    key = (world_uuid, cost_property)
+    table = table_cache.get(key, version)
+    if table is not None:
+        return table
+
+    latest = table_cache.latest(key)
+    table = latest[1] if latest is not None else DistanceTable.load(world_uuid, cost_property)
+    if table is not None and table.change_seq >= pruned_to:
+        if table.change_seq < change_seq:
+            _catch_up(driver, table, change_seq)
+            table.save_if_due()
+    else:
+        graph = load_route_graph(driver, world_uuid)
+        table = DistanceTable.from_route_graph(world_uuid, cost_property, graph, change_seq)
+        table.save_in_background()
+    table_cache.put(key, version, table, size=table.nbytes)
+    return table
+
+def _tables_for(location_uuids):
+    return [table for table in table_cache.values()
+            if any(location_uuid in table.index for location_uuid in location_uuids)]
+
+# Change hooks, called once the write has committed. Only tables already loaded are
+# updated straight away; writes that don't call them, and other processes, are caught up
+# from the change log on the next version (replaying a change a hook already made is harmless).
+def route_changed(start_uuid, end_uuid, properties):
+    for table in _tables_for([start_uuid, end_uuid]):
+        table.set_route(start_uuid, end_uuid, properties or {})
+        table.save_if_due()
+
+def route_removed(start_uuid, end_uuid):
+    for table in _tables_for([start_uuid, end_uuid]):
+        table.remove_route(start_uuid, end_uuid)
+        table.save_if_due()
+
+def location_removed(location_uuid):
+    for table in _tables_for([location_uuid]):
+        table.remove_location(location_uuid)
+        table.save_if_due()
@@ -0,0 +1,153 @@
+import logging
+import os
+import threading
+import time
+
+from app.instrumentation import instrumented, metrics
+from app.utils import quote_name
+
+logger = logging.getLogger(__name__)
+
+# off: do nothing; advise: only report suggestions; auto: also create the indexes
+MODE = os.getenv("INDEX_ADVISOR_MODE", "advise").lower()
+
+# A (label, property) filter earns an index once it has been used this often and its
+# queries average at least this long
+MIN_CALLS = int(os.getenv("INDEX_ADVISOR_MIN_CALLS", "50"))
+SLOW_SECONDS = float(os.getenv("INDEX_ADVISOR_SLOW_MS", "10")) / 1000
+
+# Equality, range and STARTS WITH are served by RANGE indexes; CONTAINS / ENDS WITH by TEXT
+TEXT_OPERATORS = {"contains", "ends_with"}
+
+# SHOW INDEXES is re-run at most this often
+INDEX_LIST_TTL_SECONDS = 60
+
+def index_type_for(operator):
+    return "TEXT" if operator in TEXT_OPERATORS else "RANGE"
+
+def index_name(label, property_name, index_type):
+    return f"advisor_{label}_{property_name}_{index_type}".lower()
+
+def create_index_statement(label, property_name, index_type):
+    kind = "TEXT INDEX" if index_type == "TEXT" else "INDEX"
+    return (f"CREATE {kind} {quote_name(index_name(label, property_name, index_type))} IF NOT EXISTS "
+            f"FOR (n:{quote_name(label)}) ON (n.{quote_name(property_name)})")
+
+# Watches the property filters recorded in app/instrumentation.py and suggests (or, in
+# auto mode, creates) indexes for the ones that are both frequent and slow. Needs a
+# plain driver, not a unit of work: schema changes can't run in a data transaction.
+class IndexAdvisor:
+    def __init__(self, driver, mode=MODE, min_calls=MIN_CALLS, slow_seconds=SLOW_SECONDS):
+        self.driver = driver
+        self.mode = mode
+        self.min_calls = min_calls
+        self.slow_seconds = slow_seconds
+        self.created = []
+        self._attempted = set()
+        self._indexes = None
+        self._indexes_loaded_at = 0
+        self._lock = threading.Lock()
+
+    @instrumented
+    def existing_indexes(self, refresh=False):
+        with self._lock:
+            stale = time.monotonic() - self._indexes_loaded_at > INDEX_LIST_TTL_SECONDS
+            if self._indexes is not None and not refresh and not stale:
+                return self._indexes
+        with self.driver.session() as session:
+            result = session.run("""
+                SHOW INDEXES YIELD name, type, entityType, labelsOrTypes, properties, state
+                WHERE entityType = 'NODE'
+                RETURN name, type, labelsOrTypes, properties, state
+            """)
+            indexes = [record.data() for record in result]
+        with self._lock:
+            self._indexes = indexes
+            self._indexes_loaded_at = time.monotonic()
+        return indexes
+
+    def _covered(self, label, property_name, index_type, indexes):
+        return any(index["type"] == index_type and index["labelsOrTypes"] == [label]
+                   and index["properties"] == [property_name] for index in indexes)
+
+    def suggestions(self, indexes=None):
+        indexes = self.existing_indexes() if indexes is None else indexes
+        suggested = []
+        for (label, property_name, operator), (calls, total_seconds) in sorted(metrics.filter_stats().items()):
+            mean_seconds = total_seconds / calls if calls else 0.0
+            index_type = index_type_for(operator)
+            if calls < self.min_calls or mean_seconds < self.slow_seconds:
+                continue
+            if self._covered(label, property_name, index_type, indexes):
+                continue
+            suggested.append({
+                "label": label, "property": property_name, "operator": operator, "type": index_type,
+                "calls": calls, "mean_ms": round(mean_seconds * 1000, 3),
+                "statement": create_index_statement(label, property_name, index_type),
+            })
+        return suggested
+
+    # Filter listener: cheap until a filter crosses the thresholds, then (auto mode) the
+    # index is created off the request thread
+    def observe(self, label, property_name, operator):
+        if self.mode != "auto":
+            return
+        key = (label, property_name, index_type_for(operator))
+        if key in self._attempted:
+            return
+        calls, total_seconds = metrics.filter_stats().get((label, property_name, operator), (0, 0.0))
+        if calls < self.min_calls or total_seconds / calls < self.slow_seconds:
+            return
+        with self._lock:
+            if key in self._attempted:
+                return
+            self._attempted.add(key)
+        threading.Thread(target=self.create_index, args=key, daemon=True).start()
+
+    @instrumented
+    def create_index(self, label, property_name, index_type):
+        if self._covered(label, property_name, index_type, self.existing_indexes(refresh=True)):
+            return None
+        statement = create_index_statement(label, property_name, index_type)
+        try:
+            with self.driver.session() as session:
+                session.run(statement).consume()
+        except Exception as e:
+            logger.warning("index_create_failed label=%s property=%s type=%s error=%s", label, property_name, index_type, e)
+            return None
+        logger.info("index_created label=%s property=%s type=%s", label, property_name, index_type)
+        self.created.append({"label": label, "property": property_name, "type": index_type,
+                             "statement": statement, "created_at": time.time()})
+        self.existing_indexes(refresh=True)
+        return statement
+
+    def report(self):
+        indexes = self.existing_indexes(refresh=True)
+        observed = [{"label": label, "property": property_name, "operator": operator, "calls": calls,
+                     "mean_ms": round(total_seconds / calls * 1000, 3) if calls else 0.0}
+                    for (label, property_name, operator), (calls, total_seconds) in sorted(metrics.filter_stats().items())]
+        return {
+            "mode": self.mode,
+            "thresholds": {"min_calls": self.min_calls, "slow_ms": self.slow_seconds * 1000},
+            "existing": indexes,
+            "observed": observed,
+            "suggested": self.suggestions(indexes),
+            "created": list(self.created),
+        }
+
+_installed = None
+_install_lock = threading.Lock()
+
+# Start watching filters recorded through app/instrumentation.py. There is one advisor per
+# process: installing again for the same driver returns it, and a new driver replaces it.
+def install_index_advisor(driver, mode=MODE):
+    global _installed
+    with _install_lock:
+        if _installed is not None and _installed.driver is driver and _installed.mode == mode:
+            return _installed
+        _installed = IndexAdvisor(driver, mode=mode)
+        if mode != "off":
+            metrics.add_filter_listener(_installed.observe, name="index_advisor")
+        else:
+            metrics.remove_filter_listener("index_advisor")
+        return _installed
@@ -0,0 +1,293 @@
+from collections import defaultdict, deque
+from contextlib import contextmanager
+import contextvars
+import functools
+import os
+import random
+import threading
+import time
+
+from flask import has_request_context, request
+
+# Latency buckets in seconds, Prometheus style (cumulative, +Inf implied)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+# Fraction of queries to capture a plan for, and how: PROFILE runs the query itself with
+# profiling on, EXPLAIN plans it in a separate (non-executing) call first
+PLAN_SAMPLE_RATE = float(os.getenv("QUERY_PLAN_SAMPLE_RATE", "0"))
+PLAN_MODE = os.getenv("QUERY_PLAN_MODE", "PROFILE").upper()
+PLANS_KEPT_PER_ORIGIN = 5
+
+# The operation the running queries belong to (the "origin" label), set by @instrumented
+_current_operation = contextvars.ContextVar("query_operation", default="unknown")
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += 1
+        self.sum += value
+
+class QueryMetrics:
+    def __init__(self):
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.consume = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.rows = defaultdict(lambda: Histogram(ROW_BUCKETS))
+        self.errors = defaultdict(int)
+        self.plans = defaultdict(lambda: deque(maxlen=PLANS_KEPT_PER_ORIGIN))
+        # Property filters, keyed by (label, property, operator), for the index advisor
+        self.filters = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        # Registered under a name (or the function itself), so registering again replaces
+        self._filter_listeners = {}
+        self._collectors = {}
+        self._lock = threading.Lock()
+
+    def record(self, labels, latency, consume_time, rows):
+        with self._lock:
+            self.latency[labels].observe(latency)
+            self.consume[labels].observe(consume_time)
+            self.rows[labels].observe(rows)
+
+    def record_error(self, labels):
+        with self._lock:
+            self.errors[labels] += 1
+
+    def record_plan(self, labels, query, plan):
+        with self._lock:
+            self.plans[labels].append({"query": query, "plan": plan, "captured_at": time.time()})
+
+    # A query filtered `label` nodes on these properties and took `seconds`
+    def record_filter(self, label, properties, seconds, operator="equality"):
+        keys = [(label, property_name, operator) for property_name in properties]
+        with self._lock:
+            for key in keys:
+                self.filters[key].observe(seconds)
+        for listener in list(self._filter_listeners.values()):
+            for key in keys:
+                listener(*key)
+
+    # listener(label, property, operator) is called after every recorded filter
+    def add_filter_listener(self, listener, name=None):
+        self._filter_listeners[name or listener] = listener
+
+    def remove_filter_listener(self, name):
+        self._filter_listeners.pop(name, None)
+
+    def filter_stats(self):
+        with self._lock:
+            return {key: (histogram.total, histogram.sum) for key, histogram in self.filters.items()}
+
+    # Extra gauges for /metrics: callables returning [(name, help, value)]
+    def register_collector(self, collector, name=None):
+        self._collectors[name or collector] = collector
+
+    def render_prometheus(self):
+        lines = []
+        with self._lock:
+            _render_histograms(lines, "storeybored_query_duration_seconds",
+                               "Time from sending a query to its first response", self.latency)
+            _render_histograms(lines, "storeybored_query_consume_seconds",
+                               "Time spent consuming query results", self.consume)
+            _render_histograms(lines, "storeybored_query_rows", "Rows returned per query", self.rows)
+            _render_histograms(lines, "storeybored_property_filter_seconds",
+                               "Time spent in queries filtering a label on a property", self.filters,
+                               names=("label", "property", "operator"))
+            lines.append("# HELP storeybored_query_errors_total Queries that raised")
+            lines.append("# TYPE storeybored_query_errors_total counter")
+            for labels, count in sorted(self.errors.items()):
+                lines.append(f"storeybored_query_errors_total{{{_format_labels(labels)}}} {count}")
+        for collector in list(self._collectors.values()):
+            for name, help_text, value in collector():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def recent_plans(self):
+        with self._lock:
+            return [{"origin": labels[0], "route": labels[1], "plans": list(plans)}
+                    for labels, plans in sorted(self.plans.items())]
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels, names=("origin", "route"), **extra):
+    pairs = list(zip(names, labels)) + list(extra.items())
+    return ",".join(f'{key}="{_escape(str(value))}"' for key, value in pairs)
+
+def _render_histograms(lines, name, help_text, histograms, names=("origin", "route")):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} histogram")
+    for labels, histogram in sorted(histograms.items()):
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            lines.append(f"{name}_bucket{{{_format_labels(labels, names, le=bound)}}} {count}")
+        lines.append(f"{name}_bucket{{{_format_labels(labels, names, le='+Inf')}}} {histogram.total}")
+        lines.append(f"{name}_sum{{{_format_labels(labels, names)}}} {histogram.sum}")
+        lines.append(f"{name}_count{{{_format_labels(labels, names)}}} {histogram.total}")
+
+metrics = QueryMetrics()
+
+# Queries run inside `with operation(name):` are recorded with that origin
+@contextmanager
+def operation(name):
+    token = _current_operation.set(name)
+    try:
+        yield
+    finally:
+        _current_operation.reset(token)
+
+# Records the queries a function runs under its qualified name, e.g. "World.list_nodes".
+# The innermost decorated function wins.
+def instrumented(fn):
+    name = fn.__qualname__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with operation(name):
+            return fn(*args, **kwargs)
+    return wrapper
+
+# (origin, route) for the query being run, and the Flask endpoint if we're inside a request
+def _query_labels():
+    route = (request.endpoint or "unknown") if has_request_context() else "none"
+    return _current_operation.get(), route
+
+def _plan_to_dict(plan):
+    if plan is None:
+        return None
+    return dict(plan) if not isinstance(plan, dict) else plan
+
+def _can_plan(query):
+    statement = query.lstrip().upper()
+    return not (statement.startswith(("EXPLAIN", "PROFILE", "CREATE CONSTRAINT", "CREATE INDEX",
+                                      "CREATE FULLTEXT", "DROP ", "SHOW ", "CALL DB."))
+                or "IN TRANSACTIONS" in statement)
+
+# Runs a query on a session or transaction, timing it and wrapping the result
+def _run(runner, query, parameters, kwargs):
+    labels = _query_labels()
+    sampled = PLAN_SAMPLE_RATE > 0 and random.random() < PLAN_SAMPLE_RATE and _can_plan(query)
+    if sampled and PLAN_MODE == "EXPLAIN":
+        plan = runner.run("EXPLAIN " + query, parameters, **kwargs).consume().plan
+        metrics.record_plan(labels, query, _plan_to_dict(plan))
+    profiled = sampled and PLAN_MODE == "PROFILE"
+
+    start = time.perf_counter()
+    try:
+        result = runner.run(("PROFILE " + query) if profiled else query, parameters, **kwargs)
+    except Exception:
+        metrics.record_error(labels)
+        raise
+    return _TimedResult(result, labels, time.perf_counter() - start, query if profiled else None)
+
+# Wraps a neo4j Result, counting rows and consumption time until it is exhausted
+class _TimedResult:
+    def __init__(self, result, labels, latency, profiled_query):
+        self._result = result
+        self._labels = labels
+        self._latency = latency
+        self._profiled_query = profiled_query
+        self._rows = 0
+        self._consume_time = 0.0
+        self._recorded = False
+
+    def _finish(self, summary=None):
+        if self._recorded:
+            return
+        self._recorded = True
+        metrics.record(self._labels, self._latency, self._consume_time, self._rows)
+        if self._profiled_query is not None:
+            summary = summary or self._result.consume()
+            metrics.record_plan(self._labels, self._profiled_query, _plan_to_dict(summary.profile))
+
+    def __iter__(self):
+        iterator = iter(self._result)
+        while True:
+            start = time.perf_counter()
+            try:
+                record = next(iterator)
+            except StopIteration:
+                self._consume_time += time.perf_counter() - start
+                self._finish()
+                return
+            self._consume_time += time.perf_counter() - start
+            self._rows += 1
+            yield record
+
+    def single(self, strict=False):
+        start = time.perf_counter()
+        record = self._result.single(strict=strict)
+        self._consume_time += time.perf_counter() - start
+        self._rows += 1 if record is not None else 0
+        self._finish()
+        return record
+
+    def data(self, *keys):
+        return [record.data(*keys) for record in self]
+
+    def consume(self):
+        start = time.perf_counter()
+        summary = self._result.consume()
+        self._consume_time += time.perf_counter() - start
+        self._finish(summary)
+        return summary
+
+    # Results dropped without being exhausted are still counted
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+    def __getattr__(self, name):
+        return getattr(self._result, name)
+
+# Session and transaction wrappers: run() is timed, everything else passes through
+class _InstrumentedRunner:
+    def __init__(self, inner):
+        self._inner = inner
+
+    def __enter__(self):
+        self._inner.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._inner.__exit__(exc_type, exc_value, traceback)
+
+    def run(self, query, parameters=None, **kwargs):
+        return _run(self._inner, query, parameters, kwargs)
+
+    def begin_transaction(self, *args, **kwargs):
+        return _InstrumentedRunner(self._inner.begin_transaction(*args, **kwargs))
+
+    # Managed transactions hand the work function an instrumented transaction
+    def execute_read(self, work, *args, **kwargs):
+        return self._inner.execute_read(_instrumented_work, work, *args, **kwargs)
+
+    def execute_write(self, work, *args, **kwargs):
+        return self._inner.execute_write(_instrumented_work, work, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+def _instrumented_work(tx, work, *args, **kwargs):
+    return work(_InstrumentedRunner(tx), *args, **kwargs)
+
+# Driver wrapper: every session.run / tx.run goes through _run
+class InstrumentedDriver:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def session(self, **kwargs):
+        return _InstrumentedRunner(self.driver.session(**kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self.driver, name)
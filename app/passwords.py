@@ -0,0 +1,46 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+
+from passlib.hash import bcrypt
+
+# bcrypt cost factor for new hashes; existing hashes with a different cost are
+# re-hashed the next time their owner logs in
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# At most this many hashes are computed at once (bcrypt releases the GIL, so they
+# really do run in parallel) and at most PASSWORD_QUEUE_SIZE more wait for a turn.
+# Past that, logins fail fast instead of every worker queueing behind bcrypt.
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_QUEUE_SIZE = int(os.getenv("PASSWORD_HASH_QUEUE_SIZE", str(PASSWORD_WORKERS * 8)))
+PASSWORD_WAIT_SECONDS = float(os.getenv("PASSWORD_HASH_WAIT_SECONDS", "10"))
+
+_hasher = bcrypt.using(rounds=BCRYPT_ROUNDS)
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_WORKERS, thread_name_prefix="bcrypt")
+_slots = threading.BoundedSemaphore(PASSWORD_WORKERS + PASSWORD_QUEUE_SIZE)
+
+class PasswordServiceBusy(Exception):
+    pass
+
+def _submit(fn, *args):
+    if not _slots.acquire(timeout=PASSWORD_WAIT_SECONDS):
+        raise PasswordServiceBusy("Too many password checks in progress")
+    try:
+        future = _executor.submit(fn, *args)
+    except Exception:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    return future.result()
+
+def hash_password(password):
+    return _submit(_hasher.hash, password)
+
+def verify_password(password, password_hash):
+    if not password_hash:
+        return False
+    return _submit(_hasher.verify, password, password_hash)
+
+# True if the hash was made with a different cost than BCRYPT_ROUNDS
+def needs_rehash(password_hash):
+    return _hasher.needs_update(password_hash)
@@ -0,0 +1,248 @@
+from collections import namedtuple
+import heapq
+import itertools
+import math
+import os
+
+from app.instrumentation import instrumented
+from app.transactions import read_transaction
+from app.world_cache import WorldSnapshotCache, estimate_size
+
+# A route through the ROUTE graph: location uuids, edge ids between them, and its cost
+Path = namedtuple("Path", ["nodes", "edges", "cost"])
+
+# ROUTE properties come from forms as strings as often as numbers; anything unusable counts as 0
+def edge_value(properties, param):
+    value = properties.get(param)
+    if value is None:
+        return 0
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0
+
+# In-memory ROUTE graph for one world. ROUTE relationships are treated as undirected,
+# but each edge remembers the direction it is stored in so results match the database.
+class RouteGraph:
+    def __init__(self):
+        self.edges = []          # edge id -> (start uuid, end uuid, properties)
+        self.adjacency = {}      # uuid -> [(neighbour uuid, edge id)]
+        self.coordinates = {}    # uuid -> (x, y) for locations that have them
+        self._heuristic_scales = {}
+
+    # Rough memory use, for the route graph cache's budget
+    @property
+    def nbytes(self):
+        return estimate_size((self.edges, self.adjacency, self.coordinates))
+
+    def add_location(self, location_uuid, x=None, y=None):
+        self.adjacency.setdefault(location_uuid, [])
+        if x is not None and y is not None:
+            self._heuristic_scales.clear()
+            self.coordinates[location_uuid] = (float(x), float(y))
+
+    def add_edge(self, start, end, properties):
+        edge_id = len(self.edges)
+        self._heuristic_scales.clear()
+        self.edges.append((start, end, dict(properties)))
+        self.adjacency.setdefault(start, []).append((end, edge_id))
+        self.adjacency.setdefault(end, []).append((start, edge_id))
+        return edge_id
+
+    def weight(self, edge_id, param):
+        # No weight property means we are counting hops
+        if param is None:
+            return 1
+        value = edge_value(self.edges[edge_id][2], param)
+        # Dijkstra, A* and stopping at the target all rely on costs never going down
+        if value < 0:
+            start, end, _ = self.edges[edge_id]
+            raise ValueError(f"Route {start} -> {end} has a negative {param} ({value}); costs must be non-negative")
+        return value
+
+    def path_total(self, edge_ids, param):
+        return sum(edge_value(self.edges[edge_id][2], param) for edge_id in edge_ids)
+
+    # The largest scale that keeps straight-line distance * scale a lower bound on `param`:
+    # the smallest ratio of an edge's weight to the distance between its ends. 0 when some
+    # edge is cheaper than free, or no edge can be measured.
+    def heuristic_scale(self, param):
+        if param not in self._heuristic_scales:
+            scale = math.inf
+            for start, end, properties in self.edges:
+                if start not in self.coordinates or end not in self.coordinates:
+                    continue
+                (x1, y1), (x2, y2) = self.coordinates[start], self.coordinates[end]
+                length = math.hypot(x2 - x1, y2 - y1)
+                if length > 0:
+                    scale = min(scale, edge_value(properties, param) / length)
+            self._heuristic_scales[param] = max(scale, 0) if math.isfinite(scale) else 0
+        return self._heuristic_scales[param]
+
+# Straight-line distance to the target, usable as an A* heuristic when every location
+# has x/y coordinates and the weight is at least `scale` per unit of distance
+def euclidean_heuristic(graph, target, scale=1.0):
+    if target not in graph.coordinates or len(graph.coordinates) < len(graph.adjacency):
+        return None
+    tx, ty = graph.coordinates[target]
+
+    def heuristic(location_uuid):
+        x, y = graph.coordinates[location_uuid]
+        return math.hypot(x - tx, y - ty) * scale
+    return heuristic
+
+# Dijkstra, or A* when a heuristic is given. Raises ValueError on a negative weight.
+def shortest_path(graph, source, target, weight=None, heuristic=None, banned_nodes=(), banned_edges=()):
+    if source not in graph.adjacency or target not in graph.adjacency:
+        return None
+    estimate = heuristic or (lambda location_uuid: 0)
+    counter = itertools.count()
+    best = {source: 0}
+    previous = {}
+    queue = [(estimate(source), next(counter), 0, source)]
+    done = set()
+    while queue:
+        _, _, cost, node = heapq.heappop(queue)
+        if node in done:
+            continue
+        if node == target:
+            nodes, edges = [target], []
+            while node != source:
+                node, edge_id = previous[node]
+                nodes.append(node)
+                edges.append(edge_id)
+            return Path(nodes[::-1], edges[::-1], cost)
+        done.add(node)
+        for neighbour, edge_id in graph.adjacency[node]:
+            if neighbour in done or neighbour in banned_nodes or edge_id in banned_edges:
+                continue
+            new_cost = cost + graph.weight(edge_id, weight)
+            if new_cost < best.get(neighbour, math.inf):
+                best[neighbour] = new_cost
+                previous[neighbour] = (node, edge_id)
+                heapq.heappush(queue, (new_cost + estimate(neighbour), next(counter), new_cost, neighbour))
+    return None
+
+# Yen's algorithm: yields loopless paths from source to target in order of increasing cost
+def k_shortest_paths(graph, source, target, weight=None, heuristic=None, max_hops=None):
+    first = shortest_path(graph, source, target, weight, heuristic)
+    if first is None:
+        return
+    found = [first]
+    yield first
+
+    candidates = []
+    seen = {tuple(first.edges)}
+    counter = itertools.count()
+    while True:
+        last = found[-1]
+        for i in range(len(last.nodes) - 1):
+            # Longer roots can only produce paths over the hop limit
+            if max_hops is not None and i >= max_hops:
+                break
+            spur_node = last.nodes[i]
+            root_nodes = last.nodes[:i + 1]
+            root_edges = last.edges[:i]
+
+            # Don't reuse the next edge of any found path sharing this root, or revisit the root
+            banned_edges = {path.edges[i] for path in found if path.nodes[:i + 1] == root_nodes and len(path.edges) > i}
+            banned_nodes = set(root_nodes[:-1])
+            spur = shortest_path(graph, spur_node, target, weight, heuristic, banned_nodes, banned_edges)
+            if spur is None:
+                continue
+
+            edges = root_edges + spur.edges
+            key = tuple(edges)
+            if key in seen:
+                continue
+            seen.add(key)
+            cost = sum(graph.weight(edge_id, weight) for edge_id in root_edges) + spur.cost
+            heapq.heappush(candidates, (cost, next(counter), Path(root_nodes[:-1] + spur.nodes, edges, cost)))
+
+        if not candidates:
+            return
+        path = heapq.heappop(candidates)[2]
+        found.append(path)
+        yield path
+
+# Up to k routes within max_depth hops whose per-criterion totals respect the min/max limits.
+# Routes are ranked by `weight` (defaults to the first criterion, or hop count without criteria)
+# and returned in the same shape Location.find_routes_to has always returned.
+def plan_routes(graph, source, target, max_depth=5, criteria=None, k=10, weight=None, max_candidates=1000):
+    criteria = criteria or {}
+    if weight is None and criteria:
+        weight = next(iter(criteria))
+
+    # A* only pays off when coordinates exist and the weight tracks distance. The stored
+    # weight needn't be at least the straight-line distance, so the heuristic is scaled down
+    # to what the edges guarantee; anything more could return a worse route first.
+    heuristic = None
+    if weight is not None and weight in ("distance", "length"):
+        scale = graph.heuristic_scale(weight)
+        if scale > 0:
+            heuristic = euclidean_heuristic(graph, target, scale=scale)
+
+    routes = []
+    for examined, path in enumerate(k_shortest_paths(graph, source, target, weight, heuristic, max_hops=max_depth)):
+        if examined >= max_candidates:
+            break
+        if len(path.edges) > max_depth:
+            continue
+
+        totals = {param: graph.path_total(path.edges, param) for param in criteria}
+        within_limits = True
+        for param, limits in criteria.items():
+            if 'min' in limits and totals[param] < float(limits['min']):
+                within_limits = False
+            if 'max' in limits and totals[param] > float(limits['max']):
+                within_limits = False
+        if not within_limits:
+            # Paths come out cheapest first, so once the ranking weight is over its max nothing later fits
+            if weight in criteria and 'max' in criteria[weight] and totals[weight] > float(criteria[weight]['max']):
+                break
+            continue
+
+        route = {
+            "nodes": path.nodes,
+            "relationships": [{"start": graph.edges[edge_id][0], "end": graph.edges[edge_id][1], "type": "ROUTE"}
+                              for edge_id in path.edges],
+        }
+        for param in criteria:
+            route[f"total_{param}"] = totals[param]
+        routes.append(route)
+        if len(routes) >= k:
+            break
+    return routes
+
+# Locations and routes are read in one read transaction so they agree with each other
+def _read_route_graph(tx, world_uuid):
+    graph = RouteGraph()
+    result = tx.run("""
+        MATCH (l:Location {world_uuid: $world_uuid})
+        RETURN l.uuid AS uuid, l.x AS x, l.y AS y
+    """, world_uuid=world_uuid)
+    for record in result:
+        graph.add_location(record["uuid"], record["x"], record["y"])
+
+    result = tx.run("""
+        MATCH (a:Location {world_uuid: $world_uuid})-[r:ROUTE]->(b:Location {world_uuid: $world_uuid})
+        RETURN a.uuid AS start, b.uuid AS end, properties(r) AS properties
+    """, world_uuid=world_uuid)
+    for record in result:
+        graph.add_edge(record["start"], record["end"], record["properties"])
+    return graph
+
+@instrumented
+def load_route_graph(driver, world_uuid):
+    return read_transaction(driver, _read_route_graph, world_uuid)
+
+# Route graphs per world, reused until the world's version moves on
+MAX_CACHED_BYTES = int(os.getenv("ROUTE_GRAPH_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+route_graph_cache = WorldSnapshotCache(max_bytes=MAX_CACHED_BYTES)
+
+def get_route_graph(driver, world_uuid, version):
+    graph = route_graph_cache.get(world_uuid, version)
+    if graph is None:
+        graph = load_route_graph(driver, world_uuid)
+        route_graph_cache.put(world_uuid, version, graph, size=graph.nbytes)
+    return graph
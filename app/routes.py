@@ -1,10 +1,152 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify
-from app.utils import User, World, NODE
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify, g, Response, stream_with_context
+from app.utils import User, World, NODE, Timeline, PopulationLimitReached, graph_node, graph_edge, uncount_relationship
+from app.schema import ensure_label_schema
+from app.unit_of_work import UnitOfWork
+from app.transactions import write_records
+from app.world_cache import snapshot_cache
+from app.autocomplete import autocomplete, autocomplete_cache
+from app.social_analytics import get_social_network, network_cache
+from app.world_frame import get_world_frame, frame_cache
+from app.route_planner import route_graph_cache
+from app.auth_cache import get_authenticated_user, user_cache
+from app.passwords import PasswordServiceBusy
+from app.index_advisor import install_index_advisor
+from app import distance_table
+from app.instrumentation import metrics, operation
+import json
+import logging
 import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Lines per chunk of the streamed editor graph
+GRAPH_STREAM_CHUNK_ROWS = int(os.getenv("GRAPH_STREAM_CHUNK_ROWS", "500"))
+
+# Nodes per page of the world dashboard / node listing
+NODE_PAGE_SIZE = int(os.getenv("NODE_PAGE_SIZE", "50"))
+NODE_PAGE_MAX_SIZE = int(os.getenv("NODE_PAGE_MAX_SIZE", "500"))
+
+# Search and autocomplete result counts; shorter queries than SEARCH_MIN_CHARS return nothing
+SEARCH_DEFAULT_LIMIT = int(os.getenv("SEARCH_DEFAULT_LIMIT", "20"))
+SEARCH_MAX_LIMIT = int(os.getenv("SEARCH_MAX_LIMIT", "100"))
+SEARCH_MIN_CHARS = int(os.getenv("SEARCH_MIN_CHARS", "2"))
+AUTOCOMPLETE_LIMIT = int(os.getenv("AUTOCOMPLETE_LIMIT", "10"))
+
+# World reports and social analytics: how many entries each ranking returns
+SOCIAL_TOP_DEFAULT = int(os.getenv("SOCIAL_TOP_DEFAULT", "20"))
+SOCIAL_TOP_MAX = int(os.getenv("SOCIAL_TOP_MAX", "200"))
+
+# Server-side caps on the editor's on-demand graph loading
+SUMMARY_DEFAULT_NODES = int(os.getenv("GRAPH_SUMMARY_NODES", "50"))
+NEIGHBOURHOOD_MAX_DEPTH = int(os.getenv("NEIGHBOURHOOD_MAX_DEPTH", "3"))
+NEIGHBOURHOOD_DEFAULT_FAN_OUT = int(os.getenv("NEIGHBOURHOOD_FAN_OUT", "25"))
+NEIGHBOURHOOD_MAX_FAN_OUT = int(os.getenv("NEIGHBOURHOOD_MAX_FAN_OUT", "200"))
+NEIGHBOURHOOD_MAX_NODES = int(os.getenv("NEIGHBOURHOOD_MAX_NODES", "500"))
+
+# The editor's live change feed (/world/<uuid>/changes). Each connection polls the world's
+# change log and ends after CHANGE_FEED_MAX_SECONDS; EventSource then reconnects and resumes
+# from the last event id, so no request holds a worker forever.
+# It does hold one for up to CHANGE_FEED_MAX_SECONDS, though, mostly asleep between polls:
+# a sync worker serves nothing else meanwhile. Serve with threads (gunicorn --worker-class
+# gthread) and size workers x threads for every editor with a world open plus the ordinary
+# concurrent requests, e.g. --workers 2 --threads 32 for around 50 open editors.
+# How long the log is kept is CHANGE_LOG_RETENTION in app/utils.py.
+CHANGE_FEED_POLL_SECONDS = float(os.getenv("CHANGE_FEED_POLL_SECONDS", "1"))
+CHANGE_FEED_HEARTBEAT_SECONDS = float(os.getenv("CHANGE_FEED_HEARTBEAT_SECONDS", "15"))
+CHANGE_FEED_MAX_SECONDS = float(os.getenv("CHANGE_FEED_MAX_SECONDS", "55"))
+CHANGE_FEED_BATCH = int(os.getenv("CHANGE_FEED_BATCH", "500"))
+
+def _snapshot_cache_gauges():
+    return [(f"storeybored_world_cache_{key}", f"World snapshot cache {key.replace('_', ' ')}", value)
+            for key, value in snapshot_cache.stats().items()]
+
+metrics.register_collector(_snapshot_cache_gauges)
+
+def _autocomplete_cache_gauges():
+    return [(f"storeybored_autocomplete_cache_{key}", f"Autocomplete index cache {key.replace('_', ' ')}", value)
+            for key, value in autocomplete_cache.stats().items()]
+
+metrics.register_collector(_autocomplete_cache_gauges)
+
+def _user_cache_gauges():
+    return [(f"storeybored_user_cache_{key}", f"Authenticated user cache {key}", value)
+            for key, value in user_cache.stats().items()]
+
+metrics.register_collector(_user_cache_gauges)
+
+def _distance_table_cache_gauges():
+    return [(f"storeybored_distance_table_cache_{key}", f"Distance table cache {key.replace('_', ' ')}", value)
+            for key, value in distance_table.table_cache.stats().items()]
+
+metrics.register_collector(_distance_table_cache_gauges)
+
+def _world_frame_cache_gauges():
+    return [(f"storeybored_world_frame_cache_{key}", f"World frame cache {key.replace('_', ' ')}", value)
+            for key, value in frame_cache.stats().items()]
+
+metrics.register_collector(_world_frame_cache_gauges)
+
+def _social_network_cache_gauges():
+    return [(f"storeybored_social_network_cache_{key}", f"Social network cache {key.replace('_', ' ')}", value)
+            for key, value in network_cache.stats().items()]
+
+metrics.register_collector(_social_network_cache_gauges)
+
+def _route_graph_cache_gauges():
+    return [(f"storeybored_route_graph_cache_{key}", f"Route graph cache {key.replace('_', ' ')}", value)
+            for key, value in route_graph_cache.stats().items()]
+
+metrics.register_collector(_route_graph_cache_gauges)
 
 def create_app_routes(driver):
     app_routes = Blueprint('app_routes', __name__, template_folder='templates')
 
+    # Suggests (INDEX_ADVISOR_MODE=advise) or creates (auto) indexes for slow property filters;
+    # installed once per driver however often the routes are built
+    index_advisor = install_index_advisor(driver)
+
+    # Connection pool use, when the driver is the managed one from app/database.py. Registered
+    # by name, so building the routes again replaces the gauges instead of repeating them.
+    pool_stats = getattr(driver, 'pool_stats', None)
+    if pool_stats is not None:
+        metrics.register_collector(lambda: [(f"storeybored_pool_{key}", f"Neo4j connection pool {key.replace('_', ' ')}", value)
+                                            for key, value in pool_stats().items() if value is not None],
+                                   name='pool')
+
+    # Each request runs in one unit of work (one session, one transaction) committed at the end.
+    # The bookmarks of the user's last write travel in their session cookie, so whichever
+    # instance and read replica serves the next request still sees that write.
+    @app_routes.before_request
+    def open_unit_of_work():
+        g.db = UnitOfWork(driver, bookmarks=session.get('bookmarks'))
+
+    @app_routes.after_request
+    def commit_unit_of_work(response):
+        unit_of_work = g.pop('db', None)
+        if unit_of_work is not None:
+            if response.status_code >= 500:
+                unit_of_work.rollback()
+            else:
+                # A failed commit means nothing was saved, whatever the view answered
+                try:
+                    unit_of_work.commit()
+                except Exception as e:
+                    logger.warning("commit_failed path=%s error=%s", request.path, e)
+                    response = jsonify({'status': 'error', 'error': 'The change could not be saved'})
+                    response.status_code = 500
+                    return response
+                if unit_of_work.bookmarks and unit_of_work.bookmarks != session.get('bookmarks'):
+                    session['bookmarks'] = unit_of_work.bookmarks
+        return response
+
+    @app_routes.teardown_request
+    def close_unit_of_work(exception):
+        # Only still set if the view raised before after_request could commit
+        unit_of_work = g.pop('db', None)
+        if unit_of_work is not None:
+            unit_of_work.rollback()
+
     @app_routes.route('/')
     def home():
         return render_template('login.html')
@@ -16,7 +158,14 @@ def create_app_routes(driver):
             password = request.form['password']
 
             user = User(username=username)
-            if user.verify_password(driver, password):
+            try:
+                verified = user.verify_password(g.db, password)
+            except PasswordServiceBusy:
+                flash('Too many people are logging in right now, please try again in a moment.', 'danger')
+                return render_template('login.html'), 503
+            if verified:
+                # A fresh login (possibly with an upgraded hash) starts from a fresh cache entry
+                user_cache.invalidate(user.uuid)
                 session['user_id'] = user.uuid
                 flash(f'Welcome back, {username}!', 'success')
                 return redirect(url_for('app_routes.dashboard'))
@@ -28,16 +177,19 @@ def create_app_routes(driver):
     @app_routes.route('/register', methods=['GET', 'POST'])
     def register():
         if request.method == 'POST':
-            print("Register form submitted")
-
             username = request.form['username']
             password = request.form['password']
             email = request.form['email']
 
-            print(f"Username: {username}, Email: {email}")
+            logger.info("register_submitted username=%s", username)
 
             user = User(username=username, properties={'email': email})
-            if user.register(driver, password):
+            try:
+                registered = user.register(g.db, password)
+            except PasswordServiceBusy:
+                flash('Too many people are signing up right now, please try again in a moment.', 'danger')
+                return render_template('register.html'), 503
+            if registered:
                 flash('Registration successful! You can now log in.', 'success')
                 return redirect(url_for('app_routes.login'))
             else:
@@ -51,14 +203,52 @@ def create_app_routes(driver):
             flash('You need to log in first.', 'warning')
             return redirect(url_for('app_routes.login'))
 
-        user = User.from_database(driver, session['user_id'])
-        worlds = user.get_worlds(driver)
+        user = get_authenticated_user(g.db, session['user_id'])
+        worlds = user.get_worlds(g.db)
 
         return render_template('dashboard.html', worlds=worlds)
 
+    # Query latency histograms (and cache gauges) in Prometheus text format
+    @app_routes.route('/metrics')
+    def prometheus_metrics():
+        return metrics.render_prometheus(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+    # Plans captured by QUERY_PLAN_SAMPLE_RATE sampling. These carry query text and
+    # parameters, so unlike /metrics (scraped by Prometheus) they need a login, as do the
+    # cache, index and pool reports below.
+    @app_routes.route('/metrics/plans')
+    def query_plans():
+        if 'user_id' not in session:
+            return redirect(url_for('app_routes.login'))
+        return jsonify(metrics.recent_plans()), 200
+
+    # Hit/miss counters for sizing the world snapshot cache
+    @app_routes.route('/cache/stats')
+    def cache_stats():
+        if 'user_id' not in session:
+            return redirect(url_for('app_routes.login'))
+        return jsonify(snapshot_cache.stats()), 200
+
+    # Existing indexes, observed property filters and suggested indexes
+    @app_routes.route('/indexes')
+    def index_report():
+        if 'user_id' not in session:
+            return redirect(url_for('app_routes.login'))
+        return jsonify(index_advisor.report()), 200
+
+    @app_routes.route('/pool/stats')
+    def connection_pool_stats():
+        if 'user_id' not in session:
+            return redirect(url_for('app_routes.login'))
+        if pool_stats is None:
+            return jsonify({'error': 'driver does not report pool stats'}), 404
+        return jsonify(pool_stats()), 200
+
     @app_routes.route('/logout')
     def logout():
-        session.pop('user_id', None)
+        user_id = session.pop('user_id', None)
+        if user_id:
+            user_cache.invalidate(user_id)
         flash('You have been logged out.', 'info')
         return redirect(url_for('app_routes.login'))
     
@@ -68,7 +258,7 @@ def create_app_routes(driver):
             flash('You need to log in first.', 'warning')
             return redirect(url_for('app_routes.login'))
 
-        user = User.from_database(driver, session['user_id'])
+        user = get_authenticated_user(g.db, session['user_id'])
 
         if request.method == 'POST':
             world_name = request.form['world_name']
@@ -76,7 +266,7 @@ def create_app_routes(driver):
                 'description': request.form.get('description', ''),
                 'pop_limit': request.form.get('pop_limit', 0)
             }
-            user.create_world(driver, world_name=world_name, world_properties=world_properties)
+            user.create_world(g.db, world_name=world_name, world_properties=world_properties)
             flash(f'World {world_name} created successfully!', 'success')
             return redirect(url_for('app_routes.dashboard'))
 
@@ -88,14 +278,51 @@ def create_app_routes(driver):
             flash('You need to log in first.', 'warning')
             return redirect(url_for('app_routes.login'))
 
-        world = World.from_database(driver, uuid=world_uuid)
-        nodes = world.get_nodes(driver)
-
-        return render_template('world_dashboard.html', world=world, nodes=nodes)
+        world = World.from_database(g.db, uuid=world_uuid)
+        try:
+            filters, page = _node_page(world, fields=('occupant_count', 'member_count'), cached=True)
+        except ValueError as e:
+            flash(str(e), 'warning')
+            return redirect(url_for('app_routes.enter_world', world_uuid=world_uuid))
+        timelines = world.get_timelines(g.db)
+
+        return render_template('world_dashboard.html', world=world, nodes=page['nodes'], next_cursor=page['next'],
+                               filters=filters, timelines=timelines)
+
+    # One page of the world's nodes from the request's label / prefix / after / limit arguments.
+    # cached: `world` was read this request, so its version can key the snapshot cache
+    def _node_page(world, fields, cached=False):
+        filters = {'label': request.args.get('label') or None, 'prefix': request.args.get('prefix') or None}
+        # The label ends up in the query text
+        if filters['label'] and not filters['label'].isidentifier():
+            raise ValueError('label must be an identifier')
+        limit = max(1, min(request.args.get('limit', NODE_PAGE_SIZE, type=int), NODE_PAGE_MAX_SIZE))
+        after = request.args.get('after') or None
+        key = (world.uuid, 'nodes', filters['label'], filters['prefix'], after, limit, tuple(fields))
+        version = world.properties.get('version', 0)
+        page = snapshot_cache.get(key, version) if cached else None
+        if page is None:
+            page = world.list_nodes(g.db, label=filters['label'], name_prefix=filters['prefix'],
+                                    after=after, limit=limit, fields=fields)
+            if cached:
+                snapshot_cache.put(key, version, page)
+        return filters, page
+
+    # The same listing as JSON; ?fields=a,b adds those properties to uuid and name
+    @app_routes.route('/world/<world_uuid>/nodes', methods=['GET'])
+    def list_world_nodes(world_uuid):
+        if 'user_id' not in session:
+            return redirect(url_for('app_routes.login'))
+        fields = [name for name in request.args.get('fields', '').split(',') if name]
+        try:
+            _, page = _node_page(World(uuid=world_uuid), fields=fields)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'error': str(e)}), 400
+        return jsonify(page), 200
     
     @app_routes.route('/world/<world_uuid>/create_node', methods=['GET', 'POST'])
     def create_node(world_uuid):
-        world = World.from_database(driver, uuid=world_uuid)
+        world = World.from_database(g.db, uuid=world_uuid)
 
         if request.method == 'POST':
             # Get the node type (label) and name
@@ -119,7 +346,12 @@ def create_app_routes(driver):
                     node_properties[prop_name] = prop_value
 
             # Create or update the node
-            world.create_or_update_node(driver, node_label=label, node_properties=node_properties)
+            ensure_label_schema(driver, label)
+            try:
+                world.create_or_update_node(g.db, node_label=label, node_properties=node_properties)
+            except PopulationLimitReached as e:
+                flash(str(e), 'danger')
+                return redirect(url_for('app_routes.enter_world', world_uuid=world_uuid))
             flash(f'{label} "{name}" has been created.', 'success')
             return redirect(url_for('app_routes.enter_world', world_uuid=world_uuid))
 
@@ -127,65 +359,229 @@ def create_app_routes(driver):
     
     @app_routes.route('/world/<world_uuid>/delete_node/<node_uuid>', methods=['POST'])
     def delete_node(world_uuid, node_uuid):
-        world = World.from_database(driver, uuid=world_uuid)
-        node = NODE.from_database(driver, uuid=node_uuid)
-        
-        # First, delete all relationships related to the node
-        with driver.session() as session:
-            session.run("MATCH (n {uuid: $uuid})-[r]-() DELETE r", uuid=node_uuid)
-        
-        # Then, delete the node itself
-        with driver.session() as session:
-            session.run("MATCH (n {uuid: $uuid}) DELETE n", uuid=node_uuid)
+        # One DETACH DELETE, only if the node is in this world
+        removed = World(uuid=world_uuid).delete_nodes(g.db, [node_uuid])
+        if not removed:
+            flash('That node is not part of this world.', 'danger')
+            return redirect(url_for('app_routes.enter_world', world_uuid=world_uuid))
 
-        flash(f'Node {node.properties["name"]} has been deleted.', 'success')
+        flash(f'Node {removed[0]["name"]} has been deleted.', 'success')
         return redirect(url_for('app_routes.enter_world', world_uuid=world_uuid))
 
+    # Bulk delete: {"uuids": [...]} or {"label": ..., "properties": {...}}, optional "cascade"
+    @app_routes.route('/world/<world_uuid>/delete_nodes', methods=['POST'])
+    def delete_nodes(world_uuid):
+        data = request.get_json() or {}
+        world = World(uuid=world_uuid)
+
+        if data.get('uuids'):
+            node_uuids = [str(node_uuid) for node_uuid in data['uuids']]
+            # Every target has to be in this world, or nothing is deleted
+            missing = sorted(set(node_uuids) - world.contained_uuids(g.db, node_uuids))
+            if missing:
+                return jsonify({'status': 'error', 'error': 'nodes not in this world', 'missing': missing}), 400
+        elif data.get('label'):
+            label = data['label']
+            properties = data.get('properties') or {}
+            # Labels and property keys end up in the query text
+            if not label.isidentifier() or not all(str(key).isidentifier() for key in properties):
+                return jsonify({'status': 'error', 'error': 'label and property names must be identifiers'}), 400
+            if properties:
+                nodes = world.find_nodes_by_label_and_properties(g.db, label, properties)
+            else:
+                nodes = world.find_nodes_by_label(g.db, label)
+            node_uuids = [node['uuid'] for node in nodes or []]
+        else:
+            return jsonify({'status': 'error', 'error': 'give either uuids or a label'}), 400
+
+        batch_size = max(1, min(int(data.get('batch_size', 1000)), 10000))
+        removed = world.delete_nodes(g.db, node_uuids, cascade=bool(data.get('cascade')), batch_size=batch_size)
+        return jsonify({
+            'status': 'success',
+            'deleted': len(removed),
+            'orphans_deleted': sum(1 for node in removed if node['orphan']),
+            'nodes': removed,
+        }), 200
+
 
     @app_routes.route('/world/<world_uuid>/edit', methods=['GET'])
     def edit_world(world_uuid):
-        world = World.from_database(driver, uuid=world_uuid)
-        nodes = world.get_nodes(driver)  # Fetching nodes
-
-        graph_data = {
-            'nodes': [],
-            'edges': []
-        }
-
-        # Populate nodes
-        for node in nodes:
-            node_properties = node.get('properties', {})
-            node_id = node_properties.get('uuid', 'undefined_uuid')
-            node_name = node_properties.get('name', 'Unnamed Node')
-            node_labels = node.get('labels', ['Unknown'])
-
-            if node_id != 'undefined_uuid':
-                graph_data['nodes'].append({
-                    'id': node_id,
-                    'label': node_name,
-                    'group': node_labels[0] if node_labels else 'Unknown'
-                })
-
-        # Retrieve relationships (edges)
-        with driver.session() as session:
-            result = session.run("""
-                MATCH (n)-[r]->(m)
-                WHERE n.uuid IN $node_ids AND m.uuid IN $node_ids
-                RETURN n.uuid AS from, m.uuid AS to, TYPE(r) AS rel_type
-            """, node_ids=[node['properties']['uuid'] for node in nodes])
-
-            for record in result:
-                graph_data['edges'].append({
-                    'from': record['from'],
-                    'to': record['to'],
-                    'label': record['rel_type']
-                })
-
-        # Debugging: Print to verify if data is correct
-        print(f"Graph Data Nodes: {graph_data['nodes']}")
-        print(f"Graph Data Edges: {graph_data['edges']}")
-
-        return render_template('edit_world.html', world=world, graph_data=graph_data)
+        world = World.from_database(g.db, uuid=world_uuid)
+        # The graph itself is fetched by the page from graph.ndjson
+        return render_template('edit_world.html', world=world)
+
+    # The world's nodes and the relationships between them as newline-delimited JSON, sent in
+    # chunks while the query is still being read. Node lines come first, so the editor can
+    # draw them before the edges arrive. Edge ids are relationship ids, as used by
+    # update_relationship / delete_relationship.
+    @app_routes.route('/world/<world_uuid>/graph.ndjson', methods=['GET'])
+    def stream_world_graph(world_uuid):
+        if 'user_id' not in session:
+            return redirect(url_for('app_routes.login'))
+        try:
+            world = World.from_database(g.db, uuid=world_uuid)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'error': str(e)}), 404
+        # The lines are kept in the snapshot cache for this version of the world
+        version = world.properties.get('version', 0)
+        cached = snapshot_cache.get(world_uuid, version)
+        # The unit of work is committed before the body is sent, so the stream reads through
+        # its own session; the cookie's bookmarks keep it behind the user's last write
+        bookmarks = session.get('bookmarks')
+
+        def generate():
+            if cached is not None:
+                for start in range(0, len(cached), GRAPH_STREAM_CHUNK_ROWS):
+                    yield '\n'.join(cached[start:start + GRAPH_STREAM_CHUNK_ROWS]) + '\n'
+                return
+            lines, sent = [], []
+            for row in world.stream_graph(driver, bookmarks=bookmarks):
+                if row['kind'] == 'node':
+                    item = {'kind': 'node', **graph_node(row['id'], row['name'], row['labels'])}
+                else:
+                    item = {'kind': 'edge', **graph_edge(row['id'], row['from'], row['to'], row['type'])}
+                lines.append(json.dumps(item))
+                if len(lines) >= GRAPH_STREAM_CHUNK_ROWS:
+                    yield '\n'.join(lines) + '\n'
+                    sent.extend(lines)
+                    lines = []
+            if lines:
+                yield '\n'.join(lines) + '\n'
+                sent.extend(lines)
+            # Only a stream read to the end is kept
+            snapshot_cache.put(world_uuid, version, sent)
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    # What the editor draws first: the best-connected nodes and the edges among them
+    @app_routes.route('/world/<world_uuid>/summary', methods=['GET'])
+    def world_summary(world_uuid):
+        if 'user_id' not in session:
+            return redirect(url_for('app_routes.login'))
+        limit = max(1, min(request.args.get('limit', SUMMARY_DEFAULT_NODES, type=int), NEIGHBOURHOOD_MAX_NODES))
+        return jsonify(World(uuid=world_uuid).top_nodes(g.db, limit=limit)), 200
+
+    # The subgraph around one node, fetched when the editor expands it. depth, the per-node
+    # fan-out (limit) and the total size are capped here whatever the client asks for.
+    @app_routes.route('/world/<world_uuid>/neighbourhood/<node_uuid>', methods=['GET'])
+    def node_neighbourhood(world_uuid, node_uuid):
+        if 'user_id' not in session:
+            return redirect(url_for('app_routes.login'))
+        depth = max(1, min(request.args.get('depth', 1, type=int), NEIGHBOURHOOD_MAX_DEPTH))
+        fan_out = max(1, min(request.args.get('limit', NEIGHBOURHOOD_DEFAULT_FAN_OUT, type=int), NEIGHBOURHOOD_MAX_FAN_OUT))
+        types = [name for name in request.args.get('types', '').split(',') if name]
+        # Relationship types end up in the query text
+        if not all(name.isidentifier() for name in types):
+            return jsonify({'status': 'error', 'error': 'relationship types must be identifiers'}), 400
+
+        neighbourhood = World(uuid=world_uuid).neighbourhood(g.db, node_uuid, depth=depth, relationship_types=types or None,
+                                                             fan_out=fan_out, max_nodes=NEIGHBOURHOOD_MAX_NODES)
+        if neighbourhood is None:
+            return jsonify({'status': 'error', 'error': 'node not in this world'}), 404
+        return jsonify(neighbourhood), 200
+
+    # Server-sent events with what changed in the world: one `change` event per node or
+    # relationship (id = its change sequence number), coalesced per poll. Resumes from the
+    # Last-Event-ID header on reconnect, else from ?after, else from now. A `reset` event
+    # means the changes asked for have been pruned and the client should reload.
+    @app_routes.route('/world/<world_uuid>/changes', methods=['GET'])
+    def world_changes(world_uuid):
+        if 'user_id' not in session:
+            return redirect(url_for('app_routes.login'))
+        world = World(uuid=world_uuid)
+        head, pruned_to = world.change_position(driver)
+        after = request.headers.get('Last-Event-ID', type=int)
+        if after is None:
+            after = request.args.get('after', head, type=int)
+
+        def generate():
+            position = after
+            yield f"retry: {int(CHANGE_FEED_POLL_SECONDS * 1000)}\n\n"
+            if position < pruned_to or position > head:
+                position = head
+                yield f"id: {position}\nevent: reset\ndata: {{}}\n\n"
+            started = last_sent = time.monotonic()
+            while time.monotonic() - started < CHANGE_FEED_MAX_SECONDS:
+                deltas, position_read = world.changes(driver, position, limit=CHANGE_FEED_BATCH)
+                if deltas:
+                    yield ''.join(f"id: {delta['seq']}\nevent: change\ndata: {json.dumps(delta)}\n\n" for delta in deltas)
+                    last_sent = time.monotonic()
+                # Anything read means there may be more waiting, so read again straight away
+                if position_read > position:
+                    position = position_read
+                    continue
+                if time.monotonic() - last_sent >= CHANGE_FEED_HEARTBEAT_SECONDS:
+                    yield ": keep-alive\n\n"
+                    last_sent = time.monotonic()
+                time.sleep(CHANGE_FEED_POLL_SECONDS)
+
+        return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    # Ranked full-text search over the world's nodes: ?q=words&labels=A,B&limit=n.
+    # The editor calls it debounced, as the user types.
+    @app_routes.route('/world/<world_uuid>/search', methods=['GET'])
+    def search_world(world_uuid):
+        if 'user_id' not in session:
+            return redirect(url_for('app_routes.login'))
+        text = request.args.get('q', '').strip()
+        labels = [name for name in request.args.get('labels', '').split(',') if name]
+        if not all(name.isidentifier() for name in labels):
+            return jsonify({'status': 'error', 'error': 'labels must be identifiers'}), 400
+        if len(text) < SEARCH_MIN_CHARS:
+            return jsonify({'results': []}), 200
+        limit = max(1, min(request.args.get('limit', SEARCH_DEFAULT_LIMIT, type=int), SEARCH_MAX_LIMIT))
+        results = World(uuid=world_uuid).search(g.db, text, labels=labels or None, limit=limit)
+        return jsonify({'results': [graph_node(result['uuid'], result['name'], result['labels'], score=result['score'])
+                                    for result in results]}), 200
+
+    # Node name completions from the in-memory index (app/autocomplete.py): ?q=prefix
+    @app_routes.route('/world/<world_uuid>/autocomplete', methods=['GET'])
+    def autocomplete_world(world_uuid):
+        if 'user_id' not in session:
+            return redirect(url_for('app_routes.login'))
+        prefix = request.args.get('q', '').strip()
+        if not prefix:
+            return jsonify({'results': []}), 200
+        limit = max(1, min(request.args.get('limit', AUTOCOMPLETE_LIMIT, type=int), SEARCH_MAX_LIMIT))
+        world = World.from_database(g.db, uuid=world_uuid)
+        return jsonify({'results': autocomplete(g.db, world, prefix, limit)}), 200
+
+    # Per-label counts and numeric statistics, best-connected nodes and the top rows of each
+    # numeric property, all from the world's in-memory frame: ?top=n
+    @app_routes.route('/world/<world_uuid>/report', methods=['GET'])
+    def world_report(world_uuid):
+        if 'user_id' not in session:
+            return redirect(url_for('app_routes.login'))
+        top = max(1, min(request.args.get('top', SOCIAL_TOP_DEFAULT, type=int), SOCIAL_TOP_MAX))
+        world = World.from_database(g.db, uuid=world_uuid)
+        return jsonify({'version': world.properties.get('version', 0), **get_world_frame(g.db, world).report(top=top)}), 200
+
+    # Degree and PageRank rankings and alliance communities of the world's characters and
+    # factions, computed in memory per world version (see app/social_analytics.py): ?top=n
+    @app_routes.route('/world/<world_uuid>/social', methods=['GET'])
+    def social_analytics(world_uuid):
+        if 'user_id' not in session:
+            return redirect(url_for('app_routes.login'))
+        top = max(1, min(request.args.get('top', SOCIAL_TOP_DEFAULT, type=int), SOCIAL_TOP_MAX))
+        world = World.from_database(g.db, uuid=world_uuid)
+        return jsonify({'version': world.properties.get('version', 0),
+                        **get_social_network(g.db, world).report(top=top)}), 200
+
+    # Shortest AT_WAR chains from ?source to ?target, or to the source's enemies' enemies
+    @app_routes.route('/world/<world_uuid>/social/enemy_chains', methods=['GET'])
+    def social_enemy_chains(world_uuid):
+        if 'user_id' not in session:
+            return redirect(url_for('app_routes.login'))
+        source = request.args.get('source')
+        if not source:
+            return jsonify({'status': 'error', 'error': 'source is required'}), 400
+        limit = max(1, min(request.args.get('limit', SOCIAL_TOP_DEFAULT, type=int), SOCIAL_TOP_MAX))
+        world = World.from_database(g.db, uuid=world_uuid)
+        chains = get_social_network(g.db, world).enemy_chains(source, request.args.get('target'), limit=limit)
+        if chains is None:
+            return jsonify({'status': 'error', 'error': 'not a character or faction of this world'}), 404
+        return jsonify({'chains': chains}), 200
 
     @app_routes.route('/world/<world_uuid>/update_node', methods=['POST'])
     def update_node(world_uuid):
@@ -193,8 +589,7 @@ def create_app_routes(driver):
 
         try:
             # Fetch the node from the database
-            node = NODE.from_database(driver, uuid=data['node_id'])
-            print(f"Node found: {node}")
+            node = NODE.from_database(g.db, uuid=data['node_id'])
 
             # Ensure node.properties is a dictionary
             if node.properties is None:
@@ -203,26 +598,25 @@ def create_app_routes(driver):
             # Update node properties (name and any additional properties)
             node.properties['name'] = data['node_name']
             node.properties.update(data['node_properties'])
-            print("Updated properties:", node.properties)
+            logger.debug("node_updated world=%s node=%s keys=%s", world_uuid, node.uuid, sorted(node.properties))
 
-            # Save the updated node to the database
-            node.create_or_update(driver)
-            print("Node updated successfully")
+            # Write now rather than at commit, so a failed write is reported here
+            g.db.flush()
 
             return jsonify({'status': 'success'}), 200
         except Exception as e:
-            print(f"Error updating node: {e}")
+            logger.warning("node_update_failed world=%s node=%s error=%s", world_uuid, data.get('node_id'), e)
             return jsonify({'error': str(e)}), 500
 
     @app_routes.route('/world/<world_uuid>/create_relationship', methods=['POST'])
     def create_relationship(world_uuid):
         data = request.get_json()
 
-        node1 = NODE.from_database(driver, uuid=data['node1'])
-        node2 = NODE.from_database(driver, uuid=data['node2'])
+        node1 = NODE.from_database(g.db, uuid=data['node1'])
+        node2 = NODE.from_database(g.db, uuid=data['node2'])
 
         # Create relationship
-        node1.create_or_update_relationship(driver, target_node_uuid=node2.uuid,
+        node1.create_or_update_relationship(g.db, target_node_uuid=node2.uuid,
                                             relationship_type=data['rel_type'],
                                             properties=data['rel_properties'],
                                             direction=False)
@@ -230,7 +624,7 @@ def create_app_routes(driver):
 
     @app_routes.route('/world/<world_uuid>/create_node_modal', methods=['POST'])
     def create_node_modal(world_uuid):
-        world = World.from_database(driver, uuid=world_uuid)
+        world = World.from_database(g.db, uuid=world_uuid)
 
         data = request.get_json()  # Get data from AJAX request
 
@@ -246,28 +640,33 @@ def create_app_routes(driver):
             node_properties[key] = value
 
         # Create or update the node
-        new_node = world.create_or_update_node(driver, node_label=label, node_properties=node_properties)
+        ensure_label_schema(driver, label)
+        try:
+            new_node = world.create_or_update_node(g.db, node_label=label, node_properties=node_properties)
+        except PopulationLimitReached as e:
+            return jsonify({'status': 'error', 'error': str(e)}), 409
         
         return jsonify({'status': 'success', 'node_id': new_node.uuid}), 200
 
     @app_routes.route('/world/<world_uuid>/update_relationship', methods=['POST'])
     def update_relationship(world_uuid):
         data = request.get_json()
-        rel_id = data['rel_id']
+        rel_id = str(data['rel_id'])
         rel_type = data['rel_type']
         rel_properties = data.get('rel_properties', {})
 
         # Update relationship logic in the database
         try:
-            with driver.session() as session:
-                query = """
-                MATCH ()-[r]->()
-                WHERE id(r) = $rel_id
-                SET r += $rel_properties
-                SET r.type = $rel_type
-                RETURN r
-                """
-                session.run(query, rel_id=rel_id, rel_properties=rel_properties, rel_type=rel_type)
+            query = """
+            MATCH ()-[r]->()
+            WHERE elementId(r) = $rel_id
+            SET r += $rel_properties
+            SET r.type = $rel_type
+            RETURN startNode(r).uuid AS start, endNode(r).uuid AS end, TYPE(r) AS type
+            """
+            with operation("update_relationship"):
+                records = write_records(g.db, query, rel_id=rel_id, rel_properties=rel_properties, rel_type=rel_type)
+            World(uuid=world_uuid).bump_version(g.db, changed_edges=[{**record.data(), 'rel_id': rel_id} for record in records])
             return jsonify({'status': 'success'}), 200
         except Exception as e:
             return jsonify({'status': 'error', 'error': str(e)}), 500
@@ -275,15 +674,118 @@ def create_app_routes(driver):
     @app_routes.route('/world/<world_uuid>/delete_relationship/<rel_id>', methods=['POST'])
     def delete_relationship(world_uuid, rel_id):
         try:
-            with driver.session() as session:
-                query = """
-                MATCH ()-[r]->()
-                WHERE id(r) = $rel_id
-                DELETE r
-                """
-                session.run(query, rel_id=int(rel_id))
+            query = """
+            MATCH (a)-[r]->(b)
+            WHERE elementId(r) = $rel_id
+            WITH a, b, r, TYPE(r) AS rel_type
+            DELETE r
+            """ + uncount_relationship("rel_type", "[a, b]") + """
+            RETURN a.uuid AS start, b.uuid AS end, rel_type
+            """
+            with operation("delete_relationship"):
+                records = write_records(g.db, query, rel_id=rel_id)
+            deleted = records[0] if records else None
+            World(uuid=world_uuid).bump_version(g.db, changed_edges=[
+                {'start': deleted['start'], 'end': deleted['end'], 'type': deleted['rel_type'], 'rel_id': rel_id}] if deleted else None)
+            if deleted and deleted['rel_type'] == 'ROUTE':
+                g.db.after_commit(lambda: distance_table.route_removed(deleted['start'], deleted['end']))
             return jsonify({'status': 'success'}), 200
         except Exception as e:
             return jsonify({'status': 'error', 'error': str(e)}), 500
 
+    # Timelines: copy-on-write branches of a world (see Timeline in app/utils.py)
+    def _world_timeline(world_uuid, timeline_uuid):
+        try:
+            timeline = NODE.from_database(g.db, timeline_uuid)
+        except ValueError:
+            return None
+        if not isinstance(timeline, Timeline) or timeline.properties.get('base_uuid') != world_uuid:
+            return None
+        return timeline
+
+    @app_routes.route('/world/<world_uuid>/create_timeline', methods=['GET', 'POST'])
+    def create_timeline(world_uuid):
+        if 'user_id' not in session:
+            flash('You need to log in first.', 'warning')
+            return redirect(url_for('app_routes.login'))
+
+        if request.method == 'POST':
+            timeline = World(uuid=world_uuid).fork(g.db, request.form['timeline_name'])
+            flash(f'Timeline {timeline.properties["name"]} created.', 'success')
+            return redirect(url_for('app_routes.enter_world', world_uuid=world_uuid))
+
+        return render_template('create_timeline.html', world_uuid=world_uuid)
+
+    # The world as the timeline sees it, in the editor's node / edge shapes
+    @app_routes.route('/world/<world_uuid>/timeline/<timeline_uuid>/graph', methods=['GET'])
+    def timeline_graph(world_uuid, timeline_uuid):
+        if 'user_id' not in session:
+            return redirect(url_for('app_routes.login'))
+        timeline = _world_timeline(world_uuid, timeline_uuid)
+        if timeline is None:
+            return jsonify({'status': 'error', 'error': 'timeline not found'}), 404
+        world = timeline.base
+        nodes = [graph_node(node['properties']['uuid'], node['properties'].get('name'), node['labels'])
+                 for node in world.get_nodes(g.db, timeline=timeline)]
+        edges = [graph_edge(None, edge['from'], edge['to'], edge['label']) for edge in world.get_edges(g.db, timeline=timeline)]
+        return jsonify({'nodes': nodes, 'edges': edges}), 200
+
+    # Same body as update_node / create_node_modal; without node_id a node is created
+    @app_routes.route('/world/<world_uuid>/timeline/<timeline_uuid>/update_node', methods=['POST'])
+    def timeline_update_node(world_uuid, timeline_uuid):
+        if 'user_id' not in session:
+            return redirect(url_for('app_routes.login'))
+        timeline = _world_timeline(world_uuid, timeline_uuid)
+        if timeline is None:
+            return jsonify({'status': 'error', 'error': 'timeline not found'}), 404
+        data = request.get_json()
+        properties = dict(data.get('node_properties') or data.get('properties') or {})
+        if data.get('node_name'):
+            properties['name'] = data['node_name']
+        try:
+            node_uuid = timeline.set_node(g.db, node_uuid=data.get('node_id'), node_label=data.get('node_type'), properties=properties)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'error': str(e)}), 400
+        return jsonify({'status': 'success', 'node_id': node_uuid}), 200
+
+    @app_routes.route('/world/<world_uuid>/timeline/<timeline_uuid>/delete_node/<node_uuid>', methods=['POST'])
+    def timeline_delete_node(world_uuid, timeline_uuid, node_uuid):
+        if 'user_id' not in session:
+            return redirect(url_for('app_routes.login'))
+        timeline = _world_timeline(world_uuid, timeline_uuid)
+        if timeline is None:
+            return jsonify({'status': 'error', 'error': 'timeline not found'}), 404
+        timeline.delete_node(g.db, node_uuid)
+        return jsonify({'status': 'success'}), 200
+
+    # {"node1", "node2", "rel_type", "rel_properties"}, or with "delete": true to remove it
+    @app_routes.route('/world/<world_uuid>/timeline/<timeline_uuid>/relationship', methods=['POST'])
+    def timeline_relationship(world_uuid, timeline_uuid):
+        if 'user_id' not in session:
+            return redirect(url_for('app_routes.login'))
+        timeline = _world_timeline(world_uuid, timeline_uuid)
+        if timeline is None:
+            return jsonify({'status': 'error', 'error': 'timeline not found'}), 404
+        data = request.get_json()
+        if not str(data.get('rel_type', '')).isidentifier():
+            return jsonify({'status': 'error', 'error': 'rel_type must be an identifier'}), 400
+        if data.get('delete'):
+            timeline.delete_relationship(g.db, data['node1'], data['node2'], data['rel_type'])
+        else:
+            timeline.set_relationship(g.db, data['node1'], data['node2'], data['rel_type'], data.get('rel_properties') or {})
+        return jsonify({'status': 'success'}), 200
+
+    # Turn the timeline into a world of its own
+    @app_routes.route('/world/<world_uuid>/timeline/<timeline_uuid>/compact', methods=['POST'])
+    def compact_timeline(world_uuid, timeline_uuid):
+        if 'user_id' not in session:
+            return redirect(url_for('app_routes.login'))
+        timeline = _world_timeline(world_uuid, timeline_uuid)
+        if timeline is None:
+            flash('That timeline does not belong to this world.', 'danger')
+            return redirect(url_for('app_routes.enter_world', world_uuid=world_uuid))
+        world = timeline.compact(g.db, name=request.form.get('world_name') or None)
+        flash(f'Timeline materialised as {world.properties["name"]}.', 'success')
+        return redirect(url_for('app_routes.enter_world', world_uuid=world.uuid))
+
     return app_routes
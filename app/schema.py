@@ -0,0 +1,103 @@
+from app.instrumentation import instrumented
+from app.utils import NODE_LABEL, SEARCH_INDEX, SEARCH_PROPERTIES, quote_name
+
+# Labels the app creates itself; custom labels are picked up from the database
+CORE_LABELS = ["User", "World", "Location", "Character", "Faction", "Timeline"]
+
+# Labels we have already created constraints and indexes for in this process
+_known_labels = set()
+
+def _create_label_schema(session, label):
+    session.run(f"""
+        CREATE CONSTRAINT {quote_name(label.lower() + '_uuid_unique')} IF NOT EXISTS
+        FOR (n:{quote_name(label)}) REQUIRE n.uuid IS UNIQUE
+    """)
+    # World-scoped reads seek on (world_uuid, name) within a label...
+    session.run(f"""
+        CREATE INDEX {quote_name(label.lower() + '_world_name')} IF NOT EXISTS
+        FOR (n:{quote_name(label)}) ON (n.world_uuid, n.name)
+    """)
+    # ...but a composite index only holds nodes that have every property, so reads on
+    # world_uuid alone (routes, counters, the social graph, nameless nodes) need their own
+    session.run(f"""
+        CREATE INDEX {quote_name(label.lower() + '_world_uuid')} IF NOT EXISTS
+        FOR (n:{quote_name(label)}) ON (n.world_uuid)
+    """)
+    _known_labels.add(label)
+
+# Full-text index for World.search. Its properties can't be changed in place, so when
+# SEARCH_PROPERTIES no longer matches the existing index it is dropped and rebuilt.
+def _create_search_index(session):
+    properties = SEARCH_PROPERTIES + ["world_uuid"]
+    existing = session.run("SHOW FULLTEXT INDEXES YIELD name, properties WHERE name = $name RETURN properties",
+                           name=SEARCH_INDEX).single()
+    if existing is not None and sorted(existing["properties"]) != sorted(properties):
+        session.run(f"DROP INDEX {quote_name(SEARCH_INDEX)} IF EXISTS")
+    session.run(f"""
+        CREATE FULLTEXT INDEX {quote_name(SEARCH_INDEX)} IF NOT EXISTS
+        FOR (n:{NODE_LABEL}) ON EACH [{", ".join("n." + quote_name(name) for name in properties)}]
+    """)
+
+@instrumented
+def bootstrap_schema(driver, batch_size=10000):
+    with driver.session() as session:
+        # Shared lookup label: one uniqueness constraint (and its index) covers every uuid lookup
+        session.run(f"""
+            CREATE CONSTRAINT node_uuid_unique IF NOT EXISTS
+            FOR (n:{NODE_LABEL}) REQUIRE n.uuid IS UNIQUE
+        """)
+
+        # ...and one (world_uuid, name) index over every world's nodes, whatever their label,
+        # plus one on world_uuid alone for the label-free reads that don't filter on name
+        session.run(f"""
+            CREATE INDEX node_world_name IF NOT EXISTS
+            FOR (n:{NODE_LABEL}) ON (n.world_uuid, n.name)
+        """)
+        session.run(f"""
+            CREATE INDEX node_world_uuid IF NOT EXISTS
+            FOR (n:{NODE_LABEL}) ON (n.world_uuid)
+        """)
+
+        _create_search_index(session)
+
+        # Per-label constraints and indexes for the core labels and any custom labels already in use
+        result = session.run("CALL db.labels() YIELD label RETURN label")
+        labels = set(CORE_LABELS) | {record["label"] for record in result}
+        labels.discard(NODE_LABEL)
+        for label in sorted(labels):
+            _create_label_schema(session, label)
+
+        # A timeline stores at most one entry per changed node / relationship
+        session.run("""
+            CREATE CONSTRAINT timeline_entry_key IF NOT EXISTS
+            FOR (e:TimelineEntry) REQUIRE (e.timeline_uuid, e.key) IS UNIQUE
+        """)
+
+        # The change feed reads a world's log entries after a sequence number
+        session.run("CREATE INDEX world_change_seq IF NOT EXISTS FOR (c:WorldChange) ON (c.world_uuid, c.seq)")
+
+        # User.find looks users up by username on every login
+        session.run("CREATE INDEX user_username IF NOT EXISTS FOR (u:User) ON (u.username)")
+
+        # Backfill the shared label onto nodes created before it existed
+        session.run(f"""
+            MATCH (n) WHERE n.uuid IS NOT NULL AND NOT n:{NODE_LABEL}
+            CALL {{ WITH n SET n:{NODE_LABEL} }} IN TRANSACTIONS OF $batch_size ROWS
+        """, batch_size=batch_size)
+
+        # Stamp nodes contained before world_uuid existed with their world's uuid
+        session.run(f"""
+            MATCH (w:World)-[:CONTAINS]->(n:{NODE_LABEL})
+            WHERE n.world_uuid IS NULL
+            CALL {{ WITH w, n SET n.world_uuid = w.uuid }} IN TRANSACTIONS OF $batch_size ROWS
+        """, batch_size=batch_size)
+
+        session.run("CALL db.awaitIndexes()")
+
+# Called before creating a node so a brand-new custom label gets its own constraint
+@instrumented
+def ensure_label_schema(driver, label):
+    if not label or label in _known_labels:
+        return
+    with driver.session() as session:
+        _create_label_schema(session, label)
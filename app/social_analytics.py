@@ -0,0 +1,263 @@
+import os
+import sys
+import threading
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse import csgraph
+
+from app.instrumentation import instrumented
+from app.transactions import read_records
+from app.utils import NODE_LABEL, graph_node
+from app.world_cache import WorldSnapshotCache, estimate_size
+
+# Social network analytics over a world's characters and factions. The whole social graph
+# (INTERACTS_WITH, AT_WAR and MEMBER relationships) is read in one query into one sparse
+# adjacency matrix per relationship type, and everything else is matrix arithmetic on those:
+#   degree      distinct neighbours per relationship type
+#   pagerank    influence over the alliance graph (interactions as stored, memberships both ways)
+#   communities alliances found by label propagation, with wars pulling labels apart
+#   enemy chains shortest AT_WAR chains ("the enemy of my enemy")
+# Results are kept per world until its version moves on.
+SOCIAL_LABELS = ("Character", "Faction")
+SOCIAL_RELATIONSHIPS = ("INTERACTS_WITH", "AT_WAR", "MEMBER")
+
+PAGERANK_DAMPING = 0.85
+PAGERANK_TOLERANCE = 1e-9
+PAGERANK_MAX_ITERATIONS = 100
+
+# Label propagation weights: a membership ties a character to its faction harder than one
+# interaction does, a node leans to keep its own label, and each war counts against a label
+MEMBER_WEIGHT = 2.0
+SELF_WEIGHT = 1.0
+WAR_WEIGHT = 1.0
+COMMUNITY_MAX_ITERATIONS = 30
+
+MAX_CACHED_BYTES = int(os.getenv("SOCIAL_ANALYTICS_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+@instrumented
+def _load_social_rows(driver, world_uuid):
+    labels = " OR ".join(f"n:{label}" for label in SOCIAL_LABELS)
+    types = "|".join(SOCIAL_RELATIONSHIPS)
+    return read_records(driver, f"""
+        MATCH (n:{NODE_LABEL} {{world_uuid: $uuid}})
+        WHERE {labels}
+        RETURN n.uuid AS uuid, n.name AS name, n:Faction AS faction,
+               [(n)-[r:{types}]->(m:{NODE_LABEL} {{world_uuid: $uuid}}) | [m.uuid, type(r)]] AS outgoing
+    """, uuid=world_uuid)
+
+# 0/1 matrix of the relationships stored i -> j (duplicates collapse to one)
+def _adjacency(starts, ends, size):
+    matrix = sparse.csr_matrix((np.ones(len(starts)), (np.asarray(starts, dtype=np.int64), np.asarray(ends, dtype=np.int64))),
+                               shape=(size, size))
+    matrix.data[:] = 1.0
+    return matrix
+
+# Either direction counts, once
+def _symmetric(matrix):
+    symmetric = (matrix + matrix.T).tocsr()
+    symmetric.data[:] = 1.0
+    return symmetric
+
+# Column and value of the largest entry in each row (the lowest column on ties; -inf for an
+# empty row). scipy's own argmax walks the rows in Python.
+def _row_max(matrix):
+    matrix = matrix.tocsr()
+    counts = np.diff(matrix.indptr)
+    found = counts > 0
+    best = np.zeros(matrix.shape[0], dtype=np.int64)
+    value = np.full(matrix.shape[0], -np.inf)
+    if matrix.nnz:
+        order = np.lexsort((matrix.indices, -matrix.data, np.repeat(np.arange(matrix.shape[0]), counts)))
+        first = order[matrix.indptr[:-1][found]]
+        best[found] = matrix.indices[first]
+        value[found] = matrix.data[first]
+    return best, value
+
+class SocialNetwork:
+    def __init__(self, uuids, names, factions, adjacency):
+        self.uuids = list(uuids)
+        self.index = {node_uuid: i for i, node_uuid in enumerate(self.uuids)}
+        self.names = list(names)
+        self.factions = np.asarray(factions, dtype=bool)
+        self.adjacency = adjacency  # relationship type -> csr matrix
+        self._pagerank = None
+        self._communities = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_rows(cls, rows):
+        uuids, names, factions, outgoing = [], [], [], []
+        for row in rows:
+            uuids.append(row["uuid"])
+            names.append(row["name"])
+            factions.append(bool(row["faction"]))
+            outgoing.append(row["outgoing"])
+        index = {node_uuid: i for i, node_uuid in enumerate(uuids)}
+        coordinates = {rel_type: ([], []) for rel_type in SOCIAL_RELATIONSHIPS}
+        for i, relationships in enumerate(outgoing):
+            for target_uuid, rel_type in relationships:
+                j = index.get(target_uuid)
+                if j is not None and j != i and rel_type in coordinates:
+                    coordinates[rel_type][0].append(i)
+                    coordinates[rel_type][1].append(j)
+        adjacency = {rel_type: _adjacency(starts, ends, len(uuids)) for rel_type, (starts, ends) in coordinates.items()}
+        return cls(uuids, names, factions, adjacency)
+
+    def __len__(self):
+        return len(self.uuids)
+
+    # Rough memory use, for the network cache's budget
+    @property
+    def nbytes(self):
+        matrices = sum(matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes for matrix in self.adjacency.values())
+        return (matrices + self.factions.nbytes + estimate_size(self.uuids) + estimate_size(self.names)
+                + sys.getsizeof(self.index))
+
+    def node(self, i, **extra):
+        return graph_node(self.uuids[i], self.names[i], ["Faction" if self.factions[i] else "Character"], **extra)
+
+    def degrees(self):
+        by_type = {rel_type: np.asarray(_symmetric(matrix).sum(axis=1)).ravel()
+                   for rel_type, matrix in self.adjacency.items()}
+        union = _symmetric(sum(self.adjacency.values()))
+        return np.asarray(union.sum(axis=1)).ravel(), by_type
+
+    # Interactions count in the direction they are stored, memberships both ways
+    def _alliance_matrix(self):
+        member = self.adjacency["MEMBER"]
+        return (self.adjacency["INTERACTS_WITH"] + member + member.T).tocsr()
+
+    # Power iteration; nodes with no outgoing ties spread their rank evenly over everyone
+    def pagerank(self):
+        with self._lock:
+            if self._pagerank is not None:
+                return self._pagerank
+        size = len(self)
+        if size == 0:
+            return np.zeros(0)
+        links = self._alliance_matrix()
+        out_weight = np.asarray(links.sum(axis=1)).ravel()
+        dangling = out_weight == 0
+        inverse = np.zeros(size)
+        np.divide(1.0, out_weight, out=inverse, where=~dangling)
+        transition = (sparse.diags(inverse) @ links).T.tocsr()
+        rank = np.full(size, 1.0 / size)
+        for _ in range(PAGERANK_MAX_ITERATIONS):
+            spread = (PAGERANK_DAMPING * rank[dangling].sum() + 1.0 - PAGERANK_DAMPING) / size
+            updated = PAGERANK_DAMPING * (transition @ rank) + spread
+            converged = np.abs(updated - rank).sum() < PAGERANK_TOLERANCE
+            rank = updated
+            if converged:
+                break
+        with self._lock:
+            self._pagerank = rank
+        return rank
+
+    # Label propagation: factions are the starting alliances (members take their faction's
+    # label, everyone else their own), then each round a random half of the nodes moves to the
+    # label with the highest weight among its neighbours (its own label included). A node keeps
+    # its label on ties or when every candidate is outweighed by wars. Returns a community
+    # index per node.
+    def communities(self):
+        with self._lock:
+            if self._communities is not None:
+                return self._communities
+        size = len(self)
+        if size == 0:
+            return np.zeros(0, dtype=np.int64)
+        member = self.adjacency["MEMBER"] * MEMBER_WEIGHT
+        weights = (_symmetric(self.adjacency["INTERACTS_WITH"]) + member + member.T
+                   + sparse.identity(size, format="csr") * SELF_WEIGHT
+                   - _symmetric(self.adjacency["AT_WAR"]) * WAR_WEIGHT).tocsr()
+        rows = np.arange(size)
+        labels = rows.copy()
+        faction_of, affiliation = _row_max(_symmetric(self.adjacency["MEMBER"])[:, self.factions])
+        affiliated = np.isfinite(affiliation) & ~self.factions
+        labels[affiliated] = np.flatnonzero(self.factions)[faction_of[affiliated]]
+
+        rng = np.random.default_rng(0)
+        for _ in range(COMMUNITY_MAX_ITERATIONS):
+            scores = (weights @ sparse.csr_matrix((np.ones(size), (rows, labels)), shape=(size, size))).tocsr()
+            best, best_score = _row_max(scores)
+            current_score = np.asarray(scores[rows, labels]).ravel()
+            improving = (best_score > current_score) & (best_score > 0)
+            if not improving.any():
+                break
+            labels = np.where(improving & (rng.random(size) < 0.5), best, labels)
+        _, communities = np.unique(labels, return_inverse=True)
+        with self._lock:
+            self._communities = communities
+        return communities
+
+    # Shortest AT_WAR chain from source to target (or, without a target, to every enemy of an
+    # enemy who isn't an enemy already). An even number of hops makes a potential ally.
+    def enemy_chains(self, source_uuid, target_uuid=None, limit=20):
+        source = self.index.get(source_uuid)
+        if source is None:
+            return None
+        war = _symmetric(self.adjacency["AT_WAR"])
+        hops, previous = csgraph.shortest_path(war, unweighted=True, directed=False, indices=source,
+                                               return_predecessors=True)
+        if target_uuid is not None:
+            target = self.index.get(target_uuid)
+            if target is None:
+                return None
+            targets = [target] if np.isfinite(hops[target]) and target != source else []
+        else:
+            candidates = np.flatnonzero(hops == 2)
+            rank = self.pagerank()
+            targets = candidates[np.argsort(-rank[candidates], kind="stable")][:limit]
+        chains = []
+        for target in targets:
+            path = [int(target)]
+            while path[-1] != source:
+                path.append(int(previous[path[-1]]))
+            chains.append({
+                "chain": [self.node(i) for i in reversed(path)],
+                "hops": len(path) - 1,
+                "relation": "ally" if (len(path) - 1) % 2 == 0 else "enemy",
+            })
+        return chains
+
+    def report(self, top=20):
+        degree, by_type = self.degrees()
+        rank = self.pagerank()
+        communities = self.communities()
+        sizes = np.bincount(communities)
+        by_community = np.argsort(communities, kind="stable")
+        starts = np.concatenate(([0], np.cumsum(sizes)))
+
+        alliances = []
+        for community in np.argsort(-sizes, kind="stable")[:top]:
+            if sizes[community] < 2:
+                break
+            members = by_community[starts[community]:starts[community + 1]]
+            leaders = members[np.argsort(-rank[members], kind="stable")][:5]
+            alliances.append({
+                "size": int(sizes[community]),
+                "factions": [self.node(i) for i in members[self.factions[members]]],
+                "leaders": [self.node(i, pagerank=float(rank[i])) for i in leaders],
+            })
+
+        return {
+            "characters": int((~self.factions).sum()),
+            "factions": int(self.factions.sum()),
+            "relationships": {rel_type: int(matrix.nnz) for rel_type, matrix in self.adjacency.items()},
+            "degree": [self.node(i, degree=int(degree[i]), **{rel_type.lower(): int(by_type[rel_type][i]) for rel_type in by_type})
+                       for i in np.argsort(-degree, kind="stable")[:top]],
+            "pagerank": [self.node(i, pagerank=float(rank[i])) for i in np.argsort(-rank, kind="stable")[:top]],
+            "communities": alliances,
+        }
+
+# Social networks per world, reused until the world's version moves on
+network_cache = WorldSnapshotCache(max_bytes=MAX_CACHED_BYTES)
+
+# The social network of `world` (a World read this request)
+def get_social_network(driver, world):
+    version = world.properties.get("version", 0)
+    network = network_cache.get(world.uuid, version)
+    if network is None:
+        network = SocialNetwork.from_rows(_load_social_rows(driver, world.uuid))
+        network_cache.put(world.uuid, version, network, size=network.nbytes)
+    return network
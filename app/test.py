@@ -1,8 +1,13 @@
 
 from neo4j import GraphDatabase
 import os
+import sys
 import uuid
-from utils import wipe_neo4j_database, NODE, User, World, Character, Location, Faction
+
+# Run as a script from anywhere: make the app package importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.utils import wipe_neo4j_database, NODE, User, World, Character, Location, Faction
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -36,12 +41,7 @@ location_list = [{'name':'Charlestown','population':100}
                  ,{'name':'Windy City','population':544}
                  ,{'name':'Belltown','population':6}]
 
-for location in location_list:
-    FirstWorld.create_or_update_node(
-        driver,
-        node_label='Location',
-        node_properties=location
-    )
+FirstWorld.bulk_create_nodes(driver,label='Location',rows=location_list)
 
 #Now create a list of locations from the database
 charlestown = NODE.from_database(driver,FirstWorld.find_nodes_by_label_and_properties(driver,label='Location',properties={'name':'Charlestown'})[0]["uuid"])
@@ -68,24 +68,14 @@ character_list = [{'name':'Glendil','age':32,'hometown':'Charlestown'}
                  ,{'name':'Foryx','age':32,'hometown':'Seattle'}
                  ,{'name':'Moryx','age':32,'hometown':'Windy City'}]
 
-for char in character_list:
-    FirstWorld.create_or_update_node(
-        driver,
-        node_label='Character',
-        node_properties=char
-    )
+FirstWorld.bulk_create_nodes(driver,label='Character',rows=character_list)
 
 faction_list = [{'name':'Pantry Guild'}
                  ,{'name':'Shelf Guild'}
                  ,{'name':'Human'}
                  ,{'name':'Creeton'}]
 
-for f in faction_list:
-    FirstWorld.create_or_update_node(
-        driver,
-        node_label='Faction',
-        node_properties=f
-    )
+FirstWorld.bulk_create_nodes(driver,label='Faction',rows=faction_list)
 
 
 
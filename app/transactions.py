@@ -0,0 +1,37 @@
+# Managed transactions for the NODE helpers.
+#
+# Reads run through session.execute_read, so in a cluster the driver routes them to a
+# follower; writes run through session.execute_write and go to the leader. Both are retried
+# on transient errors (leader switch, deadlock, dropped connection) for up to the driver's
+# max_transaction_retry_time. Work functions may be called more than once, so records are
+# collected inside the transaction and nothing outside it is touched until it succeeds.
+
+def _collect(tx, query, params):
+    return list(tx.run(query, params))
+
+def _consume(tx, query, params):
+    return tx.run(query, params).consume()
+
+# All records of one read query
+def read_records(driver, query, **params):
+    with driver.session() as session:
+        return session.execute_read(_collect, query, params)
+
+# All records of one write query
+def write_records(driver, query, **params):
+    with driver.session() as session:
+        return session.execute_write(_collect, query, params)
+
+# One write query whose records aren't needed
+def write(driver, query, **params):
+    with driver.session() as session:
+        session.execute_write(_consume, query, params)
+
+# Several statements in one read / write transaction: work(tx, *args)
+def read_transaction(driver, work, *args, **kwargs):
+    with driver.session() as session:
+        return session.execute_read(work, *args, **kwargs)
+
+def write_transaction(driver, work, *args, **kwargs):
+    with driver.session() as session:
+        return session.execute_write(work, *args, **kwargs)
@@ -0,0 +1,144 @@
+from neo4j import Bookmarks
+
+# A unit of work stands in for the driver for the length of one request.
+# Every query runs on a single session: reads before the first write run as managed
+# read transactions (routed to followers, retried), and the first write opens the
+# request's one write transaction, which every later query joins so it sees the
+# request's own writes. Nodes loaded through NODE.from_database are kept in an
+# identity map so each uuid is only fetched once, and property changes on those
+# nodes are written on commit.
+#
+# bookmarks (raw strings from an earlier unit of work, e.g. kept in the user's
+# session) make the reads wait until a follower has caught up with those writes;
+# after a commit self.bookmarks holds the ones to pass on.
+class UnitOfWork:
+    def __init__(self, driver, bookmarks=None):
+        self.driver = driver
+        self.identity_map = {}
+        self.bookmarks = list(bookmarks) if bookmarks else None
+        self._clean_properties = {}
+        self._after_commit = []
+        self._session = None
+        self._tx = None
+
+    # Driver interface: helpers open sessions as usual but all share our session and transaction
+    def session(self, **kwargs):
+        return _UnitOfWorkSession(self)
+
+    def _ensure_session(self):
+        if self._session is None:
+            if self.bookmarks:
+                self._session = self.driver.session(bookmarks=Bookmarks.from_raw_values(self.bookmarks))
+            else:
+                self._session = self.driver.session()
+        return self._session
+
+    def _ensure_transaction(self):
+        if self._tx is None:
+            self._tx = self._ensure_session().begin_transaction()
+        return self._tx
+
+    # Plain session.run is treated as a write, since we can't tell what it does
+    def run(self, query, parameters=None, **kwargs):
+        return self._ensure_transaction().run(query, parameters, **kwargs)
+
+    def execute_read(self, work, *args, **kwargs):
+        if self._tx is not None:
+            return work(self._tx, *args, **kwargs)
+        return self._ensure_session().execute_read(work, *args, **kwargs)
+
+    # Writes can't be retried on their own: a retry would need the whole request replayed
+    def execute_write(self, work, *args, **kwargs):
+        return work(self._ensure_transaction(), *args, **kwargs)
+
+    # Identity map: remember a node and the properties it had when loaded or saved
+    def track(self, node):
+        self.identity_map[node.uuid] = node
+        self._clean_properties[node.uuid] = dict(node.properties)
+
+    def get(self, uuid):
+        return self.identity_map.get(uuid)
+
+    def forget(self, uuid):
+        self.identity_map.pop(uuid, None)
+        self._clean_properties.pop(uuid, None)
+
+    def dirty_nodes(self):
+        return [node for node_uuid, node in self.identity_map.items()
+                if node.properties != self._clean_properties.get(node_uuid)]
+
+    # In-memory structures derived from the graph are only updated once the write is durable
+    def after_commit(self, callback):
+        self._after_commit.append(callback)
+
+    # Write every node whose properties changed since it was loaded
+    def flush(self):
+        for node in self.dirty_nodes():
+            node.create_or_update(self)
+
+    def commit(self):
+        try:
+            self.flush()
+            if self._tx is not None:
+                self._tx.commit()
+                last_bookmarks = getattr(self._session, "last_bookmarks", None)
+                bookmarks = last_bookmarks() if last_bookmarks is not None else None
+                if bookmarks is not None:
+                    self.bookmarks = sorted(bookmarks.raw_values)
+            callbacks = list(self._after_commit)
+        finally:
+            self.close()
+        for callback in callbacks:
+            callback()
+
+    def rollback(self):
+        if self._tx is not None:
+            self._tx.rollback()
+        self.close()
+
+    def close(self):
+        if self._tx is not None:
+            self._tx.close()
+        if self._session is not None:
+            self._session.close()
+        self._tx = None
+        self._session = None
+        self.identity_map.clear()
+        self._clean_properties.clear()
+        self._after_commit.clear()
+
+
+class _UnitOfWorkSession:
+    def __init__(self, unit_of_work):
+        self.unit_of_work = unit_of_work
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def run(self, query, parameters=None, **kwargs):
+        return self.unit_of_work.run(query, parameters, **kwargs)
+
+    def execute_read(self, work, *args, **kwargs):
+        return self.unit_of_work.execute_read(work, *args, **kwargs)
+
+    def execute_write(self, work, *args, **kwargs):
+        return self.unit_of_work.execute_write(work, *args, **kwargs)
+
+    # Explicit transactions (e.g. the bulk writers) join the request transaction
+    def begin_transaction(self, **kwargs):
+        return _NestedTransaction(self.unit_of_work)
+
+    def close(self):
+        pass
+
+
+class _NestedTransaction(_UnitOfWorkSession):
+    # The request transaction is committed once, when the request ends
+    def commit(self):
+        pass
+
+    def rollback(self):
+        raise RuntimeError("Cannot roll back part of a unit of work")
@@ -1,10 +1,206 @@
-from neo4j import GraphDatabase
+from neo4j import GraphDatabase, READ_ACCESS, Bookmarks
+import base64
+import json
+import logging
+import os
+import re
+import time
 import uuid
-from passlib.hash import bcrypt
+from app import passwords
+from app.route_planner import get_route_graph, plan_routes
+from app.transactions import read_records, read_transaction, write, write_records, write_transaction
+from app.instrumentation import instrumented, metrics, operation
+from app import distance_table
 
+logger = logging.getLogger(__name__)
+
+# Every node the app creates also carries this label so uuid lookups hit one index
+NODE_LABEL = "Node"
+
+# Backtick-quote a label, property or schema name so caller-supplied names can't break the query
+def quote_name(name):
+    return "`" + str(name).replace("`", "``") + "`"
+
+@instrumented
 def wipe_neo4j_database(driver):
-    with driver.session() as session:
-        session.run("MATCH (n) DETACH DELETE n")
+    write(driver, "MATCH (n) DETACH DELETE n")
+
+# When running inside a unit of work, keep its identity map in step with what we read or wrote
+def _track(driver, node):
+    track = getattr(driver, "track", None)
+    if track is not None:
+        track(node)
+
+# Appended to write queries on node n: moves the version of the world containing n,
+# which is what the world snapshot cache is keyed on
+BUMP_WORLD_VERSION = """
+    WITH n
+    OPTIONAL MATCH (version_world:World)-[:CONTAINS]->(n)
+    SET version_world.version = coalesce(version_world.version, 0) + 1
+"""
+
+# Log entries kept per world; a feed further behind than this reloads instead
+CHANGE_LOG_RETENTION = int(os.getenv("CHANGE_LOG_RETENTION", "10000"))
+
+# Appended to write queries: for each world in `worlds` (a Cypher list, nulls skipped) takes
+# the next change sequence number and logs what changed, for the editor's change feed
+# (World.changes). Only keys are logged; the feed reads the current state when it sends.
+# Relationship changes also log start, end, type and rel_id (elementId).
+# Each entry logged deletes the one that just fell out of the last CHANGE_LOG_RETENTION (an
+# index seek on world_uuid, seq), so the log stays bounded without a separate prune.
+# `worlds` is a list variable or a list of node variables (e.g. "[w]"); the prune subquery
+# imports them.
+def log_change(worlds, kind, key, added="false", **fields):
+    extra = "".join(f", {name}: {expression}" for name, expression in fields.items())
+    imported = ", ".join(dict.fromkeys(re.findall(r"\w+", worlds)))
+    return f"""
+    FOREACH (changed_world IN [world IN {worlds} WHERE world IS NOT NULL] |
+        SET changed_world.change_seq = coalesce(changed_world.change_seq, 0) + 1
+        CREATE (:WorldChange {{world_uuid: changed_world.uuid, seq: changed_world.change_seq, kind: '{kind}',
+                              key: {key}, added: {added}, at: timestamp(){extra}}})
+        SET changed_world.changes_pruned_to = CASE
+            WHEN changed_world.change_seq - {CHANGE_LOG_RETENTION} > coalesce(changed_world.changes_pruned_to, 0)
+            THEN changed_world.change_seq - {CHANGE_LOG_RETENTION} ELSE changed_world.changes_pruned_to END)
+    CALL {{
+        WITH {imported}
+        UNWIND [world IN {worlds} WHERE world IS NOT NULL] AS changed_world
+        MATCH (expired:WorldChange {{world_uuid: changed_world.uuid, seq: changed_world.change_seq - {CHANGE_LOG_RETENTION}}})
+        DELETE expired
+    }}
+    """
+
+EDGE_CHANGE = {"start": "startNode(r).uuid", "end": "endNode(r).uuid", "type": "type(r)", "rel_id": "elementId(r)"}
+
+def log_edge_change(worlds):
+    return log_change(worlds, "edge", "startNode(r).uuid + '|' + type(r) + '|' + endNode(r).uuid", **EDGE_CHANGE)
+
+# Full-text index behind World.search: every world's nodes, over these string properties
+# (app/schema.py rebuilds it when the list changes). world_uuid is indexed too, so a search
+# is confined to one world inside the index.
+SEARCH_INDEX = "node_search"
+SEARCH_PROPERTIES = [name for name in os.getenv("SEARCH_PROPERTIES", "name,description").split(",") if name]
+
+_LUCENE_SPECIAL = set('+-&|!(){}[]^"~*?:\\/')
+
+def _lucene_escape(text):
+    return "".join("\\" + char if char in _LUCENE_SPECIAL else char for char in text)
+
+# Every word must match one of the properties, as a whole word or a prefix; name matches rank higher
+def search_query(world_uuid, text):
+    clauses = []
+    for word in text.lower().split():
+        word = _lucene_escape(word)
+        fields = [f"{_lucene_escape(name)}:({word} OR {word}*){'^2' if name == 'name' else ''}"
+                  for name in SEARCH_PROPERTIES]
+        clauses.append("(" + " OR ".join(fields) + ")")
+    if not clauses:
+        return None
+    return f'world_uuid:"{_lucene_escape(world_uuid)}" AND ' + " AND ".join(clauses)
+
+# Counts kept on the node they describe, so dashboards and limits needn't traverse: each
+# OCCUPANT relationship counts once on its Location end, each MEMBER relationship once on
+# its Faction end, and a world's population is the number of Characters it contains.
+# Written in the same statement as the change; World.reconcile_counters repairs drift.
+RELATIONSHIP_COUNTERS = {"OCCUPANT": ("Location", "occupant_count"), "MEMBER": ("Faction", "member_count")}
+POPULATION_LABEL = "Character"
+
+# Adds `delta` to the counters on `ends` (a Cypher list) for a relationship_type relationship, when `condition`
+def count_relationship(relationship_type, delta, ends="[n, m]", condition="true"):
+    if relationship_type not in RELATIONSHIP_COUNTERS:
+        return ""
+    label, name = RELATIONSHIP_COUNTERS[relationship_type]
+    return f"""
+    FOREACH (counted IN CASE WHEN {condition} THEN [node IN {ends} WHERE node:{label}] ELSE [] END |
+        SET counted.{name} = coalesce(counted.{name}, 0) + {delta})
+    """
+
+# The same for a relationship whose type is only known to the query (type_expr), being deleted
+def uncount_relationship(type_expr, ends):
+    return "".join(count_relationship(relationship_type, -1, ends, f"{type_expr} = '{relationship_type}'")
+                   for relationship_type in RELATIONSHIP_COUNTERS)
+
+# Before DETACH DELETE of node n from world w: takes it off its neighbours' counters and,
+# for a character, off the world's population
+def uncount_node():
+    updates = "".join(f"""
+    FOREACH (counted IN [(n)-[:{relationship_type}]-(other:{label}) | other] |
+        SET counted.{name} = coalesce(counted.{name}, 0) - 1)""" for relationship_type, (label, name) in RELATIONSHIP_COUNTERS.items())
+    return updates + f"""
+    FOREACH (world IN CASE WHEN n:{POPULATION_LABEL} THEN [w] ELSE [] END |
+        SET world.population = coalesce(world.population, 0) - 1)
+    """
+
+# Adds `adding` (a Cypher expression) to `world`'s population and sets limit_reached when that
+# takes it past its pop_limit (0, unset or not a number: no limit), taking it back off again.
+# The increment holds the world's write lock until commit, so two writers can't both get in
+# under the limit the way they could with a read before the write. Keeps `carry` in scope.
+def add_population(world, adding, carry=()):
+    over = f"coalesce(toInteger({world}.pop_limit), 0) > 0 AND {world}.population > toInteger({world}.pop_limit)"
+    return f"""
+    SET {world}.population = coalesce({world}.population, 0) + {adding}
+    WITH {", ".join((world,) + tuple(carry))}, {adding} > 0 AND {over} AS limit_reached
+    FOREACH (undo IN CASE WHEN limit_reached THEN [{world}] ELSE [] END |
+        SET undo.population = undo.population - {adding})
+    """
+
+# Cypher condition: `relationship` ties its other end to `owner`, a Location it occupies or a
+# Faction it is a member of (the counted end in RELATIONSHIP_COUNTERS). Those are the nodes
+# something depends on; routes and interactions join peers.
+def anchored_by(relationship, owner):
+    return " OR ".join(f"(type({relationship}) = '{relationship_type}' AND {owner}:{label})"
+                       for relationship_type, (label, _) in RELATIONSHIP_COUNTERS.items())
+
+class PopulationLimitReached(ValueError):
+    pass
+
+# Properties the queries maintain themselves; never written back from a possibly stale copy.
+# Only world_uuid is maintained on every node; the rest only on the label that keeps them
+# (a Character's version or a Location's population is the user's own).
+MANAGED_PROPERTIES = {"world_uuid"}
+MANAGED_LABEL_PROPERTIES = {"World": {"version", "change_seq", "changes_pruned_to", "population"},
+                            "Timeline": {"version"},
+                            **{label: {name} for label, name in RELATIONSHIP_COUNTERS.values()}}
+
+def writable_properties(properties, label=None):
+    managed = MANAGED_PROPERTIES | MANAGED_LABEL_PROPERTIES.get(label, set())
+    return {key: value for key, value in properties.items() if key not in managed}
+
+# Deleted nodes must not be written back (or handed out) by the unit of work
+def _forget(driver, node_uuid):
+    forget = getattr(driver, "forget", None)
+    if forget is not None:
+        forget(node_uuid)
+
+# Run callback once the write is committed: at the end of the unit of work if there is one,
+# otherwise straight away since plain sessions auto-commit
+def _after_commit(driver, callback):
+    after_commit = getattr(driver, "after_commit", None)
+    if after_commit is not None:
+        after_commit(callback)
+    else:
+        callback()
+
+# Node and edge shapes the world editor (vis.js) draws
+def graph_node(node_uuid, name, labels, **extra):
+    return {"id": node_uuid, "label": name or "Unnamed Node", "group": labels[0] if labels else "Unknown", **extra}
+
+def graph_edge(rel_id, start_uuid, end_uuid, rel_type):
+    return {"id": rel_id, "from": start_uuid, "to": end_uuid, "label": rel_type}
+
+# Opaque page cursors for World.list_nodes: the sort key of the last row of a page
+def encode_cursor(*key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, UnicodeError):
+        raise ValueError("Invalid page cursor")
+    # (label, name, uuid); the name is null for the nameless nodes at the end of a label
+    if (not isinstance(key, list) or len(key) != 3 or not isinstance(key[0], str) or not isinstance(key[2], str)
+            or not isinstance(key[1], (str, type(None)))):
+        raise ValueError("Invalid page cursor")
+    return key
 
 # Define a class that does generic Neo4j things on a Node
 class NODE:
@@ -14,123 +210,191 @@ class NODE:
         self.properties = properties or {}
 
     @classmethod
+    @instrumented
     def from_database(cls, driver, uuid):
-        with driver.session() as session:
-            result = session.run("MATCH (n) WHERE n.uuid = $uuid RETURN labels(n) AS labels, n", uuid=uuid)
-            record = result.single()
-
-            if not record:
-                raise ValueError(f"No node found with UUID {uuid}")
-
-            labels = record["labels"]
-            properties = dict(record["n"])
-
-            if "User" in labels:
-                return User(uuid=uuid, properties=properties)
-            elif "World" in labels:
-                return World(uuid=uuid, properties=properties)
-            elif "Location" in labels:
-                return Location(uuid=uuid, properties=properties)
-            elif "Character" in labels:
-                return Character(uuid=uuid, properties=properties)
-            elif "Faction" in labels:
-                return Faction(uuid=uuid, properties=properties)
-            else:
-                return NODE(uuid=uuid, label=labels[0], properties=properties)
+        # Inside a unit of work each uuid is only fetched once per request
+        identity_map = getattr(driver, "identity_map", None)
+        if identity_map is not None and uuid in identity_map:
+            return identity_map[uuid]
+
+        records = read_records(driver, f"""
+            MATCH (n:{NODE_LABEL} {{uuid: $uuid}})
+            RETURN [label IN labels(n) WHERE label <> '{NODE_LABEL}'] AS labels, n
+        """, uuid=uuid)
+
+        if not records:
+            raise ValueError(f"No node found with UUID {uuid}")
+
+        labels = records[0]["labels"]
+        properties = dict(records[0]["n"])
+
+        if "User" in labels:
+            node = User(uuid=uuid, properties=properties)
+        elif "World" in labels:
+            node = World(uuid=uuid, properties=properties)
+        elif "Location" in labels:
+            node = Location(uuid=uuid, properties=properties)
+        elif "Character" in labels:
+            node = Character(uuid=uuid, properties=properties)
+        elif "Faction" in labels:
+            node = Faction(uuid=uuid, properties=properties)
+        elif "Timeline" in labels:
+            node = Timeline(uuid=uuid, properties=properties)
+        else:
+            node = NODE(uuid=uuid, label=labels[0], properties=properties)
+
+        _track(driver, node)
+        return node
 
+    @instrumented
     def create_or_update(self, driver):
-        with driver.session() as session:
-            if self.uuid:
-                # Existing node: update properties
-                query = f"""
-                    MATCH (n {{uuid: $uuid}})
-                    SET n += $properties
-                    RETURN n
-                """
-                session.run(query, uuid=self.uuid, properties=self.properties)
+        if self.uuid:
+            # Existing node: update properties
+            query = f"""
+                MATCH (n:{NODE_LABEL} {{uuid: $uuid}})
+                SET n += $properties
+                {BUMP_WORLD_VERSION}
+                {log_change("[version_world]", "node", "n.uuid")}
+            """
+            write(driver, query, uuid=self.uuid, properties=writable_properties(self.properties, self.label))
+        else:
+            # New node: create with properties. The uuid is picked before the write, so a
+            # retried transaction can't create the node twice (the uuid constraint stops it)
+            query = f"""
+                CREATE (n:{self.label}:{NODE_LABEL} $properties)
+                SET n.uuid = $uuid
+                RETURN n
+            """
+            node_uuid = str(uuid.uuid4())
+            write(driver, query, uuid=node_uuid, properties=writable_properties(self.properties, self.label))
+            self.uuid = node_uuid
+
+        _track(driver, self)
+
+    @instrumented
+    def find_relationships(self, driver, relationship_type=None, unique_nodes=False, direction=True, limit=None, timeline=None):
+        # Build the MATCH clause based on direction
+        if direction:
+            if relationship_type:
+                if isinstance(relationship_type, list):
+                    # Multiple relationship types
+                    relationship_types = '|'.join(relationship_type)
+                    query = f"""
+                        MATCH (n:{self.label} {{uuid: $uuid}})-[r:{relationship_types}]->(m)
+                        RETURN r, m, [label IN labels(m) WHERE label <> '{NODE_LABEL}'] AS labels
+                    """
+                else:
+                    # Single relationship type
+                    query = f"""
+                        MATCH (n:{self.label} {{uuid: $uuid}})-[r:{relationship_type}]->(m)
+                        RETURN r, m, [label IN labels(m) WHERE label <> '{NODE_LABEL}'] AS labels
+                    """
             else:
-                # New node: create with properties
+                # Any relationship type
                 query = f"""
-                    CREATE (n:{self.label} $properties)
-                    SET n.uuid = $uuid
-                    RETURN n
+                    MATCH (n:{self.label} {{uuid: $uuid}})-[r]->(m)
+                    RETURN r, m, [label IN labels(m) WHERE label <> '{NODE_LABEL}'] AS labels
                 """
-                self.uuid = str(uuid.uuid4())
-                session.run(query, uuid=self.uuid, properties=self.properties)
-
-    def find_relationships(self, driver, relationship_type=None, unique_nodes=False, direction=True):
-        with driver.session() as session:
-            # Build the MATCH clause based on direction
-            if direction:
-                if relationship_type:
-                    if isinstance(relationship_type, list):
-                        # Multiple relationship types
-                        relationship_types = '|'.join(relationship_type)
-                        query = f"""
-                            MATCH (n:{self.label} {{uuid: $uuid}})-[r:{relationship_types}]->(m)
-                            RETURN r, m, labels(m) AS labels
-                        """
-                    else:
-                        # Single relationship type
-                        query = f"""
-                            MATCH (n:{self.label} {{uuid: $uuid}})-[r:{relationship_type}]->(m)
-                            RETURN r, m, labels(m) AS labels
-                        """
-                else:
-                    # Any relationship type
+        else:
+            if relationship_type:
+                if isinstance(relationship_type, list):
+                    # Multiple relationship types
+                    relationship_types = '|'.join(relationship_type)
                     query = f"""
-                        MATCH (n:{self.label} {{uuid: $uuid}})-[r]->(m)
-                        RETURN r, m, labels(m) AS labels
+                        MATCH (n:{self.label} {{uuid: $uuid}})-[r:{relationship_types}]-(m)
+                        RETURN r, m, [label IN labels(m) WHERE label <> '{NODE_LABEL}'] AS labels
                     """
-            else:
-                if relationship_type:
-                    if isinstance(relationship_type, list):
-                        # Multiple relationship types
-                        relationship_types = '|'.join(relationship_type)
-                        query = f"""
-                            MATCH (n:{self.label} {{uuid: $uuid}})-[r:{relationship_types}]-(m)
-                            RETURN r, m, labels(m) AS labels
-                        """
-                    else:
-                        # Single relationship type
-                        query = f"""
-                            MATCH (n:{self.label} {{uuid: $uuid}})-[r:{relationship_type}]-(m)
-                            RETURN r, m, labels(m) AS labels
-                        """
                 else:
-                    # Any relationship type
+                    # Single relationship type
                     query = f"""
-                        MATCH (n:{self.label} {{uuid: $uuid}})-[r]-(m)
-                        RETURN r, m, labels(m) AS labels
+                        MATCH (n:{self.label} {{uuid: $uuid}})-[r:{relationship_type}]-(m)
+                        RETURN r, m, [label IN labels(m) WHERE label <> '{NODE_LABEL}'] AS labels
                     """
-            
-            result = session.run(query, uuid=self.uuid)
-            relationships = [(record['r'], record['m'], record['labels']) for record in result]
-            
-            if unique_nodes:
-                # Process relationships to extract unique nodes and include labels
-                nodes = {node['uuid']: {**node, 'labels': labels} for _, node, labels in relationships}.values()
-                return list(nodes)
-            return relationships if relationships else None
-
-    def create_or_update_relationship(self, driver, target_node_uuid, relationship_type, properties=None, direction=True):
-        with driver.session() as session:
-            if direction:
-                # Directed relationship: node-[r]->targetnode
-                query = f"""
-                    MATCH (n:{self.label} {{uuid: $uuid}}), (m {{uuid: $target_node_uuid}})
-                    MERGE (n)-[r:{relationship_type}]->(m)
-                    SET r += $properties
-                """
             else:
-                # Undirected relationship: node-[r]-targetnode (without specifying direction)
+                # Any relationship type
                 query = f"""
-                    MATCH (n:{self.label} {{uuid: $uuid}}), (m {{uuid: $target_node_uuid}})
-                    MERGE (n)-[r:{relationship_type}]-(m)
-                    SET r += $properties
+                    MATCH (n:{self.label} {{uuid: $uuid}})-[r]-(m)
+                    RETURN r, m, [label IN labels(m) WHERE label <> '{NODE_LABEL}'] AS labels
+                """
+
+        # At most `limit` relationships, for callers that must bound the fan-out
+        if limit is not None:
+            query += "LIMIT $limit"
+
+        relationships = [(record['r'], record['m'], record['labels'])
+                         for record in read_records(driver, query, uuid=self.uuid, limit=limit)]
+
+        # Seen through a timeline: its changes are laid over what the base world has
+        if timeline is not None:
+            relationships = timeline.merge_relationships(driver, self.uuid, relationships,
+                                                         relationship_type=relationship_type, direction=direction)
+
+        if unique_nodes:
+            # Process relationships to extract unique nodes and include labels
+            nodes = {node['uuid']: {**node, 'labels': labels} for _, node, labels in relationships}.values()
+            return list(nodes)
+        return relationships if relationships else None
+
+    @instrumented
+    def create_or_update_relationship(self, driver, target_node_uuid, relationship_type, properties=None, direction=True):
+        # A RelationshipWriteBuffer queues the upsert and writes it later in a batch
+        buffer_relationship = getattr(driver, "buffer_relationship", None)
+        if buffer_relationship is not None:
+            buffer_relationship(self.uuid, target_node_uuid, relationship_type, properties, direction)
+            return
+
+        # A world gaining a node (CONTAINS) changes that world itself. The node is stamped with
+        # the world's uuid, so world-scoped reads can seek on it instead of walking CONTAINS.
+        if self.label == "World":
+            version_bump = "SET n.version = coalesce(n.version, 0) + 1" + log_change("[n]", "node", "m.uuid", added="true")
+            if relationship_type == "CONTAINS":
+                version_bump = f"""
+                    SET m.world_uuid = n.uuid
+                    {version_bump}
                 """
-            
-            session.run(query, uuid=self.uuid, target_node_uuid=target_node_uuid, properties=properties or {})
+        else:
+            version_bump = f"""
+                WITH n, r
+                OPTIONAL MATCH (version_world:World)-[:CONTAINS]->(n)
+                SET version_world.version = coalesce(version_world.version, 0) + 1
+                {log_edge_change("[version_world]")}
+            """
+        # Directed: node-[r]->targetnode; undirected: node-[r]-targetnode (either direction matches).
+        # Counters only move when the MERGE creates the relationship, so look for it first.
+        arrow = "->" if direction else "-"
+        match = f"""
+            MATCH (n:{self.label} {{uuid: $uuid}}), (m:{NODE_LABEL} {{uuid: $target_node_uuid}})
+            OPTIONAL MATCH (n)-[existing:{relationship_type}]{arrow}(m)
+            WITH n, m, count(existing) = 0 AS created
+        """
+        merge = f"""
+            MERGE (n)-[r:{relationship_type}]{arrow}(m)
+            SET r += $properties
+            {count_relationship(relationship_type, 1, condition="created")}
+            {version_bump}
+        """
+        params = dict(uuid=self.uuid, target_node_uuid=target_node_uuid, properties=properties or {})
+
+        if self.label != "World" or relationship_type != "CONTAINS":
+            write(driver, match + merge, **params)
+            return
+
+        # A new character counts into the population, and is turned away (nothing written)
+        # when that takes the world past its pop_limit
+        query = f"""
+            {match}
+            {add_population("n", f"CASE WHEN created AND m:{POPULATION_LABEL} THEN 1 ELSE 0 END", ("m", "created"))}
+            CALL {{
+                WITH n, m, created, limit_reached
+                WITH * WHERE NOT limit_reached
+                {merge}
+                RETURN count(*) AS merged
+            }}
+            RETURN limit_reached, n.pop_limit AS pop_limit
+        """
+        records = write_records(driver, query, **params)
+        if records and records[0]["limit_reached"]:
+            raise PopulationLimitReached(f"World population limit of {records[0]['pop_limit']} reached")
 
 class World(NODE):
     def __init__(self, uuid=None, name=None, properties=None):
@@ -139,23 +403,221 @@ class World(NODE):
             self.properties["name"] = name
 
     def create_or_update_node(self, driver, node_label, node_properties, node_uuid=None, relationship_properties=None):
+        if node_uuid is None and node_label == POPULATION_LABEL:
+            self.check_population(driver, 1)
+
         # Create or update the NODE object
         node = NODE(uuid=node_uuid, label=node_label, properties=node_properties)
         node.create_or_update(driver)
 
-        # Debug: Print confirmation that the node was created/updated
-        print(f"Node created/updated: {node.uuid}")
+        logger.debug("node_upserted world=%s node=%s label=%s", self.uuid, node.uuid, node_label)
 
-        # Establish the "CONTAINS" relationship between the world and the node
-        self.create_or_update_relationship(driver, target_node_uuid=node.uuid, relationship_type="CONTAINS", properties=relationship_properties)
+        # Establish the "CONTAINS" relationship between the world and the node. A character the
+        # world turns away (it filled up since the check above) isn't left behind outside it.
+        try:
+            self.create_or_update_relationship(driver, target_node_uuid=node.uuid, relationship_type="CONTAINS", properties=relationship_properties)
+        except PopulationLimitReached:
+            if node_uuid is None:
+                write(driver, f"MATCH (n:{NODE_LABEL} {{uuid: $uuid}}) DETACH DELETE n", uuid=node.uuid)
+                _forget(driver, node.uuid)
+            raise
 
-        # Debug: Print confirmation that the relationship was created
-        print(f"Relationship 'CONTAINS' created between World {self.uuid} and Node {node.uuid}")
+        logger.debug("relationship_upserted type=CONTAINS world=%s node=%s", self.uuid, node.uuid)
 
         return node
-    
-    def get_nodes(self, driver, relationship_type="CONTAINS"):
-        relationships = self.find_relationships(driver, relationship_type=relationship_type, unique_nodes=True)
+
+    # Raises PopulationLimitReached if `adding` more characters would take the world past its
+    # pop_limit (0 or unset: no limit). Reads the maintained population, not the characters.
+    @instrumented
+    def check_population(self, driver, adding):
+        records = read_records(driver, """
+            MATCH (w:World {uuid: $uuid})
+            RETURN coalesce(w.population, 0) AS population, w.pop_limit AS pop_limit
+        """, uuid=self.uuid)
+        if not records:
+            return
+        # pop_limit comes from a form field, so it may be stored as a string
+        try:
+            pop_limit = int(records[0]["pop_limit"] or 0)
+        except (TypeError, ValueError):
+            return
+        if pop_limit > 0 and records[0]["population"] + adding > pop_limit:
+            raise PopulationLimitReached(f"World population limit of {pop_limit} reached")
+
+    # Create many nodes of one label in this world, one UNWIND batch per transaction.
+    # rows is a list of property dicts; returns the new uuids in the same order.
+    @instrumented
+    def bulk_create_nodes(self, driver, label, rows, batch_size=1000, relationship_properties=None):
+        if label == POPULATION_LABEL:
+            self.check_population(driver, len(rows))
+        uuids = [str(uuid.uuid4()) for _ in rows]
+        # A batch of characters that would take the world past its pop_limit writes nothing
+        adding = "size($batch)" if label == POPULATION_LABEL else "0"
+        query = f"""
+            MATCH (w:World {{uuid: $world_uuid}})
+            {add_population("w", adding)}
+            CALL {{
+                WITH w, limit_reached
+                WITH * WHERE NOT limit_reached
+                SET w.version = coalesce(w.version, 0) + 1
+                WITH w
+                UNWIND $batch AS row
+                CREATE (n:{quote_name(label)}:{NODE_LABEL})
+                SET n = row.properties, n.uuid = row.uuid, n.world_uuid = w.uuid
+                CREATE (w)-[r:CONTAINS]->(n)
+                SET r = $relationship_properties
+                {log_change("[w]", "node", "n.uuid", added="true")}
+                RETURN count(n) AS written
+            }}
+            RETURN written, limit_reached, w.pop_limit AS pop_limit
+        """
+        for start in range(0, len(rows), batch_size):
+            # Counters are kept by the queries, so a row can't set them (or its world) itself
+            batch = [{"uuid": node_uuid, "properties": writable_properties(properties, label)}
+                     for node_uuid, properties in zip(uuids[start:start + batch_size], rows[start:start + batch_size])]
+            records = write_records(driver, query, world_uuid=self.uuid, batch=batch,
+                                    relationship_properties=relationship_properties or {})
+            # Nothing is created when the world doesn't exist
+            if not records:
+                raise ValueError(f"No world found with UUID {self.uuid}")
+            if records[0]["limit_reached"]:
+                raise PopulationLimitReached(f"World population limit of {records[0]['pop_limit']} reached")
+        return uuids
+
+    # Merge many relationships of one type between nodes of this world.
+    # rows are (source_uuid, target_uuid) or (source_uuid, target_uuid, properties) tuples.
+    @instrumented
+    def bulk_create_relationships(self, driver, relationship_type, rows, direction=True, batch_size=1000):
+        arrow = "->" if direction else "-"
+        query = f"""
+            MATCH (w:World {{uuid: $world_uuid}})
+            SET w.version = coalesce(w.version, 0) + 1
+            WITH w
+            UNWIND $batch AS row
+            MATCH (n:{NODE_LABEL} {{uuid: row.source, world_uuid: w.uuid}}), (m:{NODE_LABEL} {{uuid: row.target, world_uuid: w.uuid}})
+            OPTIONAL MATCH (n)-[existing:{relationship_type}]{arrow}(m)
+            WITH w, row, n, m, count(existing) = 0 AS created
+            MERGE (n)-[r:{relationship_type}]{arrow}(m)
+            SET r += row.properties
+            {count_relationship(relationship_type, 1, condition="created")}
+            {log_edge_change("[w]")}
+            RETURN count(r) AS written
+        """
+        # One row per relationship (later properties win), so the counters see each new one once
+        merged = {}
+        for row in rows:
+            key = (row[0], row[1]) if direction else tuple(sorted(row[:2]))
+            merged.setdefault(key, [row[0], row[1], {}])[2].update(row[2] if len(row) > 2 and row[2] else {})
+        rows = list(merged.values())
+        written = 0
+        for start in range(0, len(rows), batch_size):
+            batch = [{"source": row[0], "target": row[1], "properties": row[2]} for row in rows[start:start + batch_size]]
+            written += write_records(driver, query, world_uuid=self.uuid, batch=batch)[0]["written"]
+        return written
+
+    # uuids (out of node_uuids) of nodes this world CONTAINS
+    @instrumented
+    def contained_uuids(self, driver, node_uuids):
+        records = read_records(driver, f"""
+            MATCH (n:{NODE_LABEL})
+            WHERE n.uuid IN $node_uuids AND n.world_uuid = $uuid
+            RETURN n.uuid AS uuid
+        """, uuid=self.uuid, node_uuids=list(node_uuids))
+        return {record["uuid"] for record in records}
+
+    # DETACH DELETE nodes of this world, batch_size per statement, and return what was removed:
+    # [{uuid, labels, name, relationships, orphan}]. Only nodes the world CONTAINS are touched,
+    # and the version only moves when a batch removes something.
+    # With cascade, nodes of the world that depended on the targets go too: those whose every
+    # location and faction (see anchored_by) is being deleted, e.g. a character whose only
+    # faction was. Locations joined by a ROUTE or characters who only INTERACTS_WITH a target stay.
+    @instrumented
+    def delete_nodes(self, driver, node_uuids, cascade=False, batch_size=1000):
+        anchor_types = "|".join(RELATIONSHIP_COUNTERS)
+        query = f"""
+            MATCH (w:World {{uuid: $world_uuid}})
+            OPTIONAL MATCH (w)-[:CONTAINS]->(n:{NODE_LABEL})
+            WHERE n.uuid IN $batch
+            WITH w, collect(n) AS targets
+            FOREACH (changed IN CASE WHEN size(targets) > 0 THEN [w] ELSE [] END |
+                SET changed.version = coalesce(changed.version, 0) + 1)
+            WITH w, targets
+            OPTIONAL MATCH (w)-[:CONTAINS]->(d:{NODE_LABEL})-[r:{anchor_types}]-(t:{NODE_LABEL})
+            WHERE $cascade AND t IN targets AND NOT d.uuid IN $all_uuids AND ({anchored_by("r", "t")})
+            WITH w, targets, collect(DISTINCT d) AS candidates
+            WITH w, targets, [d IN candidates
+                              WHERE size([(d)-[a:{anchor_types}]-(other) WHERE ({anchored_by("a", "other")})
+                                          AND NOT other.uuid IN $all_uuids | other]) = 0] AS orphans
+            UNWIND targets + orphans AS n
+            WITH w, n, n.uuid AS uuid, [label IN labels(n) WHERE label <> '{NODE_LABEL}'] AS labels, n.name AS name,
+                 size([(n)--() | 1]) AS relationships, n IN orphans AS orphan
+            {log_change("[w]", "node", "uuid")}
+            {uncount_node()}
+            DETACH DELETE n
+            RETURN uuid, labels, name, relationships, orphan
+        """
+        node_uuids = list(dict.fromkeys(node_uuids))
+        removed = []
+        for start in range(0, len(node_uuids), batch_size):
+            records = write_records(driver, query, world_uuid=self.uuid, batch=node_uuids[start:start + batch_size],
+                                    all_uuids=node_uuids, cascade=cascade)
+            removed.extend(dict(record) for record in records)
+
+        for node in removed:
+            _forget(driver, node["uuid"])
+            if "Location" in node["labels"]:
+                _after_commit(driver, lambda location_uuid=node["uuid"]: distance_table.location_removed(location_uuid))
+        return removed
+
+    # Recompute this world's counters (see RELATIONSHIP_COUNTERS) from the relationships
+    # themselves and fix the ones that drifted, e.g. after writes made outside these methods.
+    # Returns how many nodes were repaired per counter.
+    @instrumented
+    def reconcile_counters(self, driver):
+        repaired = {}
+        for relationship_type, (label, name) in RELATIONSHIP_COUNTERS.items():
+            records = write_records(driver, f"""
+                MATCH (n:{label} {{world_uuid: $uuid}})
+                WITH n, COUNT {{ (n)-[:{relationship_type}]-() }} AS actual
+                WHERE n.{name} IS NULL OR n.{name} <> actual
+                SET n.{name} = actual
+                RETURN count(n) AS repaired
+            """, uuid=self.uuid)
+            repaired[name] = records[0]["repaired"]
+        records = write_records(driver, f"""
+            MATCH (w:World {{uuid: $uuid}})
+            WITH w, COUNT {{ (w)-[:CONTAINS]->(:{POPULATION_LABEL}) }} AS actual
+            WHERE w.population IS NULL OR w.population <> actual
+            SET w.population = actual
+            RETURN count(w) AS repaired
+        """, uuid=self.uuid)
+        repaired["population"] = records[0]["repaired"]
+        return repaired
+
+    # For writes made outside these methods (raw queries in routes): moves the version and,
+    # with changed_edges [{start, end, type, rel_id}], logs them for the change feed
+    @instrumented
+    def bump_version(self, driver, changed_edges=None):
+        write(driver, f"""
+            MATCH (w:World {{uuid: $uuid}})
+            SET w.version = coalesce(w.version, 0) + 1
+            WITH w
+            UNWIND $changed_edges AS edge
+            {log_change("[w]", "edge", "edge.start + '|' + edge.type + '|' + edge.end",
+                        start="edge.start", end="edge.end", type="edge.type", rel_id="edge.rel_id")}
+        """, uuid=self.uuid, changed_edges=changed_edges or [])
+
+    @instrumented
+    def get_nodes(self, driver, relationship_type="CONTAINS", timeline=None):
+        # The world's own nodes: an index seek on world_uuid. A timeline merges its changes
+        # over the CONTAINS relationships, so that still walks them.
+        if relationship_type == "CONTAINS" and timeline is None:
+            records = read_records(driver, f"""
+                MATCH (n:{NODE_LABEL} {{world_uuid: $uuid}})
+                RETURN n, [label IN labels(n) WHERE label <> '{NODE_LABEL}'] AS labels
+            """, uuid=self.uuid)
+            return [{"properties": {**record["n"], "labels": record["labels"]}, "labels": record["labels"]} for record in records]
+        relationships = self.find_relationships(driver, relationship_type=relationship_type, unique_nodes=True, timeline=timeline)
         if relationships:
             nodes = []
             for node in relationships:
@@ -166,30 +628,328 @@ class World(NODE):
                 })
             return nodes
         return []
-    
+
+    # (change_seq, pruned_to): the last logged change, and the last one pruned from the log
+    @instrumented
+    def change_position(self, driver):
+        records = read_records(driver, """
+            MATCH (w:World {uuid: $uuid})
+            RETURN coalesce(w.change_seq, 0) AS change_seq, coalesce(w.changes_pruned_to, 0) AS pruned_to
+        """, uuid=self.uuid)
+        return (records[0]["change_seq"], records[0]["pruned_to"]) if records else (0, 0)
+
+    # Changes logged after sequence number `after` (at most `limit` log entries), as deltas
+    # for the editor: node_upsert / node_delete / edge_upsert / edge_delete with the current
+    # state of what changed. Several changes to one node or relationship become one delta,
+    # carrying the latest seq. Returns (deltas in seq order, last seq read).
+    @instrumented
+    def changes(self, driver, after, limit=500):
+        records = read_records(driver, f"""
+            MATCH (c:WorldChange {{world_uuid: $uuid}})
+            WHERE c.seq > $after
+            WITH c ORDER BY c.seq LIMIT $limit
+            OPTIONAL MATCH (:World {{uuid: $uuid}})-[:CONTAINS]->(n:{NODE_LABEL} {{uuid: c.key}})
+            WHERE c.kind = 'node'
+            OPTIONAL MATCH (:{NODE_LABEL} {{uuid: c.start}})-[r]->(:{NODE_LABEL} {{uuid: c.end}})
+            WHERE c.kind = 'edge' AND type(r) = c.type
+            WITH c, n, collect(elementId(r)) AS rel_ids
+            RETURN c.seq AS seq, c.kind AS kind, c.key AS key, c.added AS added, c.start AS start, c.end AS end,
+                   c.type AS type, c.rel_id AS rel_id, n IS NOT NULL AS exists, n.name AS name,
+                   [label IN labels(n) WHERE label <> '{NODE_LABEL}'] AS labels, rel_ids
+            ORDER BY seq
+        """, uuid=self.uuid, after=after, limit=limit)
+        deltas = {}
+        for record in records:
+            previous = deltas.pop(record["key"], None)
+            if record["kind"] == "node":
+                if record["exists"]:
+                    added = bool(record["added"]) or bool(previous and previous.get("added"))
+                    delta = {"op": "node_upsert", "added": added, "node": graph_node(record["key"], record["name"], record["labels"])}
+                else:
+                    delta = {"op": "node_delete", "id": record["key"]}
+            elif record["rel_ids"]:
+                rel_id = record["rel_id"] if record["rel_id"] in record["rel_ids"] else record["rel_ids"][0]
+                delta = {"op": "edge_upsert", "edge": graph_edge(rel_id, record["start"], record["end"], record["type"])}
+            else:
+                delta = {"op": "edge_delete", "edge": graph_edge(record["rel_id"], record["start"], record["end"], record["type"])}
+            deltas[record["key"]] = {"seq": record["seq"], **delta}
+        last_seq = records[-1]["seq"] if records else after
+        return sorted(deltas.values(), key=lambda delta: delta["seq"]), last_seq
+
+    # Drop all but the last `keep` log entries (at most batch_size per call, the rest on the
+    # next one); a feed resuming from before them has to reload. log_change keeps the log at
+    # CHANGE_LOG_RETENTION as it writes, so this is only for catching up after the retention
+    # was lowered, or on entries logged before it was.
+    @instrumented
+    def prune_changes(self, driver, keep=CHANGE_LOG_RETENTION, batch_size=10000):
+        records = write_records(driver, """
+            MATCH (w:World {uuid: $uuid})
+            WITH w, coalesce(w.change_seq, 0) - $keep AS cutoff, coalesce(w.changes_pruned_to, 0) AS pruned_to
+            SET w.changes_pruned_to = CASE WHEN cutoff > pruned_to THEN cutoff ELSE pruned_to END
+            WITH w
+            MATCH (c:WorldChange {world_uuid: $uuid})
+            WHERE c.seq <= w.changes_pruned_to
+            WITH c LIMIT $batch_size
+            DELETE c
+            RETURN count(c) AS pruned
+        """, uuid=self.uuid, keep=keep, batch_size=batch_size)
+        return records[0]["pruned"] if records else 0
+
+    # Branch the world: instant, nothing is copied (see Timeline)
+    @instrumented
+    def fork(self, driver, name):
+        timeline_uuid = str(uuid.uuid4())
+        records = write_records(driver, f"""
+            MATCH (w:World {{uuid: $world_uuid}})
+            CREATE (w)-[:HAS_TIMELINE]->(t:Timeline:{NODE_LABEL} {{uuid: $uuid, name: $name, base_uuid: $world_uuid,
+                                                                  created_at: timestamp()}})
+            RETURN properties(t) AS properties
+        """, world_uuid=self.uuid, uuid=timeline_uuid, name=name)
+        if not records:
+            raise ValueError(f"No world found with UUID {self.uuid}")
+        timeline = Timeline(uuid=timeline_uuid, properties=dict(records[0]["properties"]))
+        _track(driver, timeline)
+        return timeline
+
+    def get_timelines(self, driver):
+        return self.find_relationships(driver, relationship_type="HAS_TIMELINE", unique_nodes=True) or []
+
+    @instrumented
+    def get_edges(self, driver, timeline=None, with_properties=False):
+        records = read_records(driver, f"""
+            MATCH (n:{NODE_LABEL} {{world_uuid: $uuid}})-[r]->(m:{NODE_LABEL} {{world_uuid: $uuid}})
+            RETURN n.uuid AS from, m.uuid AS to, TYPE(r) AS rel_type{", properties(r) AS properties" if with_properties else ""}
+        """, uuid=self.uuid)
+        edges = [{"from": record["from"], "to": record["to"], "label": record["rel_type"]} for record in records]
+        if with_properties:
+            for edge, record in zip(edges, records):
+                edge["properties"] = record["properties"]
+        if timeline is not None:
+            edges = timeline.merge_edges(driver, edges)
+        return edges
+
+    # Nodes, then the relationships between them, from one query, yielded while the driver
+    # is still fetching. Runs in its own read session (not a managed transaction, which would
+    # buffer every record before returning), so it can outlive the request's unit of work.
+    def stream_graph(self, driver, bookmarks=None):
+        query = f"""
+            CALL {{
+                MATCH (n:{NODE_LABEL} {{world_uuid: $uuid}})
+                RETURN 'node' AS kind, n.uuid AS id, n.name AS name,
+                       [label IN labels(n) WHERE label <> '{NODE_LABEL}'] AS labels,
+                       null AS from, null AS to, null AS type
+                UNION ALL
+                MATCH (n:{NODE_LABEL} {{world_uuid: $uuid}})-[r]->(m:{NODE_LABEL} {{world_uuid: $uuid}})
+                RETURN 'edge' AS kind, elementId(r) AS id, null AS name, null AS labels,
+                       n.uuid AS from, m.uuid AS to, TYPE(r) AS type
+            }}
+            RETURN kind, id, name, labels, from, to, type
+        """
+        session_config = {"default_access_mode": READ_ACCESS}
+        if bookmarks:
+            session_config["bookmarks"] = Bookmarks.from_raw_values(bookmarks)
+        with driver.session(**session_config) as session:
+            # Set around the run only: a generator's context leaks to whoever consumes it
+            with operation("World.stream_graph"):
+                result = session.run(query, uuid=self.uuid)
+            for record in result:
+                yield record.data()
+
+    # The `limit` best-connected nodes of the world and the relationships among them: what
+    # the editor shows before anything is expanded. Same node / edge shapes as stream_graph.
+    @instrumented
+    def top_nodes(self, driver, limit=50):
+        return read_transaction(driver, self._read_top_nodes, limit)
+
+    def _read_top_nodes(self, tx, limit):
+        records = list(tx.run(f"""
+            MATCH (n:{NODE_LABEL} {{world_uuid: $uuid}})
+            WITH n, COUNT {{ (n)-[r]-(:{NODE_LABEL}) WHERE type(r) <> 'CONTAINS' }} AS degree
+            ORDER BY degree DESC, n.name
+            LIMIT $limit
+            RETURN n.uuid AS id, n.name AS name,
+                   [label IN labels(n) WHERE label <> '{NODE_LABEL}'] AS labels, degree
+        """, uuid=self.uuid, limit=limit))
+        nodes = [graph_node(record["id"], record["name"], record["labels"], degree=record["degree"]) for record in records]
+        edges = [graph_edge(record["id"], record["from"], record["to"], record["type"]) for record in tx.run(f"""
+            MATCH (n:{NODE_LABEL})-[r]->(m:{NODE_LABEL})
+            WHERE n.uuid IN $uuids AND m.uuid IN $uuids AND type(r) <> 'CONTAINS'
+            RETURN elementId(r) AS id, n.uuid AS from, m.uuid AS to, TYPE(r) AS type
+        """, uuids=[node["id"] for node in nodes])]
+        return {"nodes": nodes, "edges": edges}
+
+    # The part of the world within `depth` hops of node_uuid, walked one find_relationships
+    # call per node. Each node adds at most `fan_out` relationships and the walk stops at
+    # max_nodes nodes, so the result stays small however big the world is; "truncated" says
+    # whether a cap cut anything off. Returns None if the node isn't in this world.
+    def neighbourhood(self, driver, node_uuid, depth=1, relationship_types=None, fan_out=25, max_nodes=500):
+        if node_uuid not in self.contained_uuids(driver, [node_uuid]):
+            return None
+        center = NODE.from_database(driver, node_uuid)
+        nodes = {node_uuid: graph_node(node_uuid, center.properties.get("name"), [center.label], depth=0)}
+        edges = {}
+        truncated = False
+        frontier = [node_uuid]
+        for level in range(1, depth + 1):
+            found = []
+            for current in frontier:
+                # Two extra rows: one for the world's CONTAINS edge, one to tell a full page
+                # from a cut-off one
+                relationships = NODE(uuid=current, label=NODE_LABEL).find_relationships(
+                    driver, relationship_type=relationship_types, direction=False, limit=fan_out + 2) or []
+                # The world's own CONTAINS edge isn't part of the story graph
+                relationships = [(r, m, labels) for r, m, labels in relationships if r.type != "CONTAINS"]
+                if len(relationships) > fan_out:
+                    truncated = True
+                    relationships = relationships[:fan_out]
+                found.extend((current, r, m, labels) for r, m, labels in relationships)
+
+            # Only follow relationships to nodes of this world
+            in_world = self.contained_uuids(driver, {m["uuid"] for _, _, m, _ in found if m["uuid"] not in nodes})
+            frontier = []
+            for current, r, m, labels in found:
+                other = m["uuid"]
+                if other not in nodes:
+                    if other not in in_world:
+                        continue
+                    if len(nodes) >= max_nodes:
+                        truncated = True
+                        continue
+                    nodes[other] = graph_node(other, m.get("name"), labels, depth=level)
+                    frontier.append(other)
+                incoming = r.start_node.element_id == m.element_id
+                edges[r.element_id] = graph_edge(r.element_id, other if incoming else current,
+                                                  current if incoming else other, r.type)
+            if not frontier:
+                break
+        return {"center": node_uuid, "nodes": list(nodes.values()), "edges": list(edges.values()), "truncated": truncated}
+
     # Method to find all nodes with a certain label
+    @instrumented
     def find_nodes_by_label(self, driver, label):
-        with driver.session() as session:
-            query = f"""
-                MATCH (w:World {{uuid: $uuid}})-[:CONTAINS]->(n:{label})
-                RETURN n
-            """
-            result = session.run(query, uuid=self.uuid)
-            nodes = [record["n"] for record in result]
-            return nodes if nodes else None
+        query = f"""
+            MATCH (n:{quote_name(label)} {{world_uuid: $uuid}})
+            RETURN n
+        """
+        nodes = [record["n"] for record in read_records(driver, query, uuid=self.uuid)]
+        return nodes if nodes else None
 
+    @instrumented
     def find_nodes_by_label_and_properties(self, driver, label, properties):
-        with driver.session() as session:
-            # Dynamically build the WHERE clause based on the properties
-            conditions = [f"n.{key} = ${key}" for key in properties.keys()]
-            query = f"""
-                MATCH (w:World {{uuid: $uuid}})-[:CONTAINS]->(n:{label})
-                WHERE {" AND ".join(conditions)}
-                RETURN n
-            """
-            result = session.run(query, uuid=self.uuid, **properties)
-            nodes = [record["n"] for record in result]
-            return nodes if nodes else None
+        # Dynamically build the WHERE clause: names are quoted, values passed as $p0, $p1, ...
+        conditions = [f"n.{quote_name(key)} = $p{i}" for i, key in enumerate(properties)]
+        parameters = {f"p{i}": value for i, value in enumerate(properties.values())}
+        query = f"""
+            MATCH (n:{quote_name(label)} {{world_uuid: $uuid}})
+            WHERE {" AND ".join(conditions)}
+            RETURN n
+        """
+        start = time.perf_counter()
+        nodes = [record["n"] for record in read_records(driver, query, uuid=self.uuid, **parameters)]
+        # Which label/property filters are common and slow is what the index advisor works from
+        metrics.record_filter(label, list(properties), time.perf_counter() - start)
+        return nodes if nodes else None
+
+    # Nodes of this world matching `text` in the full-text index, best first:
+    # [{"uuid", "name", "labels", "score"}]. labels optionally narrows it to those labels.
+    @instrumented
+    def search(self, driver, text, labels=None, limit=20):
+        lucene_query = search_query(self.uuid, text)
+        if lucene_query is None:
+            return []
+        label_filter = " OR ".join(f"node:{quote_name(label)}" for label in labels or [])
+        records = read_records(driver, f"""
+            CALL db.index.fulltext.queryNodes($index, $search, {{limit: $candidates}})
+            YIELD node, score
+            {"WHERE " + label_filter if label_filter else ""}
+            RETURN node.uuid AS uuid, node.name AS name,
+                   [label IN labels(node) WHERE label <> '{NODE_LABEL}'] AS labels, score
+            ORDER BY score DESC
+            LIMIT $limit
+        """, index=SEARCH_INDEX, search=lucene_query, limit=limit,
+            # Label filtering happens after the index, so ask it for more than we return
+            candidates=limit * 5 if labels else limit)
+        return [record.data() for record in records]
+
+    # One page of the world's nodes, ordered by label, then name, then uuid (nodes without a
+    # name come last in their label). Each label is read in the order of its (world_uuid, name)
+    # index (app/schema.py), so a page is a range seek rather than a sort of the whole world;
+    # without a label they are paged one after another. Only uuid, name and `fields` are
+    # fetched. `after` is the cursor returned with the previous page; returns
+    # {"nodes": [{"properties", "labels"}], "next": cursor or None}.
+    @instrumented
+    def list_nodes(self, driver, label=None, name_prefix=None, after=None, limit=50, fields=()):
+        after_key = decode_cursor(after) if after else None
+        projection = "".join(f", .{quote_name(field)}" for field in fields if field not in ("uuid", "name"))
+        start = time.perf_counter()
+        # The extra row only says whether there is another page
+        rows = read_transaction(driver, self._read_node_page, label, name_prefix, after_key, limit + 1, projection)
+        if name_prefix:
+            metrics.record_filter(label or NODE_LABEL, ["name"], time.perf_counter() - start, operator="starts_with")
+        page = rows[:limit]
+        last = page[-1] if page else None
+        return {
+            "nodes": [{"properties": row["properties"], "labels": row["labels"]} for row in page],
+            "next": encode_cursor(last["label"], last["properties"]["name"], last["properties"]["uuid"]) if len(rows) > limit else None,
+        }
+
+    def _read_node_page(self, tx, label, name_prefix, after_key, wanted, projection):
+        if label:
+            labels = [label]
+        else:
+            labels = sorted(record["label"] for record in tx.run("CALL db.labels() YIELD label RETURN label")
+                            if record["label"] != NODE_LABEL)
+        rows = []
+        for current in labels:
+            if after_key is not None and current < after_key[0]:
+                continue
+            resume = after_key if after_key is not None and current == after_key[0] else None
+            rows.extend(self._read_label_page(tx, current, name_prefix, resume, wanted - len(rows), projection,
+                                              first_label_only=not label))
+            if len(rows) >= wanted:
+                break
+        return rows
+
+    # Up to `wanted` nodes of one label after `resume` (a cursor key, or None for the start).
+    # Without a label filter a node is listed under its first label only. Only world nodes
+    # (:Node) are listed: the change log's entries carry a world_uuid too.
+    def _read_label_page(self, tx, label, name_prefix, resume, wanted, projection, first_label_only):
+        visible_labels = f"[label IN labels(n) WHERE label <> '{NODE_LABEL}']"
+        conditions = [f"head({visible_labels}) = $label"] if first_label_only else []
+        returns = f"RETURN n {{.uuid, .name{projection}}} AS properties, {visible_labels} AS labels"
+        parameters = {"uuid": self.uuid, "label": label}
+        records = []
+        if resume is None or resume[1] is not None:
+            # The range on name is what lets the index both find and order the rows
+            named = conditions + ["n.name >= $from_name"]
+            parameters["from_name"] = resume[1] if resume else ""
+            if name_prefix:
+                named.append("n.name STARTS WITH $prefix")
+                parameters["prefix"] = name_prefix
+            if resume:
+                named.append("(n.name > $after_name OR n.uuid > $after_uuid)")
+                parameters.update(after_name=resume[1], after_uuid=resume[2])
+            records = list(tx.run(f"""
+                MATCH (n:{NODE_LABEL}:{quote_name(label)} {{world_uuid: $uuid}})
+                WHERE {" AND ".join(named)}
+                {returns}
+                ORDER BY n.name, n.uuid
+                LIMIT $limit
+            """, limit=wanted, **parameters))
+        if len(records) < wanted and not name_prefix:
+            # Nameless nodes aren't in the index; there are few, so these are filtered
+            nameless = conditions + ["n.name IS NULL"]
+            if resume is not None and resume[1] is None:
+                nameless.append("n.uuid > $after_uuid")
+                parameters["after_uuid"] = resume[2]
+            records += list(tx.run(f"""
+                MATCH (n:{NODE_LABEL}:{quote_name(label)} {{world_uuid: $uuid}})
+                WHERE {" AND ".join(nameless)}
+                {returns}
+                ORDER BY n.uuid
+                LIMIT $limit
+            """, limit=wanted - len(records), **parameters))
+        return [{"properties": dict(record["properties"]), "labels": record["labels"], "label": label} for record in records]
 
 class User(NODE):
     def __init__(self, uuid=None, username=None, properties=None):
@@ -197,22 +957,20 @@ class User(NODE):
         if username:
             self.properties["username"] = username
 
+    @instrumented
     def find(self, driver):
-        with driver.session() as session:
-            result = session.run(
-                "MATCH (u:User {username: $username}) RETURN u", 
-                username=self.properties.get("username")
-            )
-            user_node = result.single()
-            if user_node:
-                self.uuid = user_node["u"]["uuid"]
-                self.properties.update(user_node["u"])
-            return user_node
+        records = read_records(driver, "MATCH (u:User {username: $username}) RETURN u",
+                               username=self.properties.get("username"))
+        user_node = records[0] if records else None
+        if user_node:
+            self.uuid = user_node["u"]["uuid"]
+            self.properties.update(user_node["u"])
+        return user_node
 
     def register(self, driver, password):
         if not self.find(driver):
-            # Hash the password
-            hashed_password = bcrypt.hash(password)
+            # Hash the password (on the bounded bcrypt pool, see app/passwords.py)
+            hashed_password = passwords.hash_password(password)
             self.properties["password"] = hashed_password
             self.create_or_update(driver)
             return True
@@ -223,7 +981,13 @@ class User(NODE):
         user = self.find(driver)
         if user:
             stored_password = self.properties.get("password")
-            return bcrypt.verify(password, stored_password)
+            if not passwords.verify_password(password, stored_password):
+                return False
+            # Hashes made with an older cost are upgraded while we have the plain password
+            if passwords.needs_rehash(stored_password):
+                self.properties["password"] = passwords.hash_password(password)
+                self.create_or_update(driver)
+            return True
         else:
             return False
         
@@ -253,60 +1017,52 @@ class Location(NODE):
     # Method to connect this location to another location via a route
     def connect_to_location(self, driver, other_location_uuid, route_properties=None):
         self.create_or_update_relationship(driver, target_node_uuid=other_location_uuid, relationship_type="ROUTE", properties=route_properties, direction=False)
+        # Keep any loaded distance tables for this world up to date without a rebuild
+        _after_commit(driver, lambda: distance_table.route_changed(self.uuid, other_location_uuid, route_properties))
 
     # Method to retrieve all routes connected to this location
     def get_routes(self, driver):
         return self.find_relationships(driver, relationship_type="ROUTE", unique_nodes=True, direction=False)
     
-    def find_routes_to(self, driver, target_location_uuid, max_depth=5, criteria=None):
-        criteria = criteria or {}
-        with driver.session() as session:
-            # Start building the Cypher query
-            query = f"""
-                MATCH p=(start:Location {{uuid: '{self.uuid}'}})-[:ROUTE*..{max_depth}]-(end:Location {{uuid: '{target_location_uuid}'}})
-            """
-            
-            # Dynamically build the reduce functions for each criterion
-            aggregates = []
-            conditions = []
-            for param, limits in criteria.items():
-                aggregate = f"reduce(total_{param} = 0, rel in relationships(p) | total_{param} + coalesce(rel.{param}, 0)) AS total_{param}"
-                aggregates.append(aggregate)
-                if 'min' in limits:
-                    conditions.append(f"total_{param} >= {limits['min']}")
-                if 'max' in limits:
-                    conditions.append(f"total_{param} <= {limits['max']}")
-            
-            # Add the WITH clause if there are aggregates
-            if aggregates:
-                query += " WITH p, " + ', '.join(aggregates)
-            
-            # Add the WHERE clause if there are conditions
-            if conditions:
-                query += f" WHERE {' AND '.join(conditions)}"
-            
-            # Finally, return the path and total criteria values
-            query += " RETURN p, " + ', '.join([f"total_{param}" for param in criteria.keys()])
-
-            # Debug: Print the query
-            print("Cypher Query:", query)
-
-            # Execute the query
-            result = session.run(query)
-            
-            paths = []
-            for record in result:
-                path = record["p"]
-                nodes = [node["uuid"] for node in path.nodes]
-                relationships = [{"start": rel.start_node["uuid"], "end": rel.end_node["uuid"], "type": type(rel).__name__} for rel in path.relationships]
-                
-                path_data = {"nodes": nodes, "relationships": relationships}
-                for param in criteria.keys():
-                    path_data[f"total_{param}"] = record.get(f"total_{param}", 0)
-                
-                paths.append(path_data)
-            
-            return paths if paths else None
+    @instrumented
+    def _distance_table(self, driver, cost_property):
+        records = read_records(driver, """
+            MATCH (w:World)-[:CONTAINS]->(l:Location {uuid: $uuid})
+            RETURN w.uuid AS world_uuid, coalesce(w.version, 0) AS version, coalesce(w.change_seq, 0) AS change_seq,
+                   coalesce(w.changes_pruned_to, 0) AS pruned_to
+        """, uuid=self.uuid)
+        if not records:
+            return None
+        world = records[0]
+        return distance_table.get_distance_table(driver, world["world_uuid"], cost_property, world["version"],
+                                                 world["change_seq"], world["pruned_to"])
+
+    # Cheapest total of cost_property over ROUTEs to another location (None if unreachable),
+    # looked up in the world's precomputed distance table
+    def distance_to(self, driver, other_location_uuid, cost_property):
+        table = self._distance_table(driver, cost_property)
+        return table.distance(self.uuid, other_location_uuid) if table else None
+
+    # The next location to head for on that cheapest route
+    def next_hop(self, driver, other_location_uuid, cost_property):
+        table = self._distance_table(driver, cost_property)
+        return table.next_hop(self.uuid, other_location_uuid) if table else None
+
+    # Up to k loopless routes to the target ranked by `weight` (default: the first criterion,
+    # or hop count), planned in memory over the world's ROUTE graph (see app/route_planner.py)
+    @instrumented
+    def find_routes_to(self, driver, target_location_uuid, max_depth=5, criteria=None, k=10, weight=None):
+        records = read_records(driver, """
+            MATCH (w:World)-[:CONTAINS]->(l:Location {uuid: $uuid})
+            RETURN w.uuid AS world_uuid, coalesce(w.version, 0) AS version
+        """, uuid=self.uuid)
+        if not records:
+            return None
+        record = records[0]
+
+        graph = get_route_graph(driver, record["world_uuid"], record["version"])
+        paths = plan_routes(graph, self.uuid, target_location_uuid, max_depth=max_depth, criteria=criteria, k=k, weight=weight)
+        return paths if paths else None
 
 
 class Character(NODE):
@@ -365,3 +1121,229 @@ class Faction(NODE):
     def get_interactions(self, driver, interaction_type=None):
         return self.find_relationships(driver, relationship_type=interaction_type or "INTERACTS_WITH", unique_nodes=True)
     
+
+# A copy-on-write branch of a World. Forking creates just the Timeline node; each node or
+# relationship changed in the timeline is stored once, in full, as a TimelineEntry (key:
+# the node uuid, or "start|TYPE|end" for a relationship) and everything else is read from
+# the base world. Pass the timeline to World.get_nodes / get_edges / find_relationships to
+# see the merged result, and compact() it to turn it into a world of its own.
+class Timeline(NODE):
+    def __init__(self, uuid=None, properties=None):
+        super().__init__(uuid=uuid, label="Timeline", properties=properties)
+
+    @property
+    def base(self):
+        return World(uuid=self.properties["base_uuid"])
+
+    @staticmethod
+    def relationship_key(start_uuid, relationship_type, end_uuid):
+        return f"{start_uuid}|{relationship_type}|{end_uuid}"
+
+    @staticmethod
+    def _entry(record):
+        entry = dict(record)
+        entry["properties"] = json.loads(entry.get("properties") or "{}")
+        return entry
+
+    def _read_entries(self, tx, where="", **params):
+        records = tx.run(f"""
+            MATCH (t:Timeline {{uuid: $uuid}})-[:OVERLAY]->(e:TimelineEntry)
+            {where}
+            RETURN properties(e) AS e
+        """, uuid=self.uuid, **params)
+        return [self._entry(record["e"]) for record in records]
+
+    # Every change in the timeline: ({node uuid: entry}, {relationship key: entry})
+    @instrumented
+    def entries(self, driver):
+        entries = read_transaction(driver, self._read_entries)
+        return ({entry["key"]: entry for entry in entries if entry["kind"] == "node"},
+                {entry["key"]: entry for entry in entries if entry["kind"] == "relationship"})
+
+    def _read_nodes(self, tx, node_uuids):
+        node_entries = {entry["key"]: entry for entry in self._read_entries(
+            tx, "WHERE e.kind = 'node' AND e.key IN $node_uuids", node_uuids=list(node_uuids))}
+        missing = [node_uuid for node_uuid in node_uuids if node_uuid not in node_entries]
+        base_nodes = {record["n"]["uuid"]: (dict(record["n"]), record["labels"]) for record in tx.run(f"""
+            MATCH (n:{NODE_LABEL} {{world_uuid: $base_uuid}}) WHERE n.uuid IN $node_uuids
+            RETURN n, [label IN labels(n) WHERE label <> '{NODE_LABEL}'] AS labels
+        """, node_uuids=missing, base_uuid=self.properties["base_uuid"])}
+        return node_entries, base_nodes
+
+    # find_relationships results for node_uuid with this timeline's changes applied. Changed
+    # nodes and relationships come back as plain property dicts.
+    @instrumented
+    def merge_relationships(self, driver, node_uuid, relationships, relationship_type=None, direction=True):
+        if isinstance(relationship_type, str):
+            relationship_type = [relationship_type]
+        touching = read_transaction(driver, self._read_entries,
+                                    "WHERE e.kind = 'relationship' AND (e.start = $node_uuid OR e.end = $node_uuid)",
+                                    node_uuid=node_uuid)
+        relationship_entries = {entry["key"]: entry for entry in touching
+                                if (not relationship_type or entry["type"] in relationship_type)
+                                and (not direction or entry["start"] == node_uuid)}
+
+        rows = []
+        for r, m, labels in relationships:
+            incoming = r.start_node.element_id == m.element_id
+            start, end = (m["uuid"], node_uuid) if incoming else (node_uuid, m["uuid"])
+            entry = relationship_entries.pop(self.relationship_key(start, r.type, end), None)
+            if entry is not None:
+                if entry["deleted"]:
+                    continue
+                r = entry["properties"]
+            rows.append((r, m["uuid"], m, labels))
+        for entry in relationship_entries.values():
+            if not entry["deleted"]:
+                other = entry["end"] if entry["start"] == node_uuid else entry["start"]
+                rows.append((entry["properties"], other, None, None))
+
+        # Neighbours changed (or created) in the timeline replace the base ones
+        node_entries, base_nodes = read_transaction(driver, self._read_nodes, {other for _, other, _, _ in rows})
+        merged = []
+        for r, other, m, labels in rows:
+            entry = node_entries.get(other)
+            if entry is not None:
+                if entry["deleted"]:
+                    continue
+                m, labels = entry["properties"], entry["labels"]
+            elif m is None:
+                if other not in base_nodes:
+                    continue
+                m, labels = base_nodes[other]
+            merged.append((r, m, labels))
+        return merged
+
+    # World.get_edges results with this timeline's changes applied
+    def merge_edges(self, driver, edges):
+        node_entries, relationship_entries = self.entries(driver)
+        deleted = {key for key, entry in node_entries.items() if entry["deleted"]}
+        merged = []
+        for edge in edges:
+            entry = relationship_entries.pop(self.relationship_key(edge["from"], edge["label"], edge["to"]), None)
+            if edge["from"] in deleted or edge["to"] in deleted or (entry is not None and entry["deleted"]):
+                continue
+            if entry is not None and "properties" in edge:
+                edge = dict(edge, properties=entry["properties"])
+            merged.append(edge)
+        base_uuid = self.properties["base_uuid"]
+        for entry in relationship_entries.values():
+            # The world's own CONTAINS entries are nodes, not edges
+            if entry["deleted"] or entry["start"] == base_uuid or entry["start"] in deleted or entry["end"] in deleted:
+                continue
+            edge = {"from": entry["start"], "to": entry["end"], "label": entry["type"]}
+            if edges and "properties" in edges[0]:
+                edge["properties"] = entry["properties"]
+            merged.append(edge)
+        return merged
+
+    def _write_entry(self, tx, key, entry):
+        tx.run("""
+            MATCH (t:Timeline {uuid: $uuid})
+            MERGE (e:TimelineEntry {timeline_uuid: $uuid, key: $key})
+            MERGE (t)-[:OVERLAY]->(e)
+            SET e += $entry, t.version = coalesce(t.version, 0) + 1
+        """, uuid=self.uuid, key=key, entry={**entry, "properties": json.dumps(entry.get("properties") or {})}).consume()
+
+    # Copy-on-write: the first change to a node stores all of its properties in the timeline
+    def _set_node(self, tx, node_uuid, label, properties, create=False):
+        base_uuid = self.properties["base_uuid"]
+        entries = self._read_entries(tx, "WHERE e.key = $key", key=node_uuid)
+        if entries and not entries[0]["deleted"]:
+            labels, current = entries[0]["labels"], entries[0]["properties"]
+        else:
+            # Only the base world's own nodes can be changed here, not any node with the uuid
+            record = tx.run(f"""
+                MATCH (n:{NODE_LABEL} {{uuid: $uuid, world_uuid: $base_uuid}})
+                RETURN n, [label IN labels(n) WHERE label <> '{NODE_LABEL}'] AS labels
+            """, uuid=node_uuid, base_uuid=base_uuid).single()
+            if record is not None:
+                labels, current = record["labels"], dict(record["n"])
+            elif create and label:
+                # New in this timeline: the base world gets a CONTAINS entry for it too
+                labels, current = [label], {}
+                self._write_entry(tx, self.relationship_key(base_uuid, "CONTAINS", node_uuid), {
+                    "kind": "relationship", "start": base_uuid, "end": node_uuid, "type": "CONTAINS", "deleted": False})
+            else:
+                raise ValueError(f"No node found with UUID {node_uuid}")
+        current.update(writable_properties(properties or {}, labels[0] if labels else None))
+        current["uuid"] = node_uuid
+        self._write_entry(tx, node_uuid, {"kind": "node", "labels": labels, "properties": current, "deleted": False})
+
+    # Change (or, with node_label and no uuid, create) a node in this timeline only
+    @instrumented
+    def set_node(self, driver, node_uuid=None, node_label=None, properties=None):
+        create = node_uuid is None
+        node_uuid = node_uuid or str(uuid.uuid4())
+        write_transaction(driver, self._set_node, node_uuid, node_label, properties, create)
+        return node_uuid
+
+    @instrumented
+    def delete_node(self, driver, node_uuid):
+        write_transaction(driver, self._write_entry, node_uuid, {"kind": "node", "labels": [], "deleted": True})
+
+    def _set_relationship(self, tx, start_uuid, end_uuid, relationship_type, properties):
+        key = self.relationship_key(start_uuid, relationship_type, end_uuid)
+        entries = self._read_entries(tx, "WHERE e.key = $key", key=key)
+        if entries and not entries[0]["deleted"]:
+            current = entries[0]["properties"]
+        else:
+            record = tx.run(f"""
+                MATCH (a:{NODE_LABEL} {{uuid: $start, world_uuid: $base_uuid}})-[r:{quote_name(relationship_type)}]->(b:{NODE_LABEL} {{uuid: $end, world_uuid: $base_uuid}})
+                RETURN properties(r) AS properties
+            """, start=start_uuid, end=end_uuid, base_uuid=self.properties["base_uuid"]).single()
+            current = dict(record["properties"]) if record is not None else {}
+        current.update(properties or {})
+        self._write_entry(tx, key, {"kind": "relationship", "start": start_uuid, "end": end_uuid,
+                                    "type": relationship_type, "properties": current, "deleted": False})
+
+    @instrumented
+    def set_relationship(self, driver, start_uuid, end_uuid, relationship_type, properties=None):
+        write_transaction(driver, self._set_relationship, start_uuid, end_uuid, relationship_type, properties)
+
+    @instrumented
+    def delete_relationship(self, driver, start_uuid, end_uuid, relationship_type):
+        write_transaction(driver, self._write_entry, self.relationship_key(start_uuid, relationship_type, end_uuid), {
+            "kind": "relationship", "start": start_uuid, "end": end_uuid, "type": relationship_type, "deleted": True})
+
+    # Materialise the timeline as a standalone world (same owners), written with the bulk
+    # UNWIND writes: one query per batch of nodes of a label / relationships of a type
+    @instrumented
+    def compact(self, driver, name=None, batch_size=1000):
+        base = World.from_database(driver, self.properties["base_uuid"])
+        # The new world's counters and change log start over as the nodes are written
+        world_properties = {key: value for key, value in writable_properties(base.properties, "World").items() if key != "uuid"}
+        world_properties["name"] = name or f"{base.properties.get('name', 'World')} ({self.properties.get('name', 'timeline')})"
+        world = World(properties=world_properties)
+        world.create_or_update(driver)
+        owners = read_records(driver, "MATCH (u:User)-[:OWNS]->(w:World {uuid: $uuid}) RETURN u.uuid AS uuid", uuid=base.uuid)
+        for record in owners:
+            User(uuid=record["uuid"]).create_or_update_relationship(driver, target_node_uuid=world.uuid, relationship_type="OWNS")
+
+        by_label = {}
+        for node in base.get_nodes(driver, timeline=self):
+            label = node["labels"][0] if node["labels"] else "Node"
+            properties = {key: value for key, value in node["properties"].items() if key not in ("uuid", "labels")}
+            by_label.setdefault(label, []).append((node["properties"]["uuid"], properties))
+        new_uuids = {}
+        for label, rows in by_label.items():
+            created = world.bulk_create_nodes(driver, label, [properties for _, properties in rows], batch_size=batch_size)
+            new_uuids.update(zip([old_uuid for old_uuid, _ in rows], created))
+
+        by_type = {}
+        for edge in base.get_edges(driver, timeline=self, with_properties=True):
+            if edge["from"] in new_uuids and edge["to"] in new_uuids:
+                by_type.setdefault(edge["label"], []).append((new_uuids[edge["from"]], new_uuids[edge["to"]], edge["properties"]))
+        for relationship_type, rows in by_type.items():
+            world.bulk_create_relationships(driver, relationship_type, rows, batch_size=batch_size)
+        return world
+
+    # Drop the timeline and everything it stored; the base world is untouched
+    @instrumented
+    def discard(self, driver):
+        write(driver, """
+            MATCH (t:Timeline {uuid: $uuid})
+            OPTIONAL MATCH (t)-[:OVERLAY]->(e:TimelineEntry)
+            DETACH DELETE e, t
+        """, uuid=self.uuid)
+        _forget(driver, self.uuid)
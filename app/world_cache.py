@@ -0,0 +1,88 @@
+from collections import OrderedDict
+import os
+import sys
+import threading
+
+# Rough in-memory size of a snapshot (dicts/lists/strings), used for the memory budget
+def estimate_size(obj):
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(estimate_size(key) + estimate_size(value) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(estimate_size(item) for item in obj)
+    return size
+
+# In-process LRU cache of per-world snapshots (autocomplete indexes, distance tables, frames, ...)
+# bounded by memory. Each world keeps only the snapshot for its current version; a version
+# mismatch counts as a miss and the stale entry is replaced.
+class WorldSnapshotCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # world_uuid -> (version, snapshot, size)
+        self._lock = threading.Lock()
+
+    def get(self, world_uuid, version):
+        with self._lock:
+            entry = self._entries.get(world_uuid)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(world_uuid)
+            self.hits += 1
+            return entry[1]
+
+    # The newest entry for the key whatever its version, without counting a lookup
+    def latest(self, world_uuid):
+        with self._lock:
+            entry = self._entries.get(world_uuid)
+            return None if entry is None else (entry[0], entry[1])
+
+    def values(self):
+        with self._lock:
+            return [entry[1] for entry in self._entries.values()]
+
+    # `size` is for snapshots the estimate can't see into (numpy arrays, objects)
+    def put(self, world_uuid, version, snapshot, size=None):
+        if size is None:
+            size = estimate_size(snapshot)
+        with self._lock:
+            self._remove(world_uuid)
+            # A snapshot bigger than the whole budget is never cached
+            if size > self.max_bytes:
+                return
+            self._entries[world_uuid] = (version, snapshot, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, world_uuid):
+        with self._lock:
+            self._remove(world_uuid)
+
+    def _remove(self, world_uuid):
+        entry = self._entries.pop(world_uuid, None)
+        if entry is not None:
+            self.current_bytes -= entry[2]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+# The world pages' reads: the editor's graph lines and the dashboard's node pages, each
+# reused while the world's version is unchanged
+snapshot_cache = WorldSnapshotCache(max_bytes=int(os.getenv("WORLD_CACHE_MAX_BYTES", 64 * 1024 * 1024)))
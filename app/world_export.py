@@ -0,0 +1,224 @@
+import io
+import json
+import time
+import uuid
+
+from neo4j import READ_ACCESS
+import zstandard
+
+from app.instrumentation import instrumented
+from app.schema import ensure_label_schema
+from app.transactions import write, write_records
+from app.utils import NODE_LABEL, World, quote_name, writable_properties
+
+# One world as a zstd-compressed stream of JSON lines:
+#   {"kind": "header", "format": FORMAT, "version": 1, "world": {...}, "owners": [...]}
+#   {"kind": "node", "uuid", "labels", "properties", "contains"}   every node the world CONTAINS
+#   {"kind": "relationship", "type", "start", "end", "properties"} relationships among them
+#   {"kind": "footer", "nodes": n, "relationships": m}
+# All node lines come before the relationship lines. Both ends stream, so memory stays flat
+# however big the world is; the footer tells a complete file from a truncated one.
+FORMAT = "storeybored-world"
+FORMAT_VERSION = 1
+
+ZSTD_LEVEL = 3
+# Rows per write transaction on import
+IMPORT_BATCH_SIZE = 5000
+# Uncompressed bytes handed to zstd at a time
+_WRITE_CHUNK_BYTES = 1 << 20
+
+def _line(item):
+    return (json.dumps(item, separators=(",", ":"), ensure_ascii=False) + "\n").encode("utf-8")
+
+def _export_rows(tx, world_uuid):
+    world = tx.run(f"""
+        MATCH (w:World {{uuid: $uuid}})
+        OPTIONAL MATCH (u:User)-[:OWNS]->(w)
+        RETURN properties(w) AS properties, [label IN labels(w) WHERE label <> '{NODE_LABEL}'] AS labels,
+               collect(u.uuid) AS owners
+    """, uuid=world_uuid).single()
+    if world is None:
+        raise ValueError(f"No world found with UUID {world_uuid}")
+    yield {"kind": "header", "format": FORMAT, "version": FORMAT_VERSION, "exported_at": time.time(),
+           "world": {"uuid": world_uuid, "labels": world["labels"], "properties": world["properties"]},
+           "owners": world["owners"]}
+
+    for record in tx.run(f"""
+        MATCH (w:World {{uuid: $uuid}})-[c:CONTAINS]->(n:{NODE_LABEL})
+        RETURN n.uuid AS uuid, [label IN labels(n) WHERE label <> '{NODE_LABEL}'] AS labels,
+               properties(n) AS properties, properties(c) AS contains
+    """, uuid=world_uuid):
+        yield {"kind": "node", **record.data()}
+
+    for record in tx.run(f"""
+        MATCH (w:World {{uuid: $uuid}})-[:CONTAINS]->(n:{NODE_LABEL})-[r]->(m:{NODE_LABEL})<-[:CONTAINS]-(w)
+        RETURN TYPE(r) AS type, n.uuid AS start, m.uuid AS end, properties(r) AS properties
+    """, uuid=world_uuid):
+        yield {"kind": "relationship", **record.data()}
+
+# Write the world to `path` (or an open binary file). Everything is read in one read
+# transaction, so the file is a consistent snapshot even while the world is being edited.
+@instrumented
+def export_world(driver, world_uuid, path, level=ZSTD_LEVEL):
+    counts = {"node": 0, "relationship": 0}
+    output = open(path, "wb") if isinstance(path, str) else path
+    try:
+        with zstandard.ZstdCompressor(level=level).stream_writer(output, closefd=False) as compressed:
+            with driver.session(default_access_mode=READ_ACCESS) as session:
+                tx = session.begin_transaction()
+                try:
+                    chunk = bytearray()
+                    for item in _export_rows(tx, world_uuid):
+                        counts[item["kind"]] = counts.get(item["kind"], 0) + 1
+                        chunk += _line(item)
+                        if len(chunk) >= _WRITE_CHUNK_BYTES:
+                            compressed.write(chunk)
+                            chunk = bytearray()
+                    chunk += _line({"kind": "footer", "nodes": counts["node"], "relationships": counts["relationship"]})
+                    compressed.write(chunk)
+                finally:
+                    tx.close()
+    finally:
+        if output is not path:
+            output.close()
+    return {"nodes": counts["node"], "relationships": counts["relationship"]}
+
+def read_export(path):
+    source = open(path, "rb") if isinstance(path, str) else path
+    try:
+        with zstandard.ZstdDecompressor().stream_reader(source, closefd=False) as decompressed:
+            for line in io.TextIOWrapper(io.BufferedReader(decompressed, _WRITE_CHUNK_BYTES), encoding="utf-8"):
+                # Every row ends in a newline; one that doesn't was cut off
+                if not line.endswith("\n"):
+                    raise ValueError("Export is truncated mid-row")
+                if line.strip():
+                    yield json.loads(line)
+    finally:
+        if source is not path:
+            source.close()
+
+# New uuids for a copy are uuid5(namespace, old uuid): the same remap key always gives the
+# same uuids, so an interrupted import can simply be run again
+def remapper(remap_key):
+    if remap_key is None:
+        return lambda old_uuid: old_uuid
+    namespace = uuid.uuid5(uuid.NAMESPACE_URL, f"storeybored:{remap_key}")
+    return lambda old_uuid: str(uuid.uuid5(namespace, old_uuid))
+
+# Loads rows in batches of one label set / relationship type. Everything is MERGEd on uuid,
+# so re-running a partly finished import converges instead of duplicating.
+class _BatchWriter:
+    def __init__(self, driver, world_uuid, batch_size):
+        self.driver = driver
+        self.world_uuid = world_uuid
+        self.batch_size = batch_size
+        self.pending = {}
+        self.written = {"nodes": 0, "relationships": 0}
+
+    def add(self, key, row):
+        batch = self.pending.setdefault(key, [])
+        batch.append(row)
+        if len(batch) >= self.batch_size:
+            self._flush(key, self.pending.pop(key))
+
+    def flush(self):
+        for key, batch in list(self.pending.items()):
+            self._flush(key, batch)
+        self.pending.clear()
+
+    def _flush(self, key, batch):
+        kind, name = key
+        if kind == "node":
+            labels = ":".join(quote_name(label) for label in name)
+            query = f"""
+                MATCH (w:World {{uuid: $world_uuid}})
+                SET w.version = coalesce(w.version, 0) + 1
+                WITH w
+                UNWIND $batch AS row
+                MERGE (n:{NODE_LABEL} {{uuid: row.uuid}})
+                SET n = row.properties, n.uuid = row.uuid, n.world_uuid = w.uuid{", n:" + labels if labels else ""}
+                MERGE (w)-[c:CONTAINS]->(n)
+                SET c = row.contains
+            """
+            write(self.driver, query, world_uuid=self.world_uuid, batch=batch)
+            self.written["nodes"] += len(batch)
+        else:
+            query = f"""
+                UNWIND $batch AS row
+                MATCH (n:{NODE_LABEL} {{uuid: row.start}}), (m:{NODE_LABEL} {{uuid: row.end}})
+                MERGE (n)-[r:{quote_name(name)}]->(m)
+                SET r = row.properties
+                RETURN count(r) AS written
+            """
+            self.written["relationships"] += write_records(self.driver, query, batch=batch)[0]["written"]
+
+# Load an export into the database. With remap_key every uuid (the world's included) is
+# replaced, so the world can be copied next to its original; without it the uuids are
+# reused and importing over an existing world updates it in place. The world is owned by
+# its original owners that exist here, plus owner_uuid if given.
+@instrumented
+def import_world(driver, path, remap_key=None, owner_uuid=None, name=None, batch_size=IMPORT_BATCH_SIZE):
+    remap = remapper(remap_key)
+    rows = read_export(path)
+    header = next(rows, None)
+    if not header or header.get("kind") != "header" or header.get("format") != FORMAT:
+        raise ValueError("Not a world export, or truncated before the first rows")
+    if header["version"] > FORMAT_VERSION:
+        raise ValueError(f"Export format version {header['version']} is newer than this importer")
+
+    world = header["world"]
+    world_uuid = remap(world["uuid"])
+    # The version and change log counters are this database's own: importing over a world
+    # moves its version on rather than back to the exported one
+    properties = dict(writable_properties(world["properties"], "World"), uuid=world_uuid)
+    if name:
+        properties["name"] = name
+    owners = [owner for owner in header.get("owners", []) + [owner_uuid] if owner]
+    write(driver, f"""
+        MERGE (w:World:{NODE_LABEL} {{uuid: $uuid}})
+        SET w += $properties, w.version = coalesce(w.version, 0) + 1
+        WITH w
+        OPTIONAL MATCH (u:User) WHERE u.uuid IN $owners
+        FOREACH (owner IN CASE WHEN u IS NULL THEN [] ELSE [u] END | MERGE (owner)-[:OWNS]->(w))
+    """, uuid=world_uuid, properties=properties, owners=owners)
+
+    writer = _BatchWriter(driver, world_uuid, batch_size)
+    seen_labels = set()
+    footer = None
+    nodes_done = False
+    for item in rows:
+        kind = item["kind"]
+        if kind == "node":
+            labels = tuple(item["labels"])
+            for label in labels:
+                if label not in seen_labels:
+                    seen_labels.add(label)
+                    ensure_label_schema(driver, label)
+            writer.add(("node", labels), {"uuid": remap(item["uuid"]), "properties": item["properties"],
+                                          "contains": item.get("contains") or {}})
+        elif kind == "relationship":
+            # Relationships need both ends, so every node is written first
+            if not nodes_done:
+                writer.flush()
+                nodes_done = True
+            writer.add(("relationship", item["type"]), {"start": remap(item["start"]), "end": remap(item["end"]),
+                                                        "properties": item["properties"]})
+        elif kind == "footer":
+            footer = item
+    writer.flush()
+
+    if footer is None:
+        raise ValueError(f"Export is truncated: no footer after {writer.written['nodes']} nodes")
+    # The counters came over as plain properties; make them agree with what was imported.
+    # Relationship batches don't move the version, so it moves once more at the end.
+    imported = World(uuid=world_uuid)
+    imported.reconcile_counters(driver)
+    imported.bump_version(driver)
+    # Nothing imported went through the change log, so move the log past it: change feeds
+    # and distance tables that were following this world reload instead of missing it
+    write(driver, """
+        MATCH (w:World {uuid: $uuid})
+        WITH w, coalesce(w.change_seq, 0) + 1 AS change_seq
+        SET w.change_seq = change_seq, w.changes_pruned_to = change_seq
+    """, uuid=world_uuid)
+    return {"world_uuid": world_uuid, **writer.written}
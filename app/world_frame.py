@@ -0,0 +1,270 @@
+import math
+import os
+import sys
+
+import numpy as np
+
+from app.instrumentation import instrumented
+from app.transactions import read_transaction
+from app.utils import NODE_LABEL, graph_edge, graph_node, quote_name
+from app.world_cache import WorldSnapshotCache, estimate_size
+
+# A whole world loaded once into columns instead of a dict (and a NODE) per node:
+#   uuids      interned strings, with a uuid -> row index map
+#   names      object array
+#   labels     one small int per node (label_codes) into the label_names dictionary
+#   numbers    a float64 array per numeric property (NaN where missing or not a number)
+#   edges      start / end / type code per relationship, indexed both ways as CSR
+#              (out_indptr/out_edges and in_indptr/in_edges: the edges of row i are
+#              out_edges[out_indptr[i]:out_indptr[i + 1]])
+# Selections are arrays of row indices, so filtering, sorting and grouping are numpy
+# operations over whole columns. Frames are kept per world until its version moves on.
+NUMERIC_PROPERTIES = tuple(name.strip() for name in os.getenv("FRAME_NUMERIC_PROPERTIES", "population,age").split(",")
+                           if name.strip())
+
+MAX_CACHED_BYTES = int(os.getenv("WORLD_FRAME_CACHE_MAX_BYTES", 128 * 1024 * 1024))
+
+# Numeric properties come from forms as strings as often as numbers
+def _to_number(value):
+    if value is None or isinstance(value, bool):
+        return math.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+# Dictionary-encode values: (codes array, distinct values in first-seen order)
+def _encode(values):
+    dictionary = {}
+    codes = np.fromiter((dictionary.setdefault(value, len(dictionary)) for value in values), dtype=np.int32, count=len(values))
+    return codes, list(dictionary)
+
+# CSR index of edges by one end: indptr over rows, edge indices grouped by row
+def _csr(ends, size):
+    order = np.argsort(ends, kind="stable").astype(np.int32)
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(ends, minlength=size), out=indptr[1:])
+    return indptr, order
+
+# One node of a frame, read from its columns
+class FrameRow:
+    __slots__ = ("frame", "index")
+
+    def __init__(self, frame, index):
+        self.frame = frame
+        self.index = index
+
+    @property
+    def uuid(self):
+        return self.frame.uuids[self.index]
+
+    @property
+    def name(self):
+        return self.frame.names[self.index]
+
+    @property
+    def label(self):
+        return self.frame.label_names[self.frame.label_codes[self.index]]
+
+    # A numeric property, None if missing
+    def __getitem__(self, name):
+        value = self.frame.numbers[name][self.index]
+        return None if np.isnan(value) else float(value)
+
+    def graph_node(self, **extra):
+        return graph_node(self.uuid, self.name, [self.label], **extra)
+
+    def __repr__(self):
+        return f"FrameRow({self.uuid!r}, {self.name!r}, {self.label!r})"
+
+class WorldFrame:
+    def __init__(self, world_uuid, uuids, names, labels, numbers, edges):
+        self.world_uuid = world_uuid
+        self.uuids = [sys.intern(node_uuid) for node_uuid in uuids]
+        self.index = {node_uuid: i for i, node_uuid in enumerate(self.uuids)}
+        self.names = np.array(names, dtype=object)
+        self.label_codes, self.label_names = _encode(labels)
+        self.numbers = {name: np.asarray(values, dtype=np.float64) for name, values in numbers.items()}
+
+        # Relationships whose ends aren't both in the frame are dropped
+        edges = list(edges)
+        starts = np.fromiter((self.index.get(edge[0], -1) for edge in edges), dtype=np.int64, count=len(edges))
+        ends = np.fromiter((self.index.get(edge[1], -1) for edge in edges), dtype=np.int64, count=len(edges))
+        kept = (starts >= 0) & (ends >= 0)
+        self.edge_starts = starts[kept].astype(np.int32)
+        self.edge_ends = ends[kept].astype(np.int32)
+        type_codes, self.type_names = _encode([edge[2] for edge in edges])
+        self.edge_type_codes = type_codes[kept]
+        self.edge_ids = [edge[3] for edge, keep in zip(edges, kept) if keep]
+        self.out_indptr, self.out_edges = _csr(self.edge_starts, len(self.uuids))
+        self.in_indptr, self.in_edges = _csr(self.edge_ends, len(self.uuids))
+        # Rank of each row by name, so sorting by name is an integer sort
+        self._name_rank = np.empty(len(self.uuids), dtype=np.int64)
+        self._name_rank[np.argsort(np.array([name if isinstance(name, str) else "" for name in names], dtype=object),
+                                   kind="stable")] = np.arange(len(self.uuids))
+
+    # Nodes and relationships are read in one read transaction so they agree with each other
+    @classmethod
+    @instrumented
+    def load(cls, driver, world_uuid, numeric=NUMERIC_PROPERTIES):
+        return read_transaction(driver, cls._read, world_uuid, tuple(numeric))
+
+    @classmethod
+    def _read(cls, tx, world_uuid, numeric):
+        uuids, names, labels = [], [], []
+        numbers = {name: [] for name in numeric}
+        values = ", ".join(f"n.{quote_name(name)}" for name in numeric)
+        for record in tx.run(f"""
+            MATCH (n:{NODE_LABEL} {{world_uuid: $uuid}})
+            RETURN n.uuid AS uuid, n.name AS name, [label IN labels(n) WHERE label <> '{NODE_LABEL}'] AS labels,
+                   [{values}] AS numbers
+        """, uuid=world_uuid):
+            uuids.append(record["uuid"])
+            names.append(record["name"])
+            labels.append(record["labels"][0] if record["labels"] else "Unknown")
+            for name, value in zip(numeric, record["numbers"]):
+                numbers[name].append(_to_number(value))
+
+        edges = [(record["from"], record["to"], record["rel_type"], record["id"]) for record in tx.run(f"""
+            MATCH (n:{NODE_LABEL} {{world_uuid: $uuid}})-[r]->(m:{NODE_LABEL} {{world_uuid: $uuid}})
+            RETURN n.uuid AS from, m.uuid AS to, TYPE(r) AS rel_type, elementId(r) AS id
+        """, uuid=world_uuid)]
+        return cls(world_uuid, uuids, names, labels, numbers, edges)
+
+    def __len__(self):
+        return len(self.uuids)
+
+    # Rough memory use, for the frame cache's budget: the columns, plus the Python strings
+    # behind the object ones
+    @property
+    def nbytes(self):
+        columns = [value for value in vars(self).values() if isinstance(value, np.ndarray)] + list(self.numbers.values())
+        return (sum(column.nbytes for column in columns) + estimate_size(self.uuids) + estimate_size(self.edge_ids)
+                + sum(sys.getsizeof(name) for name in self.names) + sys.getsizeof(self.index))
+
+    def __getitem__(self, index):
+        return FrameRow(self, int(index))
+
+    def row(self, node_uuid):
+        index = self.index.get(node_uuid)
+        return None if index is None else FrameRow(self, index)
+
+    def rows(self, indices):
+        return [FrameRow(self, int(index)) for index in indices]
+
+    def _codes(self, names, dictionary):
+        return [dictionary.index(name) for name in names if name in dictionary]
+
+    # Row indices with any of `labels` (all rows without), narrowed by a boolean mask
+    def select(self, labels=None, where=None):
+        mask = np.ones(len(self), dtype=bool) if labels is None else np.isin(self.label_codes, self._codes(labels, self.label_names))
+        if where is not None:
+            mask &= where
+        return np.flatnonzero(mask)
+
+    # `indices` ordered by name or a numeric property; missing numbers sort last either way
+    def sort(self, indices, by="name", descending=False, limit=None):
+        indices = np.asarray(indices, dtype=np.int64)
+        if by == "name":
+            keys = self._name_rank[indices]
+            order = np.argsort(-keys if descending else keys, kind="stable")
+        else:
+            values = self.numbers[by][indices]
+            keys = np.where(np.isnan(values), np.inf, -values if descending else values)
+            order = np.argsort(keys, kind="stable")
+        return indices[order[:limit]]
+
+    # Per label of the selected rows: how many there are and, for each numeric property,
+    # how many have it with its sum / mean / min / max
+    def group_by_label(self, indices=None):
+        indices = np.arange(len(self)) if indices is None else np.asarray(indices, dtype=np.int64)
+        codes = self.label_codes[indices]
+        groups = len(self.label_names)
+        counts = np.bincount(codes, minlength=groups)
+        stats = {}
+        for name, column in self.numbers.items():
+            values = column[indices]
+            present = ~np.isnan(values)
+            present_codes = codes[present]
+            present_values = values[present]
+            count = np.bincount(present_codes, minlength=groups)
+            total = np.bincount(present_codes, weights=present_values, minlength=groups)
+            minimum = np.full(groups, np.inf)
+            maximum = np.full(groups, -np.inf)
+            np.minimum.at(minimum, present_codes, present_values)
+            np.maximum.at(maximum, present_codes, present_values)
+            stats[name] = (count, total, minimum, maximum)
+
+        result = {}
+        for code, label in enumerate(self.label_names):
+            if not counts[code]:
+                continue
+            result[label] = {"count": int(counts[code])}
+            for name, (count, total, minimum, maximum) in stats.items():
+                if count[code]:
+                    result[label][name] = {"count": int(count[code]), "sum": float(total[code]),
+                                           "mean": float(total[code] / count[code]),
+                                           "min": float(minimum[code]), "max": float(maximum[code])}
+        return result
+
+    def _edge_mask(self, types):
+        if types is None:
+            return np.ones(len(self.edge_ids), dtype=bool)
+        return np.isin(self.edge_type_codes, self._codes(types, self.type_names))
+
+    # Relationships per row, of the given types, counted on the chosen end(s)
+    def degree(self, types=None, direction="both"):
+        mask = self._edge_mask(types)
+        degree = np.zeros(len(self), dtype=np.int64)
+        if direction in ("out", "both"):
+            degree += np.bincount(self.edge_starts[mask], minlength=len(self))
+        if direction in ("in", "both"):
+            degree += np.bincount(self.edge_ends[mask], minlength=len(self))
+        return degree
+
+    # (edge index, neighbour row) pairs of row `index`: outgoing ones first, then incoming
+    def neighbours(self, index, types=None, direction="both"):
+        type_codes = None if types is None else set(self._codes(types, self.type_names))
+        pairs = []
+        if direction in ("out", "both"):
+            for edge in self.out_edges[self.out_indptr[index]:self.out_indptr[index + 1]]:
+                if type_codes is None or self.edge_type_codes[edge] in type_codes:
+                    pairs.append((int(edge), int(self.edge_ends[edge])))
+        if direction in ("in", "both"):
+            for edge in self.in_edges[self.in_indptr[index]:self.in_indptr[index + 1]]:
+                if type_codes is None or self.edge_type_codes[edge] in type_codes:
+                    pairs.append((int(edge), int(self.edge_starts[edge])))
+        return pairs
+
+    def graph_edge(self, edge):
+        return graph_edge(self.edge_ids[edge], self.uuids[self.edge_starts[edge]], self.uuids[self.edge_ends[edge]],
+                          self.type_names[self.edge_type_codes[edge]])
+
+    # Summary of the world for reporting: per-label counts and numeric statistics, the
+    # best-connected nodes, and the top `top` rows of each numeric property
+    def report(self, top=10):
+        degree = self.degree()
+        best_connected = self.sort(np.flatnonzero(degree), by="name")
+        best_connected = best_connected[np.argsort(-degree[best_connected], kind="stable")[:top]]
+        return {
+            "nodes": len(self),
+            "relationships": {rel_type: int(count) for rel_type, count
+                              in zip(self.type_names, np.bincount(self.edge_type_codes, minlength=len(self.type_names)))},
+            "labels": self.group_by_label(),
+            "best_connected": [self[i].graph_node(degree=int(degree[i])) for i in best_connected],
+            "top": {name: [self[i].graph_node(**{name: float(self.numbers[name][i])})
+                           for i in self.sort(self.select(where=~np.isnan(column)), by=name, descending=True, limit=top)]
+                    for name, column in self.numbers.items()},
+        }
+
+# Frames per world, reused until the world's version moves on
+frame_cache = WorldSnapshotCache(max_bytes=MAX_CACHED_BYTES)
+
+# The frame of `world` (a World read this request)
+def get_world_frame(driver, world):
+    version = world.properties.get("version", 0)
+    frame = frame_cache.get(world.uuid, version)
+    if frame is None:
+        frame = WorldFrame.load(driver, world.uuid)
+        frame_cache.put(world.uuid, version, frame, size=frame.nbytes)
+    return frame
@@ -0,0 +1,151 @@
+from collections import defaultdict
+import threading
+import time
+
+from app.instrumentation import instrumented
+from app.transactions import write_transaction
+from app.utils import NODE_LABEL, POPULATION_LABEL, PopulationLimitReached, add_population, count_relationship, log_edge_change
+
+# Opt-in buffer for relationship upserts. Pass it wherever a driver is expected:
+#
+#     with RelationshipWriteBuffer(driver) as buffered:
+#         for character in characters:
+#             character.join_faction(buffered, faction_uuid=guild.uuid)
+#
+# create_or_update_relationship (and so join_faction, occupy_location, interact_with, ...)
+# queues the upsert instead of running it. Reads go straight to the driver. Queued upserts
+# are de-duplicated per (source, target, type), grouped by type and direction, and written
+# as UNWIND/MERGE batches in one transaction once max_size upserts are waiting, when an
+# upsert is queued max_wait seconds or more after the first one, or when the block exits.
+# There is no timer: a buffer left alone keeps its upserts until one of those happens.
+class RelationshipWriteBuffer:
+    def __init__(self, driver, max_size=5000, max_wait=1.0, batch_size=1000):
+        self.driver = driver
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.batch_size = batch_size
+        self.flushes = 0
+        self.written = 0
+        self._pending = defaultdict(dict)  # (type, direction) -> {key: (source, target, properties)}
+        self._pending_count = 0
+        self._first_buffered_at = None
+        self._after_flush = []
+        self._lock = threading.RLock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Flush on a clean exit; on error the queued upserts are dropped, like a rolled-back transaction
+        if exc_type is None:
+            self.flush()
+        else:
+            self.clear()
+        return False
+
+    def session(self, **kwargs):
+        return self.driver.session(**kwargs)
+
+    def buffer_relationship(self, source_uuid, target_uuid, relationship_type, properties=None, direction=True):
+        # An undirected MERGE matches either direction, so (a, b) and (b, a) are the same edge.
+        # The first upsert's ends are the ones written, as that is the MERGE that would create it.
+        key = (source_uuid, target_uuid) if direction else tuple(sorted((source_uuid, target_uuid)))
+        with self._lock:
+            group = self._pending[(relationship_type, direction)]
+            if key not in group:
+                group[key] = (source_uuid, target_uuid, {})
+                self._pending_count += 1
+            # Later upserts win, just as consecutive SET r += $properties would
+            group[key][2].update(properties or {})
+            if self._first_buffered_at is None:
+                self._first_buffered_at = time.monotonic()
+            if self._pending_count >= self.max_size or time.monotonic() - self._first_buffered_at >= self.max_wait:
+                self.flush()
+
+    # Work that depends on the relationships existing (e.g. distance table updates) waits for the flush
+    def after_commit(self, callback):
+        with self._lock:
+            self._after_flush.append(callback)
+
+    @instrumented
+    def flush(self):
+        with self._lock:
+            if not self._pending_count:
+                callbacks, self._after_flush = self._after_flush, []
+            else:
+                write_transaction(self.driver, self._write_pending)
+                self.flushes += 1
+                self.written += self._pending_count
+                callbacks, self._after_flush = self._after_flush, []
+                self._clear_pending()
+        for callback in callbacks:
+            callback()
+
+    # Every queued upsert in one write transaction; MERGE makes a retried attempt harmless
+    def _write_pending(self, tx):
+        for (relationship_type, direction), group in self._pending.items():
+            rows = [{"source": source, "target": target, "properties": properties}
+                    for source, target, properties in group.values()]
+            query = self._merge_query(relationship_type, direction)
+            for start in range(0, len(rows), self.batch_size):
+                batch = rows[start:start + self.batch_size]
+                if relationship_type == "CONTAINS":
+                    # Characters joining a world count against its pop_limit; one over it and
+                    # the whole flush rolls back
+                    for record in tx.run(self._population_query(direction), rows=batch):
+                        if record["limit_reached"]:
+                            raise PopulationLimitReached(f"World population limit of {record['pop_limit']} reached")
+                tx.run(query, rows=batch).consume()
+
+    # Counts the characters each world is about to take in into its population, before the
+    # MERGE; see add_population
+    def _population_query(self, direction):
+        arrow = "->" if direction else "-"
+        return f"""
+            UNWIND $rows AS row
+            MATCH (w:World {{uuid: row.source}}), (m:{NODE_LABEL} {{uuid: row.target}})
+            WHERE m:{POPULATION_LABEL} AND NOT (w)-[:CONTAINS]{arrow}(m)
+            WITH w, count(DISTINCT m) AS joining
+            {add_population("w", "joining", ("joining",))}
+            RETURN w.uuid AS world_uuid, w.pop_limit AS pop_limit, limit_reached
+        """
+
+    # Drops the queued upserts and the callbacks waiting on them, which would otherwise run
+    # after some later flush as if the dropped writes had been made
+    def clear(self):
+        with self._lock:
+            self._clear_pending()
+            self._after_flush = []
+
+    def _clear_pending(self):
+        self._pending.clear()
+        self._pending_count = 0
+        self._first_buffered_at = None
+
+    def _merge_query(self, relationship_type, direction):
+        arrow = "->" if direction else "-"
+        # A world taking in a node stamps it with the world's uuid (see create_or_update_relationship);
+        # the population was already counted by _population_query
+        stamp = """
+            SET m.world_uuid = CASE WHEN n:World THEN n.uuid ELSE m.world_uuid END
+        """ if relationship_type == "CONTAINS" else ""
+        # Same MERGE (and counters) as create_or_update_relationship, a change log entry per
+        # relationship, then one version bump per affected world
+        return f"""
+            UNWIND $rows AS row
+            MATCH (n:{NODE_LABEL} {{uuid: row.source}}), (m:{NODE_LABEL} {{uuid: row.target}})
+            OPTIONAL MATCH (n)-[existing:{relationship_type}]{arrow}(m)
+            WITH row, n, m, count(existing) = 0 AS created
+            MERGE (n)-[r:{relationship_type}]{arrow}(m)
+            SET r += row.properties
+            {stamp}
+            {count_relationship(relationship_type, 1, condition="created")}
+            WITH n, r
+            OPTIONAL MATCH (version_world:World)-[:CONTAINS]->(n)
+            WITH n, r, collect(version_world) + CASE WHEN n:World THEN [n] ELSE [] END AS worlds
+            {log_edge_change("worlds")}
+            WITH DISTINCT n, worlds
+            UNWIND worlds AS world
+            WITH DISTINCT world
+            SET world.version = coalesce(world.version, 0) + 1
+        """
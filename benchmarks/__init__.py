@@ -0,0 +1,3 @@
+# Benchmark suite: synthetic worlds (generator.py), scenarios over app/utils.py and the
+# Flask routes (scenarios.py), percentile/throughput reports (report.py).
+# Run with `python -m benchmarks`; see __main__.py for options.
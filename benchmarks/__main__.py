@@ -0,0 +1,78 @@
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.database import get_driver
+from app.instrumentation import InstrumentedDriver
+from app.schema import bootstrap_schema
+from benchmarks import report, scenarios
+from benchmarks.generator import delete_world, generate_world
+from benchmarks.graph_standin import StandInDriver
+
+# Usage:
+#   python -m benchmarks                              # in-process graph stand-in, no database needed
+#   python -m benchmarks --latency-ms 0.5             # stand-in with a simulated round trip per query
+#   python -m benchmarks --neo4j                      # real database from NEO4J_URI/USERNAME/PASSWORD
+#   python -m benchmarks --json out.json              # save results...
+#   python -m benchmarks --baseline out.json          # ...and flag regressions against them later
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument("--neo4j", action="store_true", help="run against the database in NEO4J_URI instead of the stand-in")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated round trip per stand-in query")
+    parser.add_argument("--locations", type=int, default=200)
+    parser.add_argument("--route-density", type=float, default=3.0, help="average ROUTEs per location")
+    parser.add_argument("--characters", type=int, default=1000)
+    parser.add_argument("--factions", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--scenario", action="append", help="only run scenarios whose name contains this (repeatable)")
+    parser.add_argument("--reads-only", action="store_true")
+    parser.add_argument("--keep", action="store_true", help="don't delete the generated world from Neo4j afterwards")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="flag regressions against results saved with --json")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p50/p90 slowdown against the baseline")
+    return parser.parse_args(argv)
+
+def make_driver(args):
+    if args.neo4j:
+        # Same pooled driver the app uses
+        driver = get_driver()
+    else:
+        driver = InstrumentedDriver(StandInDriver(latency=args.latency_ms / 1000))
+    bootstrap_schema(driver)
+    return driver
+
+def main(argv=None):
+    args = parse_args(argv)
+    driver = make_driver(args)
+    spec = generate_world(driver, locations=args.locations, route_density=args.route_density,
+                          characters=args.characters, factions=args.factions, seed=args.seed)
+    print(f"Generated world {spec.world.uuid}: {len(spec.locations)} locations, {len(spec.routes)} routes, "
+          f"{len(spec.characters)} characters, {len(spec.factions)} factions "
+          f"({'neo4j' if args.neo4j else 'stand-in'})")
+
+    baseline = report.load_json(args.baseline) if args.baseline else None
+    context = scenarios.BenchContext(driver, spec)
+    results = []
+    try:
+        for scenario in scenarios.select(args.scenario, args.reads_only):
+            rng = scenarios.seeded_rng(args.seed, scenario.name)
+            results.append(report.run_scenario(scenario, context, rng, args.iterations, args.warmup))
+    finally:
+        if args.neo4j and not args.keep:
+            delete_world(driver, spec)
+        driver.close()
+
+    print(report.format_table(results, baseline, args.tolerance))
+    if args.json:
+        report.save_json(args.json, results, {key: value for key, value in vars(args).items()
+                                              if key not in ("json", "baseline")})
+    if baseline and any(report.regression(result, baseline, args.tolerance) for result in results):
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+from neo4j import GraphDatabase
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.schema import bootstrap_schema
+from app.utils import NODE, User
+from dotenv import load_dotenv
+
+# Seeds the same world twice, once through the per-call path app/test.py uses and
+# once through World.bulk_create_nodes/bulk_create_relationships, and compares.
+# Usage: python benchmarks/bulk_seed.py [entities]
+load_dotenv()
+
+uri = os.getenv("NEO4J_URI")
+username = os.getenv("NEO4J_USERNAME")
+password = os.getenv("NEO4J_PASSWORD")
+
+TARGET_SPEEDUP = 50
+
+def make_rows(entities):
+    locations = [{"name": f"Location {i}", "population": i} for i in range(entities // 5)]
+    factions = [{"name": f"Faction {i}"} for i in range(max(1, entities // 50))]
+    characters = [{"name": f"Character {i}", "age": 20 + i % 60}
+                  for i in range(entities - len(locations) - len(factions))]
+    return locations, characters, factions
+
+def make_world(driver, owner, name):
+    return owner.create_world(driver, world_name=name)
+
+def seed_per_call(driver, world, locations, characters, factions):
+    location_nodes = [world.create_or_update_node(driver, node_label="Location", node_properties=dict(row)) for row in locations]
+    faction_nodes = [world.create_or_update_node(driver, node_label="Faction", node_properties=dict(row)) for row in factions]
+    for i, row in enumerate(characters):
+        character = world.create_or_update_node(driver, node_label="Character", node_properties=dict(row))
+        character = NODE.from_database(driver, character.uuid)
+        character.occupy_location(driver, location_uuid=location_nodes[i % len(location_nodes)].uuid)
+        character.join_faction(driver, faction_uuid=faction_nodes[i % len(faction_nodes)].uuid)
+
+def seed_bulk(driver, world, locations, characters, factions):
+    location_uuids = world.bulk_create_nodes(driver, "Location", locations)
+    faction_uuids = world.bulk_create_nodes(driver, "Faction", factions)
+    character_uuids = world.bulk_create_nodes(driver, "Character", characters)
+    world.bulk_create_relationships(driver, "OCCUPANT",
+                                    [(c, location_uuids[i % len(location_uuids)]) for i, c in enumerate(character_uuids)],
+                                    direction=False)
+    world.bulk_create_relationships(driver, "MEMBER",
+                                    [(c, faction_uuids[i % len(faction_uuids)]) for i, c in enumerate(character_uuids)],
+                                    direction=False)
+
+def delete_world(driver, world):
+    with driver.session() as session:
+        session.run("""
+            MATCH (w:World {uuid: $uuid})-[:CONTAINS]->(n)
+            CALL { WITH n DETACH DELETE n } IN TRANSACTIONS OF 10000 ROWS
+        """, uuid=world.uuid)
+        session.run("MATCH (w:World {uuid: $uuid}) DETACH DELETE w", uuid=world.uuid)
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+if __name__ == '__main__':
+    entities = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    driver = GraphDatabase.driver(uri, auth=(username, password))
+    bootstrap_schema(driver)
+
+    owner = User(username="bench_bulk_seed")
+    owner.register(driver, password="bench")
+    owner.find(driver)
+    rows = make_rows(entities)
+
+    per_call_world = make_world(driver, owner, "Bench per-call")
+    bulk_world = make_world(driver, owner, "Bench bulk")
+    try:
+        per_call = timed(seed_per_call, driver, per_call_world, *rows)
+        bulk = timed(seed_bulk, driver, bulk_world, *rows)
+    finally:
+        delete_world(driver, per_call_world)
+        delete_world(driver, bulk_world)
+        with driver.session() as session:
+            session.run("MATCH (u:User {username: 'bench_bulk_seed'}) DETACH DELETE u")
+        driver.close()
+
+    speedup = per_call / bulk
+    print(f"{entities} entities")
+    print(f"  per-call {per_call:8.2f} s")
+    print(f"  bulk     {bulk:8.2f} s")
+    print(f"  speedup  {speedup:8.1f}x (target {TARGET_SPEEDUP}x: {'ok' if speedup >= TARGET_SPEEDUP else 'MISSED'})")
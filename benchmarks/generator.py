@@ -0,0 +1,72 @@
+from collections import namedtuple
+import math
+import random
+
+from app.utils import User, World
+
+# What generate_world made, so scenarios can pick real uuids
+WorldSpec = namedtuple("WorldSpec", "user world locations characters factions routes")
+
+# Build a synthetic world through the bulk APIs.
+# route_density is the average number of ROUTEs per location; a random spanning tree
+# comes first so every location is reachable, extra routes join random pairs.
+# The same seed always gives the same shape (uuids differ).
+def generate_world(driver, locations=200, route_density=3.0, characters=1000, factions=20,
+                   seed=0, username="bench_user", password="bench_password"):
+    rng = random.Random(seed)
+
+    user = User(username=f"{username}_{rng.randrange(10**9)}", properties={"email": "bench@example.com"})
+    user.register(driver, password)
+    user.find(driver)
+    world = user.create_world(driver, world_name=f"Bench world {seed}",
+                              world_properties={"pop_limit": characters * 2})
+
+    location_rows = [{"name": f"Location {i}", "population": rng.randrange(10, 10000),
+                      "x": rng.uniform(0, 1000), "y": rng.uniform(0, 1000)} for i in range(locations)]
+    faction_rows = [{"name": f"Faction {i}", "alignment": rng.choice(["lawful", "neutral", "chaotic"])}
+                    for i in range(factions)]
+    character_rows = [{"name": f"Character {i}", "age": rng.randrange(16, 90)} for i in range(characters)]
+
+    location_uuids = world.bulk_create_nodes(driver, "Location", location_rows)
+    faction_uuids = world.bulk_create_nodes(driver, "Faction", faction_rows)
+    character_uuids = world.bulk_create_nodes(driver, "Character", character_rows)
+
+    # Routes: spanning tree, then random extra pairs up to the requested density
+    pairs = set()
+    for i in range(1, locations):
+        pairs.add((rng.randrange(i), i))
+    target = min(int(locations * route_density / 2), locations * (locations - 1) // 2)
+    while len(pairs) < target:
+        a, b = rng.sample(range(locations), 2)
+        pairs.add((min(a, b), max(a, b)))
+    routes = []
+    for a, b in sorted(pairs):
+        start, end = location_rows[a], location_rows[b]
+        distance = math.hypot(start["x"] - end["x"], start["y"] - end["y"])
+        routes.append((location_uuids[a], location_uuids[b],
+                       {"distance": round(distance, 2), "danger": rng.randrange(1, 10),
+                        "time": round(distance / rng.uniform(2, 8), 2)}))
+    world.bulk_create_relationships(driver, "ROUTE", routes, direction=False)
+
+    if location_uuids:
+        world.bulk_create_relationships(driver, "OCCUPANT",
+                                        [(c, rng.choice(location_uuids)) for c in character_uuids], direction=False)
+    if faction_uuids:
+        world.bulk_create_relationships(driver, "MEMBER",
+                                        [(c, rng.choice(faction_uuids)) for c in character_uuids], direction=False)
+    if len(character_uuids) > 1:
+        world.bulk_create_relationships(driver, "INTERACTS_WITH",
+                                        [tuple(rng.sample(character_uuids, 2)) for _ in character_uuids])
+
+    return WorldSpec(user, World.from_database(driver, world.uuid), location_uuids, character_uuids,
+                     faction_uuids, [(start, end) for start, end, _ in routes])
+
+# Remove a generated world from a real database
+def delete_world(driver, spec):
+    with driver.session() as session:
+        session.run("""
+            MATCH (w:World {uuid: $uuid})-[:CONTAINS]->(n)
+            CALL { WITH n DETACH DELETE n } IN TRANSACTIONS OF 10000 ROWS
+        """, uuid=spec.world.uuid)
+        session.run("MATCH (w:World {uuid: $uuid}) DETACH DELETE w", uuid=spec.world.uuid)
+        session.run("MATCH (u:User {uuid: $uuid}) DETACH DELETE u", uuid=spec.user.uuid)
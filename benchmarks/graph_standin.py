@@ -0,0 +1,912 @@
+from collections import defaultdict
+import itertools
+import os
+import re
+import threading
+import time
+
+# In-process stand-in for the Neo4j driver, so benchmarks run on a machine with no database.
+#
+# It is not a Cypher engine: each query the app issues is recognised by pattern and answered
+# from an in-memory graph with uuid, label and adjacency indexes. Queries it doesn't recognise
+# raise NotImplementedError naming the query, so a new query shows up as a missing handler
+# rather than a silently wrong benchmark. Writes apply immediately (no rollback), and an
+# optional per-query `latency` models the network round trip a real driver would pay.
+
+NODE_LABEL = "Node"
+# Mirrors app/utils.py RELATIONSHIP_COUNTERS / POPULATION_LABEL
+RELATIONSHIP_COUNTERS = {"OCCUPANT": ("Location", "occupant_count"), "MEMBER": ("Faction", "member_count")}
+POPULATION_LABEL = "Character"
+# ... and CHANGE_LOG_RETENTION
+CHANGE_LOG_RETENTION = int(os.getenv("CHANGE_LOG_RETENTION", "10000"))
+
+class StandInNode(dict):
+    def __init__(self, node_id, labels, properties):
+        super().__init__(properties)
+        self.id = node_id
+        self.element_id = str(node_id)
+        self.labels = labels
+
+class StandInRelationship(dict):
+    def __init__(self, rel_id, rel_type, start, end, properties):
+        super().__init__(properties)
+        self.id = rel_id
+        self.element_id = str(rel_id)
+        self.type = rel_type
+        self.start_node = start
+        self.end_node = end
+
+class StandInRecord(dict):
+    def data(self, *keys):
+        return {key: self[key] for key in (keys or self.keys())}
+
+    def value(self, key=0):
+        return list(self.values())[key] if isinstance(key, int) else self[key]
+
+class StandInSummary:
+    def __init__(self, query):
+        self.query = query
+        self.plan = None
+        self.profile = None
+
+class StandInResult:
+    def __init__(self, query, records):
+        self._query = query
+        self._records = [StandInRecord(record) for record in records]
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def single(self, strict=False):
+        if strict and len(self._records) != 1:
+            raise ValueError(f"Expected exactly one record, got {len(self._records)}")
+        return self._records[0] if self._records else None
+
+    def peek(self):
+        return self._records[0] if self._records else None
+
+    def data(self, *keys):
+        return [record.data(*keys) for record in self._records]
+
+    def keys(self):
+        return list(self._records[0].keys()) if self._records else []
+
+    def consume(self):
+        return StandInSummary(self._query)
+
+class Graph:
+    def __init__(self):
+        self.nodes = {}                      # id -> StandInNode
+        self.relationships = {}              # id -> StandInRelationship
+        self.by_uuid = {}                    # uuid -> node id
+        self.by_label = defaultdict(set)     # label -> node ids
+        self.outgoing = defaultdict(set)     # node id -> rel ids
+        self.incoming = defaultdict(set)     # node id -> rel ids
+        self.indexes = []                    # (name, label, property) of property indexes
+        self.timeline_entries = defaultdict(dict)  # timeline uuid -> key -> TimelineEntry properties
+        self.changes = []                    # WorldChange properties, in order
+        self._ids = itertools.count()
+        self.lock = threading.RLock()
+
+    def create_node(self, labels, properties):
+        node = StandInNode(next(self._ids), set(labels), properties)
+        self.nodes[node.id] = node
+        for label in node.labels:
+            self.by_label[label].add(node.id)
+        if "uuid" in node:
+            self.by_uuid[node["uuid"]] = node.id
+        return node
+
+    def node(self, node_uuid, label=None):
+        node_id = self.by_uuid.get(node_uuid)
+        if node_id is None:
+            return None
+        node = self.nodes[node_id]
+        return node if label is None or label in node.labels else None
+
+    def delete_node(self, node):
+        for rel_id in list(self.outgoing[node.id] | self.incoming[node.id]):
+            self.delete_relationship(self.relationships[rel_id])
+        for label in node.labels:
+            self.by_label[label].discard(node.id)
+        self.by_uuid.pop(node.get("uuid"), None)
+        del self.nodes[node.id]
+
+    def relationships_of(self, node, types=None, direction="out"):
+        rel_ids = set()
+        if direction in ("out", "both"):
+            rel_ids |= self.outgoing[node.id]
+        if direction in ("in", "both"):
+            rel_ids |= self.incoming[node.id]
+        for rel_id in rel_ids:
+            rel = self.relationships[rel_id]
+            if types is None or rel.type in types:
+                yield rel, rel.end_node if rel.start_node is node else rel.start_node
+
+    def merge_relationship(self, start, end, rel_type, directed=True):
+        for rel, other in self.relationships_of(start, {rel_type}, "out" if directed else "both"):
+            if other is end:
+                return rel
+        rel = self.create_relationship(start, end, rel_type)
+        self.count_relationship(rel, 1)
+        return rel
+
+    # The maintained counters (app/utils.py RELATIONSHIP_COUNTERS, population)
+    def count_relationship(self, rel, delta):
+        counter = RELATIONSHIP_COUNTERS.get(rel.type)
+        if counter is not None:
+            label, name = counter
+            for node in (rel.start_node, rel.end_node):
+                if label in node.labels:
+                    node[name] = node.get(name, 0) + delta
+        elif rel.type == "CONTAINS" and "World" in rel.start_node.labels and POPULATION_LABEL in rel.end_node.labels:
+            rel.start_node["population"] = rel.start_node.get("population", 0) + delta
+
+    # app/utils.py add_population: would `adding` more characters take the world past its pop_limit?
+    def over_population_limit(self, world, adding):
+        try:
+            pop_limit = int(world.get("pop_limit") or 0)
+        except (TypeError, ValueError):
+            pop_limit = 0
+        return adding > 0 and pop_limit > 0 and world.get("population", 0) + adding > pop_limit
+
+    def create_relationship(self, start, end, rel_type):
+        rel = StandInRelationship(next(self._ids), rel_type, start, end, {})
+        self.relationships[rel.id] = rel
+        self.outgoing[start.id].add(rel.id)
+        self.incoming[end.id].add(rel.id)
+        return rel
+
+    def delete_relationship(self, rel):
+        self.count_relationship(rel, -1)
+        self.outgoing[rel.start_node.id].discard(rel.id)
+        self.incoming[rel.end_node.id].discard(rel.id)
+        del self.relationships[rel.id]
+
+    def worlds_containing(self, node):
+        return [other for rel, other in self.relationships_of(node, {"CONTAINS"}, "in") if "World" in other.labels]
+
+    def contains(self, world, node):
+        return any(other is world for other in self.worlds_containing(node))
+
+    def bump_version(self, world):
+        world["version"] = world.get("version", 0) + 1
+
+    def bump_containing_worlds(self, node):
+        for world in self.worlds_containing(node):
+            self.bump_version(world)
+
+    def log_change(self, world, kind, key, added=False, **fields):
+        world["change_seq"] = world.get("change_seq", 0) + 1
+        self.changes.append({"world_uuid": world["uuid"], "seq": world["change_seq"], "kind": kind, "key": key,
+                             "added": added, **fields})
+        # The expired entry is left in the list: nothing reads below changes_pruned_to
+        world["changes_pruned_to"] = max(world.get("changes_pruned_to", 0), world["change_seq"] - CHANGE_LOG_RETENTION)
+
+    def log_node_change(self, node, added=False):
+        for world in self.worlds_containing(node):
+            self.log_change(world, "node", node["uuid"], added)
+
+    def log_edge_change(self, world, rel):
+        start, end = rel.start_node["uuid"], rel.end_node["uuid"]
+        self.log_change(world, "edge", f"{start}|{rel.type}|{end}", start=start, end=end, type=rel.type,
+                        rel_id=rel.element_id)
+
+    # Nodes stamped with world_uuid (the partition key the world-scoped reads seek on)
+    def partition(self, world_uuid, label=None):
+        for node_id in self.by_label[label or NODE_LABEL]:
+            node = self.nodes[node_id]
+            if node.get("world_uuid") == world_uuid:
+                yield node
+
+    def contained(self, world, label=None):
+        for rel, node in self.relationships_of(world, {"CONTAINS"}, "out"):
+            if label is None or label in node.labels:
+                yield node
+
+def _visible_labels(node):
+    return sorted(label for label in node.labels if label != NODE_LABEL)
+
+# Query handlers: (pattern over whitespace-collapsed query text, handler(graph, match, params))
+_handlers = []
+
+def handles(pattern):
+    compiled = re.compile(pattern)
+
+    def register(fn):
+        _handlers.append((compiled, fn))
+        return fn
+    return register
+
+# Property indexes are only recorded (for SHOW INDEXES); lookups don't use them
+@handles(r"^CREATE (?:TEXT )?INDEX `([^`]+)` IF NOT EXISTS FOR \(n:`(\w+)`\) ON \(n\.`(\w+)`\)$")
+def _create_property_index(graph, match, params):
+    if match.group(1) not in [name for name, _, _ in graph.indexes]:
+        graph.indexes.append(match.groups())
+    return []
+
+@handles(r"^(CREATE (CONSTRAINT|INDEX|TEXT INDEX|FULLTEXT INDEX)|DROP INDEX|SHOW FULLTEXT INDEXES|CALL db\.awaitIndexes|MATCH \(n\) WHERE n\.uuid IS NOT NULL AND NOT n:Node)")
+def _schema(graph, match, params):
+    return []
+
+@handles(r"^MATCH \(w:World\)-\[:CONTAINS\]->\(n:Node\) WHERE n\.world_uuid IS NULL CALL")
+def _backfill_world_uuid(graph, match, params):
+    for world_id in list(graph.by_label["World"]):
+        world = graph.nodes[world_id]
+        for node in graph.contained(world):
+            node.setdefault("world_uuid", world["uuid"])
+    return []
+
+@handles(r"^SHOW INDEXES ")
+def _show_indexes(graph, match, params):
+    return [{"name": name, "type": "RANGE", "labelsOrTypes": [label], "properties": [property_name], "state": "ONLINE"}
+            for name, label, property_name in graph.indexes]
+
+@handles(r"^CALL db\.labels\(\)")
+def _labels(graph, match, params):
+    return [{"label": label} for label, ids in graph.by_label.items() if ids]
+
+@handles(r"^MATCH \(n\) DETACH DELETE n$")
+def _wipe(graph, match, params):
+    graph.__init__()
+    return []
+
+@handles(r"^MATCH \(n:Node \{uuid: \$uuid\}\) DETACH DELETE n$")
+def _delete_node(graph, match, params):
+    node = graph.node(params["uuid"])
+    if node is not None:
+        graph.delete_node(node)
+    return []
+
+@handles(r"^MATCH \(n:Node \{uuid: \$uuid\}\) RETURN \[label IN labels\(n\) WHERE label <> 'Node'\] AS labels, n$")
+def _from_database(graph, match, params):
+    node = graph.node(params["uuid"])
+    return [{"labels": _visible_labels(node), "n": node}] if node else []
+
+@handles(r"^MATCH \(n:Node \{uuid: \$uuid\}\) SET n \+= \$properties WITH n OPTIONAL MATCH \(version_world:World\)")
+def _update_node(graph, match, params):
+    node = graph.node(params["uuid"])
+    if node:
+        node.update(params["properties"])
+        graph.bump_containing_worlds(node)
+        graph.log_node_change(node)
+    return []
+
+@handles(r"^CREATE \(n:(\w+):Node \$properties\) SET n\.uuid = \$uuid")
+def _create_node(graph, match, params):
+    node = graph.create_node({match.group(1), NODE_LABEL}, {**params["properties"], "uuid": params["uuid"]})
+    return [{"n": node}]
+
+@handles(r"^MATCH \(n:(\w+) \{uuid: \$uuid\}\)-\[r(?::([\w|]+))?\]-(>?)\(m\) RETURN r, m, ")
+def _find_relationships(graph, match, params):
+    node = graph.node(params["uuid"], match.group(1))
+    if node is None:
+        return []
+    types = set(match.group(2).split("|")) if match.group(2) else None
+    direction = "out" if match.group(3) else "both"
+    rows = [{"r": rel, "m": other, "labels": _visible_labels(other)}
+            for rel, other in graph.relationships_of(node, types, direction)]
+    return rows[:params["limit"]] if match.string.endswith("LIMIT $limit") else rows
+
+@handles(r"^MATCH \(n:(\w+) \{uuid: \$uuid\}\), \(m:Node \{uuid: \$target_node_uuid\}\) OPTIONAL MATCH .* MERGE \(n\)-\[r:(\w+)\]-(>?)\(m\) SET r \+= \$properties (.*)$")
+def _merge_relationship(graph, match, params):
+    start, end = graph.node(params["uuid"], match.group(1)), graph.node(params["target_node_uuid"])
+    if start is None or end is None:
+        return []
+    if "World" in start.labels and match.group(2) == "CONTAINS":
+        joining = POPULATION_LABEL in end.labels and not any(
+            other is end for _, other in graph.relationships_of(start, {"CONTAINS"}, "out"))
+        if graph.over_population_limit(start, 1 if joining else 0):
+            return [{"limit_reached": True, "pop_limit": start.get("pop_limit")}]
+    rel = graph.merge_relationship(start, end, match.group(2), directed=bool(match.group(3)))
+    rel.update(params["properties"])
+    if "World" in start.labels and match.group(2) == "CONTAINS":
+        end["world_uuid"] = start["uuid"]
+        graph.bump_version(start)
+        graph.log_change(start, "node", end["uuid"], True)
+        return [{"limit_reached": False, "pop_limit": start.get("pop_limit")}]
+    else:
+        graph.bump_containing_worlds(start)
+        for world in graph.worlds_containing(start):
+            graph.log_edge_change(world, rel)
+    return []
+
+@handles(r"^MATCH \(w:World \{uuid: \$world_uuid\}\) SET w\.population = coalesce\(w\.population, 0\) \+ (\S+) .* UNWIND \$batch AS row CREATE \(n:`?(\w+)`?:Node\)")
+def _bulk_create_nodes(graph, match, params):
+    world = graph.node(params["world_uuid"], "World")
+    if world is None:
+        return []
+    if graph.over_population_limit(world, len(params["batch"]) if match.group(1) == "size($batch)" else 0):
+        return [{"written": 0, "limit_reached": True, "pop_limit": world.get("pop_limit")}]
+    graph.bump_version(world)
+    for row in params["batch"]:
+        node = graph.create_node({match.group(2), NODE_LABEL}, {**row["properties"], "uuid": row["uuid"],
+                                                                "world_uuid": world["uuid"]})
+        rel = graph.create_relationship(world, node, "CONTAINS")
+        graph.count_relationship(rel, 1)
+        rel.update(params["relationship_properties"])
+        graph.log_change(world, "node", node["uuid"], True)
+    return [{"written": len(params["batch"]), "limit_reached": False, "pop_limit": world.get("pop_limit")}]
+
+def _merge_rows(graph, rows, rel_type, directed, world=None):
+    written = 0
+    touched = {}
+    for row in rows:
+        start, end = graph.node(row["source"]), graph.node(row["target"])
+        if start is None or end is None:
+            continue
+        if world is not None and not (start.get("world_uuid") == end.get("world_uuid") == world["uuid"]):
+            continue
+        rel = graph.merge_relationship(start, end, rel_type, directed)
+        if rel_type == "CONTAINS" and "World" in start.labels:
+            end["world_uuid"] = start["uuid"]
+        rel.update(row["properties"])
+        touched[rel.id] = rel
+        written += 1
+    return written, touched
+
+@handles(r"^MATCH \(w:World \{uuid: \$world_uuid\}\) SET w\.version = .* UNWIND \$batch AS row MATCH .* MERGE \(n\)-\[r:(\w+)\]-(>?)\(m\)")
+def _bulk_create_relationships(graph, match, params):
+    world = graph.node(params["world_uuid"], "World")
+    graph.bump_version(world)
+    written, touched = _merge_rows(graph, params["batch"], match.group(1), bool(match.group(2)), world)
+    for rel in touched.values():
+        graph.log_edge_change(world, rel)
+    return [{"written": written}]
+
+# Only the check: _buffered_relationships counts the population as it merges
+@handles(r"^UNWIND \$rows AS row MATCH \(w:World \{uuid: row\.source\}\), \(m:Node \{uuid: row\.target\}\) WHERE m:(\w+) AND NOT \(w\)-\[:CONTAINS\]")
+def _buffered_population(graph, match, params):
+    joining = {}
+    for row in params["rows"]:
+        world, node = graph.node(row["source"], "World"), graph.node(row["target"])
+        if world is None or node is None or match.group(1) not in node.labels:
+            continue
+        if any(other is node for _, other in graph.relationships_of(world, {"CONTAINS"}, "out")):
+            continue
+        joining.setdefault(world.id, (world, set()))[1].add(node.id)
+    return [{"world_uuid": world["uuid"], "pop_limit": world.get("pop_limit"),
+             "limit_reached": graph.over_population_limit(world, len(nodes))} for world, nodes in joining.values()]
+
+@handles(r"^UNWIND \$rows AS row MATCH \(n:Node \{uuid: row\.source\}\), \(m:Node \{uuid: row\.target\}\) OPTIONAL MATCH .* MERGE \(n\)-\[r:(\w+)\]-(>?)\(m\)")
+def _buffered_relationships(graph, match, params):
+    _, touched = _merge_rows(graph, params["rows"], match.group(1), bool(match.group(2)))
+    worlds = {}
+    for rel in touched.values():
+        node = rel.start_node
+        for world in graph.worlds_containing(node) + ([node] if "World" in node.labels else []):
+            graph.log_edge_change(world, rel)
+            worlds[world.id] = world
+    for world in worlds.values():
+        graph.bump_version(world)
+    return []
+
+@handles(r"^MATCH \(w:World \{uuid: \$uuid\}\) SET w\.version = coalesce\(w\.version, 0\) \+ 1 WITH w UNWIND \$changed_edges AS edge")
+def _bump_version(graph, match, params):
+    world = graph.node(params["uuid"], "World")
+    if world:
+        graph.bump_version(world)
+        for edge in params["changed_edges"]:
+            graph.log_change(world, "edge", f"{edge['start']}|{edge['type']}|{edge['end']}", start=edge["start"],
+                             end=edge["end"], type=edge["type"], rel_id=edge["rel_id"])
+    return []
+
+@handles(r"^MATCH \(n:Node \{world_uuid: \$uuid\}\)-\[r\]->\(m:Node \{world_uuid: \$uuid\}\) RETURN n\.uuid AS from, m\.uuid AS to, TYPE\(r\) AS rel_type(, properties\(r\) AS properties|, elementId\(r\) AS id)?$")
+def _world_edges(graph, match, params):
+    members = {node.id for node in graph.partition(params["uuid"])}
+    return [{"from": node["uuid"], "to": other["uuid"], "rel_type": rel.type, "properties": dict(rel), "id": rel.element_id}
+            for node_id in members
+            for node in [graph.nodes[node_id]]
+            for rel, other in graph.relationships_of(node, None, "out") if other.id in members]
+
+@handles(r"^MATCH \(n:Node \{world_uuid: \$uuid\}\) RETURN n\.uuid AS uuid, n\.name AS name, \[label IN labels\(n\) WHERE label <> 'Node'\] AS labels, \[(.*)\] AS numbers$")
+def _world_frame_nodes(graph, match, params):
+    numeric = re.findall(r"n\.`((?:[^`]|``)+)`", match.group(1))
+    return [{"uuid": node["uuid"], "name": node.get("name"), "labels": _visible_labels(node),
+             "numbers": [node.get(name.replace("``", "`")) for name in numeric]}
+            for node in graph.partition(params["uuid"])]
+
+@handles(r"^MATCH \(n:Node \{world_uuid: \$uuid\}\) RETURN n, \[label IN labels\(n\) WHERE label <> 'Node'\] AS labels$")
+def _world_nodes(graph, match, params):
+    return [{"n": node, "labels": _visible_labels(node)} for node in graph.partition(params["uuid"])]
+
+@handles(r"^MATCH \(n:`(\w+)` \{world_uuid: \$uuid\}\) RETURN n$")
+def _nodes_by_label(graph, match, params):
+    return [{"n": node} for node in graph.partition(params["uuid"], match.group(1))]
+
+@handles(r"^MATCH \(n:`(\w+)` \{world_uuid: \$uuid\}\) WHERE (.*) RETURN n$")
+def _nodes_by_label_and_properties(graph, match, params):
+    conditions = re.findall(r"n\.`(\w+)` = \$(\w+)", match.group(2))
+    return [{"n": node} for node in graph.partition(params["uuid"], match.group(1))
+            if all(node.get(key) == params[param] for key, param in conditions)]
+
+@handles(r"^MATCH \(u:User \{username: \$username\}\) RETURN u$")
+def _find_user(graph, match, params):
+    return [{"u": graph.nodes[node_id]} for node_id in graph.by_label["User"]
+            if graph.nodes[node_id].get("username") == params["username"]][:1]
+
+@handles(r"^MATCH \(w:World\)-\[:CONTAINS\]->\(l:Location \{uuid: \$uuid\}\) RETURN w\.uuid AS world_uuid(, coalesce\(w\.version, 0\) AS version.*)?$")
+def _world_of_location(graph, match, params):
+    location = graph.node(params["uuid"], "Location")
+    worlds = graph.worlds_containing(location) if location else []
+    return [{"world_uuid": world["uuid"], "version": world.get("version", 0), "change_seq": world.get("change_seq", 0),
+             "pruned_to": world.get("changes_pruned_to", 0)} for world in worlds]
+
+@handles(r"^MATCH \(l:Location \{world_uuid: \$world_uuid\}\) RETURN l\.uuid AS uuid, l\.x AS x, l\.y AS y$")
+def _route_locations(graph, match, params):
+    return [{"uuid": node["uuid"], "x": node.get("x"), "y": node.get("y")}
+            for node in graph.partition(params["world_uuid"], "Location")]
+
+def _world_routes(graph, world_uuid):
+    members = {node.id for node in graph.partition(world_uuid, "Location")}
+    for rel in list(graph.relationships.values()):
+        if rel.type == "ROUTE" and rel.start_node.id in members and rel.end_node.id in members:
+            yield rel
+
+# app/distance_table.py: catching a table up from the change log
+@handles(r"^MATCH \(c:WorldChange \{world_uuid: \$world_uuid\}\) WHERE c\.seq > \$after AND c\.seq <= \$change_seq")
+def _route_changes(graph, match, params):
+    rows = {}
+    for change in graph.changes:
+        if (change["world_uuid"] != params["world_uuid"] or not params["after"] < change["seq"] <= params["change_seq"]
+                or not (change["kind"] == "node" or change.get("type") == "ROUTE")):
+            continue
+        row = (change["kind"], change["key"], change.get("start"), change.get("end"))
+        if row in rows:
+            continue
+        routes = []
+        start, end = graph.node(row[2], "Location"), graph.node(row[3], "Location")
+        if change["kind"] == "edge" and start is not None and end is not None:
+            routes = [dict(rel) for rel, other in graph.relationships_of(start, {"ROUTE"}, "both") if other is end]
+        rows[row] = {"kind": row[0], "key": row[1], "start": row[2], "end": row[3],
+                     "exists": change["kind"] == "node" and graph.node(row[1], "Location") is not None, "routes": routes}
+    return list(rows.values())
+
+@handles(r"^MATCH \(a:Location \{world_uuid: \$world_uuid\}\)-\[r:ROUTE\]->\(b:Location \{world_uuid: \$world_uuid\}\) RETURN a\.uuid AS start")
+def _route_edges(graph, match, params):
+    return [{"start": rel.start_node["uuid"], "end": rel.end_node["uuid"], "properties": dict(rel)}
+            for rel in _world_routes(graph, params["world_uuid"])]
+
+@handles(r"^CALL db\.labels\(\) YIELD label RETURN label$")
+def _labels(graph, match, params):
+    return [{"label": label} for label, node_ids in sorted(graph.by_label.items()) if node_ids]
+
+# World.list_nodes, one label at a time: the named nodes in (name, uuid) order, then the nameless by uuid
+@handles(r"^MATCH \(n:Node:`(\w+)` \{world_uuid: \$uuid\}\) WHERE (.*) RETURN n \{\.uuid, \.name((?:, \.`\w+`)*)\} AS properties, .* ORDER BY (n\.name, n\.uuid|n\.uuid) LIMIT \$limit$")
+def _list_label_nodes(graph, match, params):
+    label, where, extra, order = match.groups()
+    fields = ["uuid", "name"] + re.findall(r"`(\w+)`", extra or "")
+    named = order.startswith("n.name")
+    rows = []
+    for node in graph.partition(params["uuid"], label):
+        if NODE_LABEL not in node.labels:
+            continue
+        labels = _visible_labels(node)
+        if "head(" in where and (not labels or labels[0] != params["label"]):
+            continue
+        name = node.get("name")
+        if named:
+            if name is None or name < params["from_name"]:
+                continue
+            if "STARTS WITH" in where and not name.startswith(params["prefix"]):
+                continue
+            if "$after_name" in where and not (name > params["after_name"] or node["uuid"] > params["after_uuid"]):
+                continue
+            key = (name, node["uuid"])
+        else:
+            if name is not None or ("$after_uuid" in where and node["uuid"] <= params["after_uuid"]):
+                continue
+            key = (node["uuid"],)
+        rows.append((key, {"properties": {field: node.get(field) for field in fields}, "labels": labels}))
+    rows.sort(key=lambda row: row[0])
+    return [row for _, row in rows[:params["limit"]]]
+
+@handles(r"^MATCH \(n:Node\) WHERE n\.uuid IN \$node_uuids AND n\.world_uuid = \$uuid RETURN n\.uuid AS uuid$")
+def _contained_uuids(graph, match, params):
+    nodes = [graph.node(node_uuid) for node_uuid in set(params["node_uuids"])]
+    return [{"uuid": node["uuid"]} for node in nodes if node is not None and node.get("world_uuid") == params["uuid"]]
+
+@handles(r"^MATCH \(w:World \{uuid: \$world_uuid\}\) OPTIONAL MATCH \(w\)-\[:CONTAINS\]->\(n:Node\) WHERE n\.uuid IN \$batch WITH w, collect\(n\) AS targets .* DETACH DELETE n")
+def _delete_nodes(graph, match, params):
+    world = graph.node(params["world_uuid"], "World")
+    if world is None:
+        return []
+    batch, all_uuids = set(params["batch"]), set(params["all_uuids"])
+    targets = [node for node in graph.contained(world) if node["uuid"] in batch]
+    if targets:
+        graph.bump_version(world)
+
+    def anchors(node):
+        return [other for rel, other in graph.relationships_of(node, None, "both")
+                if rel.type in RELATIONSHIP_COUNTERS and RELATIONSHIP_COUNTERS[rel.type][0] in other.labels]
+    orphans = []
+    if params["cascade"]:
+        candidates = {}
+        for target in targets:
+            for rel, other in graph.relationships_of(target, None, "both"):
+                if (rel.type in RELATIONSHIP_COUNTERS and RELATIONSHIP_COUNTERS[rel.type][0] in target.labels
+                        and other["uuid"] not in all_uuids and graph.contains(world, other)):
+                    candidates[other.id] = other
+        orphans = [node for node in candidates.values() if all(other["uuid"] in all_uuids for other in anchors(node))]
+    removed = []
+    for node in targets + orphans:
+        graph.log_change(world, "node", node["uuid"])
+        removed.append({"uuid": node["uuid"], "labels": _visible_labels(node), "name": node.get("name"),
+                        "relationships": len(graph.outgoing[node.id] | graph.incoming[node.id]),
+                        "orphan": any(node is orphan for orphan in orphans)})
+        graph.delete_node(node)
+    return removed
+
+@handles(r"^CALL \{ MATCH \(n:Node \{world_uuid: \$uuid\}\) RETURN 'node' AS kind")
+def _stream_graph(graph, match, params):
+    members = list(graph.partition(params["uuid"]))
+    member_ids = {node.id for node in members}
+    rows = [{"kind": "node", "id": node["uuid"], "name": node.get("name"), "labels": _visible_labels(node),
+             "from": None, "to": None, "type": None} for node in members]
+    for node in members:
+        for rel, other in graph.relationships_of(node, None, "out"):
+            if other.id in member_ids:
+                rows.append({"kind": "edge", "id": rel.element_id, "name": None, "labels": None,
+                             "from": node["uuid"], "to": other["uuid"], "type": rel.type})
+    return rows
+
+@handles(r"^MATCH \(n:Node \{world_uuid: \$uuid\}\) WITH n, COUNT \{ \(n\)-\[r\]-\(:Node\) WHERE type\(r\) <> 'CONTAINS' \} AS degree")
+def _top_nodes(graph, match, params):
+    degrees = [(sum(1 for rel, other in graph.relationships_of(node, None, "both")
+                    if rel.type != "CONTAINS" and NODE_LABEL in other.labels), node)
+               for node in graph.partition(params["uuid"])]
+    degrees.sort(key=lambda pair: (-pair[0], pair[1].get("name") or ""))
+    return [{"id": node["uuid"], "name": node.get("name"), "labels": _visible_labels(node), "degree": degree}
+            for degree, node in degrees[:params["limit"]]]
+
+@handles(r"^MATCH \(n:Node\)-\[r\]->\(m:Node\) WHERE n\.uuid IN \$uuids AND m\.uuid IN \$uuids AND type\(r\) <> 'CONTAINS'")
+def _edges_among(graph, match, params):
+    members = [graph.node(node_uuid) for node_uuid in params["uuids"]]
+    member_ids = {node.id for node in members if node is not None}
+    return [{"id": rel.element_id, "from": rel.start_node["uuid"], "to": rel.end_node["uuid"], "type": rel.type}
+            for node in members if node is not None
+            for rel, other in graph.relationships_of(node, None, "out")
+            if rel.type != "CONTAINS" and other.id in member_ids]
+
+# app/world_export.py: export reads
+@handles(r"^MATCH \(w:World \{uuid: \$uuid\}\) OPTIONAL MATCH \(u:User\)-\[:OWNS\]->\(w\) RETURN properties\(w\)")
+def _export_world(graph, match, params):
+    world = graph.node(params["uuid"], "World")
+    if world is None:
+        return []
+    owners = [other["uuid"] for rel, other in graph.relationships_of(world, {"OWNS"}, "in") if "User" in other.labels]
+    return [{"properties": dict(world), "labels": _visible_labels(world), "owners": owners}]
+
+@handles(r"^MATCH \(w:World \{uuid: \$uuid\}\)-\[c:CONTAINS\]->\(n:Node\) RETURN n\.uuid AS uuid, .* properties\(c\) AS contains$")
+def _export_nodes(graph, match, params):
+    world = graph.node(params["uuid"], "World")
+    return [{"uuid": node["uuid"], "labels": _visible_labels(node), "properties": dict(node), "contains": dict(rel)}
+            for rel, node in graph.relationships_of(world, {"CONTAINS"}, "out")] if world else []
+
+@handles(r"^MATCH \(w:World \{uuid: \$uuid\}\)-\[:CONTAINS\]->\(n:Node\)-\[r\]->\(m:Node\)<-\[:CONTAINS\]-\(w\) RETURN TYPE\(r\) AS type, n\.uuid AS start")
+def _export_relationships(graph, match, params):
+    world = graph.node(params["uuid"], "World")
+    if world is None:
+        return []
+    members = {node.id for node in graph.contained(world)}
+    return [{"type": rel.type, "start": rel.start_node["uuid"], "end": rel.end_node["uuid"], "properties": dict(rel)}
+            for rel in list(graph.relationships.values())
+            if rel.start_node.id in members and rel.end_node.id in members]
+
+def _merge_node(graph, labels, node_uuid):
+    node = graph.node(node_uuid)
+    if node is None:
+        return graph.create_node(set(labels) | {NODE_LABEL}, {"uuid": node_uuid})
+    for label in labels:
+        node.labels.add(label)
+        graph.by_label[label].add(node.id)
+    return node
+
+# app/world_export.py: import writes
+@handles(r"^MERGE \(w:World:Node \{uuid: \$uuid\}\) SET w \+= \$properties, w\.version = .* MERGE \(owner\)-\[:OWNS\]->\(w\)\)$")
+def _import_world(graph, match, params):
+    world = _merge_node(graph, ["World"], params["uuid"])
+    world.update(params["properties"])
+    graph.bump_version(world)
+    for owner_uuid in params["owners"]:
+        owner = graph.node(owner_uuid, "User")
+        if owner is not None:
+            graph.merge_relationship(owner, world, "OWNS")
+    return []
+
+@handles(r"^MATCH \(w:World \{uuid: \$world_uuid\}\) SET w\.version = .* UNWIND \$batch AS row MERGE \(n:Node \{uuid: row\.uuid\}\) SET n = row\.properties, n\.uuid = row\.uuid, n\.world_uuid = w\.uuid(?:, n:((?:`\w+`:?)+))?")
+def _import_nodes(graph, match, params):
+    world = graph.node(params["world_uuid"], "World")
+    if world is None:
+        return []
+    graph.bump_version(world)
+    labels = re.findall(r"`(\w+)`", match.group(1) or "")
+    for row in params["batch"]:
+        node = _merge_node(graph, labels, row["uuid"])
+        node.clear()
+        node.update(row["properties"], uuid=row["uuid"], world_uuid=world["uuid"])
+        rel = graph.merge_relationship(world, node, "CONTAINS")
+        rel.clear()
+        rel.update(row["contains"])
+    return []
+
+@handles(r"^UNWIND \$batch AS row MATCH \(n:Node \{uuid: row\.start\}\), \(m:Node \{uuid: row\.end\}\) MERGE \(n\)-\[r:`(\w+)`\]->\(m\)")
+def _import_relationships(graph, match, params):
+    written = 0
+    for row in params["batch"]:
+        start, end = graph.node(row["start"]), graph.node(row["end"])
+        if start is None or end is None:
+            continue
+        rel = graph.merge_relationship(start, end, match.group(1))
+        rel.clear()
+        rel.update(row["properties"])
+        written += 1
+    return [{"written": written}]
+
+# app/utils.py Timeline
+@handles(r"^MATCH \(w:World \{uuid: \$world_uuid\}\) CREATE \(w\)-\[:HAS_TIMELINE\]->\(t:Timeline:Node ")
+def _fork(graph, match, params):
+    world = graph.node(params["world_uuid"], "World")
+    if world is None:
+        return []
+    timeline = graph.create_node({"Timeline", NODE_LABEL}, {"uuid": params["uuid"], "name": params["name"],
+                                                            "base_uuid": params["world_uuid"], "created_at": int(time.time() * 1000)})
+    graph.create_relationship(world, timeline, "HAS_TIMELINE")
+    return [{"properties": dict(timeline)}]
+
+@handles(r"^MATCH \(t:Timeline \{uuid: \$uuid\}\)-\[:OVERLAY\]->\(e:TimelineEntry\) (.*)RETURN properties\(e\) AS e$")
+def _timeline_entries(graph, match, params):
+    entries = graph.timeline_entries[params["uuid"]].values()
+    where = match.group(1)
+    if "e.start = $node_uuid" in where:
+        entries = [e for e in entries if e["kind"] == "relationship" and params["node_uuid"] in (e["start"], e["end"])]
+    elif "e.key IN $node_uuids" in where:
+        entries = [e for e in entries if e["kind"] == "node" and e["key"] in params["node_uuids"]]
+    elif "e.key = $key" in where:
+        entries = [e for e in entries if e["key"] == params["key"]]
+    return [{"e": dict(entry)} for entry in entries]
+
+@handles(r"^MATCH \(t:Timeline \{uuid: \$uuid\}\) MERGE \(e:TimelineEntry \{timeline_uuid: \$uuid, key: \$key\}\)")
+def _timeline_write_entry(graph, match, params):
+    timeline = graph.node(params["uuid"], "Timeline")
+    if timeline is None:
+        return []
+    entry = graph.timeline_entries[params["uuid"]].setdefault(params["key"], {"timeline_uuid": params["uuid"], "key": params["key"]})
+    entry.update(params["entry"])
+    graph.bump_version(timeline)
+    return []
+
+@handles(r"^MATCH \(n:Node\) WHERE n\.uuid IN \$node_uuids RETURN n, ")
+def _nodes_by_uuid(graph, match, params):
+    nodes = [graph.node(node_uuid) for node_uuid in params["node_uuids"]]
+    return [{"n": node, "labels": _visible_labels(node)} for node in nodes if node is not None]
+
+@handles(r"^MATCH \(n:Node \{world_uuid: \$base_uuid\}\) WHERE n\.uuid IN \$node_uuids RETURN n, ")
+def _world_nodes_by_uuid(graph, match, params):
+    nodes = [graph.node(node_uuid) for node_uuid in params["node_uuids"]]
+    return [{"n": node, "labels": _visible_labels(node)} for node in nodes
+            if node is not None and node.get("world_uuid") == params["base_uuid"]]
+
+@handles(r"^MATCH \(n:Node \{uuid: \$uuid, world_uuid: \$base_uuid\}\) RETURN n, ")
+def _world_node_by_uuid(graph, match, params):
+    node = graph.node(params["uuid"])
+    return [{"n": node, "labels": _visible_labels(node)}] if node and node.get("world_uuid") == params["base_uuid"] else []
+
+@handles(r"^MATCH \(n:Node \{uuid: \$uuid\}\) RETURN n, ")
+def _node_by_uuid(graph, match, params):
+    node = graph.node(params["uuid"])
+    return [{"n": node, "labels": _visible_labels(node)}] if node else []
+
+@handles(r"^MATCH \(a:Node \{uuid: \$start, world_uuid: \$base_uuid\}\)-\[r:`(\w+)`\]->\(b:Node \{uuid: \$end, world_uuid: \$base_uuid\}\) RETURN properties\(r\) AS properties$")
+def _relationship_properties(graph, match, params):
+    start, end = graph.node(params["start"]), graph.node(params["end"])
+    if start is None or end is None or not start.get("world_uuid") == end.get("world_uuid") == params["base_uuid"]:
+        return []
+    return [{"properties": dict(rel)} for rel, other in graph.relationships_of(start, {match.group(1)}, "out") if other is end][:1]
+
+@handles(r"^MATCH \(u:User\)-\[:OWNS\]->\(w:World \{uuid: \$uuid\}\) RETURN u\.uuid AS uuid$")
+def _world_owners(graph, match, params):
+    world = graph.node(params["uuid"], "World")
+    return [{"uuid": other["uuid"]} for rel, other in graph.relationships_of(world, {"OWNS"}, "in")] if world else []
+
+@handles(r"^MATCH \(t:Timeline \{uuid: \$uuid\}\) OPTIONAL MATCH \(t\)-\[:OVERLAY\]->\(e:TimelineEntry\) DETACH DELETE e, t$")
+def _discard_timeline(graph, match, params):
+    graph.timeline_entries.pop(params["uuid"], None)
+    timeline = graph.node(params["uuid"], "Timeline")
+    if timeline is not None:
+        graph.delete_node(timeline)
+    return []
+
+@handles(r"^MATCH \(\)-\[r\]->\(\) WHERE elementId\(r\) = \$rel_id SET r \+= \$rel_properties SET r\.type = \$rel_type RETURN startNode")
+def _update_relationship(graph, match, params):
+    rel = graph.relationships.get(int(params["rel_id"]))
+    if rel is None:
+        return []
+    rel.update(params["rel_properties"])
+    rel["type"] = params["rel_type"]
+    return [{"start": rel.start_node["uuid"], "end": rel.end_node["uuid"], "type": rel.type}]
+
+@handles(r"^MATCH \(a\)-\[r\]->\(b\) WHERE elementId\(r\) = \$rel_id WITH a, b, r, TYPE\(r\) AS rel_type DELETE r ")
+def _delete_relationship(graph, match, params):
+    rel = graph.relationships.get(int(params["rel_id"]))
+    if rel is None:
+        return []
+    graph.delete_relationship(rel)
+    return [{"start": rel.start_node["uuid"], "end": rel.end_node["uuid"], "rel_type": rel.type}]
+
+@handles(r"^MATCH \(w:World \{uuid: \$uuid\}\) RETURN coalesce\(w\.change_seq, 0\) AS change_seq")
+def _change_position(graph, match, params):
+    world = graph.node(params["uuid"], "World")
+    return [{"change_seq": world.get("change_seq", 0), "pruned_to": world.get("changes_pruned_to", 0)}] if world else []
+
+@handles(r"^MATCH \(c:WorldChange \{world_uuid: \$uuid\}\) WHERE c\.seq > \$after")
+def _world_changes(graph, match, params):
+    world = graph.node(params["uuid"], "World")
+    entries = [change for change in graph.changes
+               if change["world_uuid"] == params["uuid"] and change["seq"] > params["after"]][:params["limit"]]
+    rows = []
+    for change in entries:
+        node = graph.node(change["key"]) if change["kind"] == "node" else None
+        node = node if node is not None and world is not None and graph.contains(world, node) else None
+        rel_ids = []
+        if change["kind"] == "edge":
+            start, end = graph.node(change["start"]), graph.node(change["end"])
+            if start is not None and end is not None:
+                rel_ids = [rel.element_id for rel, other in graph.relationships_of(start, {change["type"]}, "out")
+                           if other is end]
+        rows.append({"seq": change["seq"], "kind": change["kind"], "key": change["key"], "added": change["added"],
+                     "start": change.get("start"), "end": change.get("end"), "type": change.get("type"),
+                     "rel_id": change.get("rel_id"), "exists": node is not None,
+                     "name": node.get("name") if node else None, "labels": _visible_labels(node) if node else [],
+                     "rel_ids": rel_ids})
+    return rows
+
+@handles(r"^MATCH \(w:World \{uuid: \$uuid\}\) WITH w, coalesce\(w\.change_seq, 0\) \+ 1 AS change_seq SET w\.change_seq = change_seq, w\.changes_pruned_to = change_seq$")
+def _reset_changes(graph, match, params):
+    world = graph.node(params["uuid"], "World")
+    if world is not None:
+        world["change_seq"] = world["changes_pruned_to"] = world.get("change_seq", 0) + 1
+    return []
+
+@handles(r"^MATCH \(w:World \{uuid: \$uuid\}\) WITH w, coalesce\(w\.change_seq, 0\) - \$keep AS cutoff")
+def _prune_changes(graph, match, params):
+    world = graph.node(params["uuid"], "World")
+    if world is None:
+        return []
+    cutoff = max(world.get("change_seq", 0) - params["keep"], world.get("changes_pruned_to", 0))
+    world["changes_pruned_to"] = cutoff
+    kept = [change for change in graph.changes if change["world_uuid"] != world["uuid"] or change["seq"] > cutoff]
+    pruned = len(graph.changes) - len(kept)
+    graph.changes = kept
+    return [{"pruned": pruned}]
+
+# Full-text search: every word has to start a word of one of the searched properties;
+# name matches score double, as the real query boosts them
+@handles(r"^CALL db\.index\.fulltext\.queryNodes\(\$index, \$search, \{limit: \$candidates\}\) YIELD node, score (?:WHERE (.*) )?RETURN")
+def _search_nodes(graph, match, params):
+    world_uuid = re.search(r'world_uuid:"((?:[^"\\]|\\.)*)"', params["search"]).group(1).replace("\\", "")
+    words = [word.replace("\\", "") for word in re.findall(r"\(\w+:\(((?:[^ \\]|\\.)+) OR", params["search"])]
+    fields = sorted(set(re.findall(r"(\w+):\(", params["search"])))
+    labels = set(re.findall(r"node:`(\w+)`", match.group(1) or ""))
+    rows = []
+    for node in graph.partition(world_uuid):
+        score = 0.0
+        for word in words:
+            hits = [field for field in fields
+                    if any(token.startswith(word) for token in re.findall(r"\w+", str(node.get(field) or "").lower()))]
+            if not hits:
+                break
+            score += sum(2.0 if field == "name" else 1.0 for field in hits)
+        else:
+            if not labels or labels & node.labels:
+                rows.append({"uuid": node["uuid"], "name": node.get("name"), "labels": _visible_labels(node), "score": score})
+    rows.sort(key=lambda row: -row["score"])
+    return rows[:params["limit"]]
+
+@handles(r"^MATCH \(n:Node \{world_uuid: \$uuid\}\) WHERE n\.name IS NOT NULL RETURN n\.uuid AS uuid, n\.name AS name")
+def _world_names(graph, match, params):
+    return [{"uuid": node["uuid"], "name": node["name"], "labels": _visible_labels(node)}
+            for node in graph.partition(params["uuid"]) if node.get("name") is not None]
+
+@handles(r"^MATCH \(n:Node \{world_uuid: \$uuid\}\) WHERE ((?:n:\w+(?: OR )?)+) RETURN n\.uuid AS uuid, n\.name AS name, n:Faction AS faction, \[\(n\)-\[r:([\w|]+)\]->")
+def _social_rows(graph, match, params):
+    labels = set(re.findall(r"n:(\w+)", match.group(1)))
+    types = set(match.group(2).split("|"))
+    rows = []
+    for node in graph.partition(params["uuid"]):
+        if labels & node.labels:
+            rows.append({"uuid": node["uuid"], "name": node.get("name"), "faction": "Faction" in node.labels,
+                         "outgoing": [[other["uuid"], rel.type] for rel, other in graph.relationships_of(node, types)
+                                      if other.get("world_uuid") == params["uuid"]]})
+    return rows
+
+@handles(r"^MATCH \(w:World \{uuid: \$uuid\}\) RETURN coalesce\(w\.population, 0\) AS population, w\.pop_limit AS pop_limit$")
+def _population(graph, match, params):
+    world = graph.node(params["uuid"], "World")
+    return [{"population": world.get("population", 0), "pop_limit": world.get("pop_limit")}] if world else []
+
+@handles(r"^MATCH \(n:(\w+) \{world_uuid: \$uuid\}\) WITH n, COUNT \{ \(n\)-\[:(\w+)\]-\(\) \} AS actual WHERE n\.(\w+) IS NULL")
+def _reconcile_relationship_counter(graph, match, params):
+    label, rel_type, name = match.groups()
+    repaired = 0
+    for node in graph.partition(params["uuid"], label):
+        actual = sum(1 for _ in graph.relationships_of(node, {rel_type}, "both"))
+        if node.get(name) != actual:
+            node[name] = actual
+            repaired += 1
+    return [{"repaired": repaired}]
+
+@handles(r"^MATCH \(w:World \{uuid: \$uuid\}\) WITH w, COUNT \{ \(w\)-\[:CONTAINS\]->\(:(\w+)\) \} AS actual")
+def _reconcile_population(graph, match, params):
+    world = graph.node(params["uuid"], "World")
+    if world is None:
+        return [{"repaired": 0}]
+    actual = sum(1 for _ in graph.contained(world, match.group(1)))
+    if world.get("population") == actual:
+        return [{"repaired": 0}]
+    world["population"] = actual
+    return [{"repaired": 1}]
+
+class StandInTransaction:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def run(self, query, parameters=None, **kwargs):
+        return self.driver.execute(query, {**(parameters or {}), **kwargs})
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+class StandInSession(StandInTransaction):
+    def begin_transaction(self, **kwargs):
+        return StandInTransaction(self.driver)
+
+    # Managed transactions: no cluster and no transient errors, so no routing or retries
+    def execute_read(self, work, *args, **kwargs):
+        return work(StandInTransaction(self.driver), *args, **kwargs)
+
+    def execute_write(self, work, *args, **kwargs):
+        return work(StandInTransaction(self.driver), *args, **kwargs)
+
+    def last_bookmarks(self):
+        return None
+
+# Drop-in for neo4j's Driver: pass it to NODE methods, create_app_routes, etc.
+class StandInDriver:
+    def __init__(self, graph=None, latency=0.0):
+        self.graph = graph or Graph()
+        self.latency = latency
+        self.queries = 0
+
+    def session(self, **kwargs):
+        return StandInSession(self)
+
+    def execute(self, query, params):
+        text = " ".join(query.split())
+        for pattern, handler in _handlers:
+            match = pattern.search(text)
+            if match:
+                self.queries += 1
+                if self.latency:
+                    time.sleep(self.latency)
+                with self.graph.lock:
+                    return StandInResult(text, handler(self.graph, match, params))
+        raise NotImplementedError(f"Graph stand-in has no handler for query: {text}")
+
+    def verify_connectivity(self):
+        pass
+
+    def close(self):
+        pass
@@ -0,0 +1,69 @@
+from collections import namedtuple
+import json
+import math
+import time
+
+from app.instrumentation import metrics
+
+Result = namedtuple("Result", "name ops seconds p50 p90 p99 max queries_per_op")
+
+# Queries completed so far, from the same counters /metrics serves
+def _query_count():
+    with metrics._lock:
+        return sum(histogram.total for histogram in metrics.latency.values()) + sum(metrics.errors.values())
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank percentile
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+def run_scenario(scenario, context, rng, iterations, warmup):
+    for _ in range(warmup):
+        scenario.fn(context, rng)
+    queries_before = _query_count()
+    timings = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        scenario.fn(context, rng)
+        timings.append(time.perf_counter() - start)
+    elapsed = time.perf_counter() - started
+    timings.sort()
+    return Result(scenario.name, iterations, elapsed,
+                  percentile(timings, 0.50), percentile(timings, 0.90), percentile(timings, 0.99),
+                  timings[-1] if timings else 0.0,
+                  (_query_count() - queries_before) / iterations if iterations else 0.0)
+
+def format_table(results, baseline=None, tolerance=0.2):
+    header = f"{'scenario':<44} {'ops':>6} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9} {'ops/s':>9} {'q/op':>7}"
+    lines = [header, "-" * len(header)]
+    for result in results:
+        throughput = result.ops / result.seconds if result.seconds else 0.0
+        line = (f"{result.name:<44} {result.ops:>6} {result.p50 * 1000:>9.3f} {result.p90 * 1000:>9.3f} "
+                f"{result.p99 * 1000:>9.3f} {result.max * 1000:>9.3f} {throughput:>9.1f} {result.queries_per_op:>7.1f}")
+        flag = regression(result, baseline, tolerance)
+        lines.append(line + (f"  {flag}" if flag else ""))
+    return "\n".join(lines)
+
+# Compare against a previous --json run: slower p50/p90 or more queries per op beyond tolerance
+def regression(result, baseline, tolerance=0.2):
+    if not baseline or result.name not in baseline:
+        return None
+    before = baseline[result.name]
+    problems = []
+    for key in ("p50", "p90"):
+        if before[key] and getattr(result, key) > before[key] * (1 + tolerance):
+            problems.append(f"{key} +{(getattr(result, key) / before[key] - 1) * 100:.0f}%")
+    if result.queries_per_op > before["queries_per_op"] + 1e-9:
+        problems.append(f"q/op {before['queries_per_op']:.1f}->{result.queries_per_op:.1f}")
+    return "REGRESSION " + ", ".join(problems) if problems else None
+
+def save_json(path, results, settings):
+    with open(path, "w") as f:
+        json.dump({"settings": settings, "results": {result.name: result._asdict() for result in results}}, f, indent=2)
+
+def load_json(path):
+    with open(path) as f:
+        return json.load(f)["results"]
@@ -0,0 +1,163 @@
+from collections import namedtuple
+import random
+
+from flask import Flask
+
+from app.routes import create_app_routes
+from app.utils import NODE, Character, Location, World
+from app.write_buffer import RelationshipWriteBuffer
+
+# A scenario is one operation, run repeatedly by report.run_scenario.
+# fn(context, rng) -> None; `writes` scenarios change the world, so they run after the reads.
+Scenario = namedtuple("Scenario", "name fn writes")
+
+# Everything a scenario needs: the driver, the generated world and a Flask test client
+class BenchContext:
+    def __init__(self, driver, spec):
+        self.driver = driver
+        self.spec = spec
+        self.client = make_client(driver, spec)
+
+def make_client(driver, spec):
+    app = Flask(__name__)
+    app.secret_key = "benchmark"
+    app.register_blueprint(create_app_routes(driver))
+    client = app.test_client()
+    with client.session_transaction() as flask_session:
+        flask_session["user_id"] = spec.user.uuid
+    return client
+
+def _check(response):
+    if response.status_code >= 400:
+        raise RuntimeError(f"{response.request.path} returned {response.status_code}")
+
+# app/utils.py APIs, called with the driver directly
+def from_database(context, rng):
+    NODE.from_database(context.driver, rng.choice(context.spec.characters))
+
+def get_nodes(context, rng):
+    context.spec.world.get_nodes(context.driver)
+
+def get_edges(context, rng):
+    context.spec.world.get_edges(context.driver)
+
+def find_nodes_by_label_and_properties(context, rng):
+    context.spec.world.find_nodes_by_label_and_properties(
+        context.driver, "Character", {"name": f"Character {rng.randrange(len(context.spec.characters))}"})
+
+def get_occupants(context, rng):
+    Location(uuid=rng.choice(context.spec.locations)).get_occupants(context.driver)
+
+def find_routes_to(context, rng):
+    start, end = rng.sample(context.spec.locations, 2)
+    Location(uuid=start).find_routes_to(context.driver, end, max_depth=6, criteria={"distance": {}, "danger": {"max": 40}}, k=3)
+
+def distance_to(context, rng):
+    start, end = rng.sample(context.spec.locations, 2)
+    Location(uuid=start).distance_to(context.driver, end, "distance")
+
+MEMBERSHIPS_PER_OP = 50
+
+def _memberships(context, rng):
+    return [(rng.choice(context.spec.characters), rng.choice(context.spec.factions)) for _ in range(MEMBERSHIPS_PER_OP)]
+
+def join_faction(context, rng):
+    for character_uuid, faction_uuid in _memberships(context, rng):
+        Character(uuid=character_uuid).join_faction(context.driver, faction_uuid, properties={"rank": rng.randrange(5)})
+
+def join_faction_buffered(context, rng):
+    with RelationshipWriteBuffer(context.driver) as buffered:
+        for character_uuid, faction_uuid in _memberships(context, rng):
+            Character(uuid=character_uuid).join_faction(buffered, faction_uuid, properties={"rank": rng.randrange(5)})
+
+def bulk_create_nodes(context, rng):
+    World(uuid=context.spec.world.uuid).bulk_create_nodes(
+        context.driver, "Item", [{"name": f"Item {rng.randrange(10**6)}", "value": rng.randrange(100)} for _ in range(100)])
+
+# Flask routes through the test client, so each op includes the unit of work and rendering
+def route_enter_world(context, rng):
+    _check(context.client.get(f"/enter_world/{context.spec.world.uuid}"))
+
+def route_edit_world(context, rng):
+    _check(context.client.get(f"/world/{context.spec.world.uuid}/edit"))
+
+def route_world_graph_stream(context, rng):
+    response = context.client.get(f"/world/{context.spec.world.uuid}/graph.ndjson")
+    _check(response)
+    response.get_data()
+
+def route_world_summary(context, rng):
+    _check(context.client.get(f"/world/{context.spec.world.uuid}/summary"))
+
+def route_neighbourhood(context, rng):
+    _check(context.client.get(f"/world/{context.spec.world.uuid}/neighbourhood/{rng.choice(context.spec.characters)}?depth=2"))
+
+def route_world_nodes_page(context, rng):
+    _check(context.client.get(f"/world/{context.spec.world.uuid}/nodes?label=Character&prefix=Character%20{rng.randrange(10)}"))
+
+def route_search(context, rng):
+    _check(context.client.get(f"/world/{context.spec.world.uuid}/search?q=character%20{rng.randrange(100)}"))
+
+def route_autocomplete(context, rng):
+    _check(context.client.get(f"/world/{context.spec.world.uuid}/autocomplete?q=char"))
+
+def route_world_report(context, rng):
+    _check(context.client.get(f"/world/{context.spec.world.uuid}/report"))
+
+def route_social(context, rng):
+    _check(context.client.get(f"/world/{context.spec.world.uuid}/social"))
+
+def route_update_node(context, rng):
+    _check(context.client.post(f"/world/{context.spec.world.uuid}/update_node", json={
+        "node_id": rng.choice(context.spec.characters),
+        "node_name": f"Character {rng.randrange(10**6)}",
+        "node_properties": {"mood": rng.choice(["calm", "angry", "curious"])},
+    }))
+
+def route_create_relationship(context, rng):
+    node1, node2 = rng.sample(context.spec.characters, 2)
+    _check(context.client.post(f"/world/{context.spec.world.uuid}/create_relationship", json={
+        "node1": node1, "node2": node2, "rel_type": "KNOWS", "rel_properties": {"since": rng.randrange(1000)},
+    }))
+
+def route_create_node_modal(context, rng):
+    _check(context.client.post(f"/world/{context.spec.world.uuid}/create_node_modal", json={
+        "node_type": "Character", "node_name": f"Newcomer {rng.randrange(10**6)}", "properties": {"age": rng.randrange(16, 90)},
+    }))
+
+SCENARIOS = [
+    Scenario("utils.from_database", from_database, False),
+    Scenario("utils.get_nodes", get_nodes, False),
+    Scenario("utils.get_edges", get_edges, False),
+    Scenario("utils.find_nodes_by_label_and_properties", find_nodes_by_label_and_properties, False),
+    Scenario("utils.get_occupants", get_occupants, False),
+    Scenario("utils.find_routes_to", find_routes_to, False),
+    Scenario("utils.distance_to", distance_to, False),
+    Scenario("route.enter_world", route_enter_world, False),
+    Scenario("route.edit_world", route_edit_world, False),
+    Scenario("route.world_graph_stream", route_world_graph_stream, False),
+    Scenario("route.world_summary", route_world_summary, False),
+    Scenario("route.neighbourhood_depth2", route_neighbourhood, False),
+    Scenario("route.world_nodes_page", route_world_nodes_page, False),
+    Scenario("route.search", route_search, False),
+    Scenario("route.autocomplete", route_autocomplete, False),
+    Scenario("route.world_report", route_world_report, False),
+    Scenario("route.social", route_social, False),
+    Scenario(f"utils.join_faction_x{MEMBERSHIPS_PER_OP}", join_faction, True),
+    Scenario(f"utils.join_faction_x{MEMBERSHIPS_PER_OP}_buffered", join_faction_buffered, True),
+    Scenario("utils.bulk_create_nodes_x100", bulk_create_nodes, True),
+    Scenario("route.update_node", route_update_node, True),
+    Scenario("route.create_relationship", route_create_relationship, True),
+    Scenario("route.create_node_modal", route_create_node_modal, True),
+]
+
+def select(patterns=None, reads_only=False):
+    chosen = [scenario for scenario in SCENARIOS
+              if not patterns or any(pattern in scenario.name for pattern in patterns)]
+    if reads_only:
+        chosen = [scenario for scenario in chosen if not scenario.writes]
+    # Reads first, so they all see the world as generated
+    return sorted(chosen, key=lambda scenario: scenario.writes)
+
+def seeded_rng(seed, name):
+    return random.Random(f"{seed}:{name}")
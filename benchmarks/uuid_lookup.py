@@ -0,0 +1,76 @@
+from neo4j import GraphDatabase
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.schema import bootstrap_schema
+from app.utils import NODE_LABEL
+from dotenv import load_dotenv
+
+# Compares the old unlabelled uuid lookup against the :Node index lookup.
+# Seeds throwaway :BenchLookup nodes, so point it at a scratch database.
+load_dotenv()
+
+uri = os.getenv("NEO4J_URI")
+username = os.getenv("NEO4J_USERNAME")
+password = os.getenv("NEO4J_PASSWORD")
+
+SIZES = [10000, 100000]
+LOOKUPS = 200
+SEED_BATCH = 10000
+
+BEFORE_QUERY = "MATCH (n) WHERE n.uuid = $uuid RETURN labels(n) AS labels, n"
+AFTER_QUERY = f"MATCH (n:{NODE_LABEL} {{uuid: $uuid}}) RETURN labels(n) AS labels, n"
+
+def seed(driver, count):
+    uuids = [str(uuid.uuid4()) for _ in range(count)]
+    with driver.session() as session:
+        for start in range(0, count, SEED_BATCH):
+            session.run(f"""
+                UNWIND $uuids AS id
+                CREATE (n:BenchLookup:{NODE_LABEL} {{uuid: id, name: 'bench'}})
+            """, uuids=uuids[start:start + SEED_BATCH])
+    return uuids
+
+def cleanup(driver):
+    with driver.session() as session:
+        session.run("""
+            MATCH (n:BenchLookup)
+            CALL { WITH n DETACH DELETE n } IN TRANSACTIONS OF 10000 ROWS
+        """)
+
+def time_lookups(driver, query, uuids):
+    timings = []
+    with driver.session() as session:
+        for node_uuid in random.sample(uuids, min(LOOKUPS, len(uuids))):
+            start = time.perf_counter()
+            session.run(query, uuid=node_uuid).single()
+            timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "mean": statistics.mean(timings),
+        "p50": timings[len(timings) // 2],
+        "p95": timings[int(len(timings) * 0.95) - 1],
+    }
+
+def report(name, stats):
+    print(f"  {name:<7} mean {stats['mean']:8.2f} ms   p50 {stats['p50']:8.2f} ms   p95 {stats['p95']:8.2f} ms")
+
+if __name__ == '__main__':
+    driver = GraphDatabase.driver(uri, auth=(username, password))
+    bootstrap_schema(driver)
+    try:
+        for size in SIZES:
+            cleanup(driver)
+            uuids = seed(driver, size)
+            print(f"{size} nodes, {LOOKUPS} lookups")
+            report("before", time_lookups(driver, BEFORE_QUERY, uuids))
+            report("after", time_lookups(driver, AFTER_QUERY, uuids))
+    finally:
+        cleanup(driver)
+        driver.close()
@@ -0,0 +1,20 @@
+from neo4j import GraphDatabase
+import os
+from app.schema import bootstrap_schema
+
+# Load environment variables
+from dotenv import load_dotenv
+load_dotenv()
+
+# Creates the uuid constraints/indexes and backfills the shared :Node label and the
+# world_uuid partition property.
+# Safe to run repeatedly; main.py also runs it on startup.
+uri = os.getenv("NEO4J_URI")
+username = os.getenv("NEO4J_USERNAME")
+password = os.getenv("NEO4J_PASSWORD")
+
+if __name__ == '__main__':
+    driver = GraphDatabase.driver(uri, auth=(username, password))
+    bootstrap_schema(driver)
+    driver.close()
+    print("Schema bootstrap complete")
@@ -0,0 +1,26 @@
+import argparse
+import logging
+import os
+import time
+from app.database import get_driver
+from app.world_export import export_world
+
+# Load environment variables
+from dotenv import load_dotenv
+load_dotenv()
+
+# Writes one world (everything it CONTAINS and the relationships among them) to a
+# compressed JSON-lines file: see app/world_export.py for the format.
+# Usage: python export_world.py WORLD_UUID world.jsonl.zst
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export a world to a .jsonl.zst file")
+    parser.add_argument("world_uuid")
+    parser.add_argument("path")
+    parser.add_argument("--level", type=int, default=3, help="zstd compression level")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING"))
+    start = time.perf_counter()
+    counts = export_world(get_driver(), args.world_uuid, args.path, level=args.level)
+    print(f"Exported {counts['nodes']} nodes and {counts['relationships']} relationships "
+          f"to {args.path} ({os.path.getsize(args.path)} bytes) in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,34 @@
+import argparse
+import logging
+import os
+import time
+from app.database import get_driver
+from app.schema import bootstrap_schema
+from app.world_export import IMPORT_BATCH_SIZE, import_world
+
+# Load environment variables
+from dotenv import load_dotenv
+load_dotenv()
+
+# Loads a file written by export_world.py. By default uuids are kept, so importing into
+# the same database updates the world in place (a restore). --remap KEY gives every node
+# a new uuid derived from KEY instead, for a copy next to the original; re-running with
+# the same KEY picks up an interrupted import.
+# Usage: python import_world.py world.jsonl.zst [--remap KEY] [--owner USER_UUID] [--name NAME]
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Import a world from a .jsonl.zst file")
+    parser.add_argument("path")
+    parser.add_argument("--remap", metavar="KEY", help="give the copy new uuids derived from KEY")
+    parser.add_argument("--owner", metavar="USER_UUID", help="also make this user an owner")
+    parser.add_argument("--name", help="rename the imported world")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING"))
+    driver = get_driver()
+    bootstrap_schema(driver)
+    start = time.perf_counter()
+    result = import_world(driver, args.path, remap_key=args.remap, owner_uuid=args.owner,
+                          name=args.name, batch_size=args.batch_size)
+    print(f"Imported world {result['world_uuid']}: {result['nodes']} nodes, "
+          f"{result['relationships']} relationships in {time.perf_counter() - start:.1f}s")
@@ -1,22 +1,26 @@
 from flask import Flask
-from neo4j import GraphDatabase
+import logging
 import os
 from app.routes import create_app_routes  # Importing routes from the app folder
 from app.utils import wipe_neo4j_database
+from app.schema import bootstrap_schema
+from app.database import get_driver
 
 # Load environment variables
 from dotenv import load_dotenv
 load_dotenv()
 
-# Initialize the Neo4j driver
-uri = os.getenv("NEO4J_URI")
-username = os.getenv("NEO4J_USERNAME")
-password = os.getenv("NEO4J_PASSWORD")
+# Debug output is level-gated; set LOG_LEVEL=DEBUG to see per-write logging
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING"), format="%(asctime)s %(levelname)s %(name)s %(message)s")
 
-driver = GraphDatabase.driver(uri, auth=(username, password))
+# One pooled, warmed-up driver for the whole process (pool settings: see app/database.py)
+driver = get_driver()
 #wipe database
 #wipe_neo4j_database(driver)
 
+# Make sure the uuid constraints and lookup label exist before serving requests
+bootstrap_schema(driver)
+
 # Create and configure the Flask app
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "supersecretkey")
@@ -0,0 +1,28 @@
+import argparse
+import logging
+import os
+import time
+from app.database import get_driver
+from app.transactions import read_records
+from app.utils import World
+
+# Load environment variables
+from dotenv import load_dotenv
+load_dotenv()
+
+# Recomputes the maintained counters (occupant_count, member_count, population) of one
+# world, or of every world, and repairs any that drifted. Safe to run at any time.
+# Usage: python reconcile_counters.py [WORLD_UUID ...]
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Repair the maintained counters of worlds")
+    parser.add_argument("world_uuids", nargs="*", help="worlds to reconcile (default: all)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING"))
+    driver = get_driver()
+    world_uuids = args.world_uuids or [record["uuid"] for record in read_records(driver, "MATCH (w:World) RETURN w.uuid AS uuid")]
+    start = time.perf_counter()
+    for world_uuid in world_uuids:
+        repaired = World(uuid=world_uuid).reconcile_counters(driver)
+        print(f"{world_uuid}: " + ", ".join(f"{count} {name}" for name, count in repaired.items()) + " repaired")
+    print(f"Reconciled {len(world_uuids)} worlds in {time.perf_counter() - start:.1f}s")